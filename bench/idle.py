@@ -0,0 +1,97 @@
+"""Measures the server memory held by idle WebSocket connections
+
+Each endpoint is served by a fresh server from bench/server.py, which is sent
+a single message per connection before the connections are left idle.
+
+Usage:
+  python3 bench/idle.py [--endpoints echo,lean] [--connections 2000]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websocket import (
+    SERVER,
+    free_port,
+    open_clients,
+    rss_kib,
+    wait_for_server,
+)
+
+ARGS = argparse.ArgumentParser(description="Measure memory of idle Vase WebSocket connections.")
+ARGS.add_argument(
+    '--endpoints', action="store", dest='endpoints', default='echo,lean',
+    help='comma separated endpoints of bench/server.py to measure')
+ARGS.add_argument(
+    '--connections', action="store", dest='connections', type=int, default=2000,
+    help='number of idle connections')
+ARGS.add_argument(
+    '--settle', action="store", dest='settle', type=float, default=1.0,
+    help='seconds to wait before the memory is measured')
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+@asyncio.coroutine
+def measure(endpoint, args, loop):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, SERVER, '--port', str(port)])
+    url = 'ws://127.0.0.1:{}'.format(port)
+    try:
+        yield from wait_for_server(url, loop)
+        yield from asyncio.sleep(args.settle, loop=loop)
+        baseline = rss_kib(server.pid)
+        started = time.perf_counter()
+        clients = yield from open_clients(url + '/' + endpoint, args.connections, loop)
+        elapsed = time.perf_counter() - started
+        for client in clients:
+            client.send('hello')
+            yield from client.recv()
+        yield from asyncio.sleep(args.settle, loop=loop)
+        rss = rss_kib(server.pid)
+        for client in clients:
+            yield from client.close()
+    finally:
+        server.terminate()
+        server.wait()
+    return elapsed, baseline, rss
+
+
+@asyncio.coroutine
+def run(args, loop):
+    print('{:>10} {:>12} {:>12} {:>14}'.format('endpoint', 'conns/s', 'RSS MiB', 'bytes/conn'))
+    for endpoint in args.endpoints.split(','):
+        elapsed, baseline, rss = yield from measure(endpoint, args, loop)
+        per_connection = 'n/a'
+        if baseline is not None and rss is not None:
+            per_connection = '{:.0f}'.format((rss - baseline) * 1024 / args.connections)
+        print('{:>10} {:>12.0f} {:>12.1f} {:>14}'.format(
+            endpoint, args.connections / elapsed, (rss or 0) / 1024, per_connection))
+
+
+def main():
+    args = ARGS.parse_args()
+    # the server inherits the limit, it holds one descriptor per connection as well
+    limit = raise_fd_limit()
+    if args.connections + 64 > limit:
+        raise SystemExit('at most {} connections are allowed by RLIMIT_NOFILE'.format(limit - 64))
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run(args, loop))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Compares WebSocket masking backends across payload sizes
+
+Usage:
+  python3 bench/masking.py [--sizes 16,1024,1048576] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vase.masking import BACKENDS
+
+ARGS = argparse.ArgumentParser(description="Benchmark WebSocket masking backends.")
+ARGS.add_argument(
+    '--sizes', action="store", dest='sizes', default='16,125,1024,65536,1048576',
+    help='comma separated payload sizes in bytes')
+ARGS.add_argument(
+    '--repeat', action="store", dest='repeat', type=int, default=5,
+    help='number of timing rounds, the best one is reported')
+
+
+def bench(func, payload, mask, repeat):
+    number = max(1, 2**20 // max(len(payload), 1))
+    if func is BACKENDS['python']:
+        number = max(1, number // 32)
+    best = min(timeit.repeat(lambda: func(payload, mask), number=number, repeat=repeat))
+    return best / number
+
+
+def main():
+    args = ARGS.parse_args()
+    sizes = [int(x) for x in args.sizes.split(',')]
+    mask = os.urandom(4)
+    names = sorted(BACKENDS)
+
+    print('{:>10} '.format('size') + ' '.join('{:>14}'.format(name) for name in names))
+    for size in sizes:
+        payload = os.urandom(size)
+        expected = BACKENDS['python'](payload, mask)
+        row = []
+        for name in names:
+            func = BACKENDS[name]
+            assert func(payload, mask) == expected, name
+            row.append('{:>11.2f} us'.format(bench(func, payload, mask, args.repeat) * 1e6))
+        print('{:>10} '.format(size) + ' '.join(row))
+
+
+if __name__ == '__main__':
+    main()
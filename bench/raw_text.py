@@ -0,0 +1,79 @@
+"""Measures what `raw_text` saves when text messages are relayed
+
+Every message is parsed from its frames and its reply frame is built with
+`WebSocketWriter.prepare()`, the way an endpoint relaying messages works.
+Text is validated by decoding it in both modes, raw mode saves the encoding
+of the reply and joining the parts of fragmented messages. Encoding ASCII is
+little more than a copy, so the savings show with non-ASCII text.
+
+Usage:
+  python3 bench/raw_text.py [--sizes 64,4096,65536] [--fragments 1] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vase.websocket import (
+    FrameBuilder,
+    WebSocketParser,
+    WebSocketWriter,
+)
+
+ARGS = argparse.ArgumentParser(description="Benchmark relaying text messages with and without raw_text.")
+ARGS.add_argument(
+    '--sizes', action="store", dest='sizes', default='64,4096,65536',
+    help='comma separated message sizes in characters')
+ARGS.add_argument(
+    '--fragments', action="store", dest='fragments', type=int, default=1,
+    help='number of frames every message is split into')
+ARGS.add_argument(
+    '--repeat', action="store", dest='repeat', type=int, default=5,
+    help='number of timing rounds, the best one is reported')
+
+TEXTS = {
+    'ascii': 'x',
+    'cyrillic': 'ы',
+}
+
+
+def build_frames(text, fragments):
+    step = max(1, len(text) // fragments)
+    parts = [text[i:i + step] for i in range(0, len(text), step)]
+    # unmasked, so that unmasking does not dominate the timings
+    data = FrameBuilder.text(parts[0], fin=len(parts) == 1, masked=False)
+    for i, part in enumerate(parts[1:], 2):
+        data += FrameBuilder.continuation(part, fin=i == len(parts), masked=False)
+    return data
+
+
+def bench(data, raw_text, repeat):
+    parser = WebSocketParser(None, raw_text=raw_text, masked=False)
+    writer = WebSocketWriter(None)
+
+    def relay():
+        for message in parser.feed(data):
+            writer.prepare(message.payload)
+
+    number = max(1, 2**20 // len(data))
+    return min(timeit.repeat(relay, number=number, repeat=repeat)) / number
+
+
+def main():
+    args = ARGS.parse_args()
+    sizes = [int(x) for x in args.sizes.split(',')]
+
+    print('{:>10} {:>10} {:>14} {:>14} {:>8}'.format('text', 'size', 'decoded', 'raw', 'saved'))
+    for name, char in sorted(TEXTS.items()):
+        for size in sizes:
+            data = build_frames(char * size, args.fragments)
+            decoded = bench(data, False, args.repeat)
+            raw = bench(data, True, args.repeat)
+            print('{:>10} {:>10} {:>11.2f} us {:>11.2f} us {:>7.0%}'.format(
+                name, size, decoded * 1e6, raw * 1e6, 1 - raw / decoded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Vase application used by the WebSocket benchmarks
+
+Usage:
+  python3 bench/server.py [--host 127.0.0.1] [--port 8765]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vase import Vase
+
+ARGS = argparse.ArgumentParser(description="Run the benchmark server.")
+ARGS.add_argument(
+    '--host', action="store", dest='host', default='127.0.0.1', help='host to listen on')
+ARGS.add_argument(
+    '--port', action="store", dest='port', type=int, default=8765, help='port to listen on')
+
+app = Vase(__name__)
+
+
+@app.endpoint(path="/echo", with_sockjs=False)
+class EchoEndpoint:
+    max_message_size = 2**26
+
+    def on_connect(self):
+        pass
+
+    def on_message(self, message):
+        self.transport.send(message)
+
+    def on_close(self, exc=None):
+        pass
+
+
+@app.endpoint(path="/lean", with_sockjs=False)
+class LeanEchoEndpoint(EchoEndpoint):
+    lean = True
+
+
+@app.endpoint(path="/broadcast", with_sockjs=False)
+class BroadcastEndpoint:
+    def on_connect(self):
+        self.channels.subscribe('bench', self.transport)
+
+    def on_message(self, message):
+        self.channels.publish('bench', message)
+
+    def on_close(self, exc=None):
+        pass
+
+
+if __name__ == '__main__':
+    args = ARGS.parse_args()
+    app.run(host=args.host, port=args.port)
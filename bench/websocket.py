@@ -0,0 +1,198 @@
+"""Measures WebSocket throughput, latency and memory of a local Vase server
+
+The server from bench/server.py is started in a subprocess, unless --url is given.
+
+Usage:
+  python3 bench/websocket.py [--scenarios echo,broadcast,large] [--connections 100]
+                             [--messages 200] [--size 64] [--large-size 1048576]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vase.websocket import connect
+
+ARGS = argparse.ArgumentParser(description="Benchmark Vase WebSocket endpoints.")
+ARGS.add_argument(
+    '--scenarios', action="store", dest='scenarios', default='echo,broadcast,large',
+    help='comma separated scenarios to run')
+ARGS.add_argument(
+    '--connections', action="store", dest='connections', type=int, default=100,
+    help='number of concurrent connections')
+ARGS.add_argument(
+    '--messages', action="store", dest='messages', type=int, default=200,
+    help='messages sent per connection (echo) or in total (broadcast)')
+ARGS.add_argument(
+    '--size', action="store", dest='size', type=int, default=64,
+    help='payload size of echo messages in bytes')
+ARGS.add_argument(
+    '--large-size', action="store", dest='large_size', type=int, default=2**20,
+    help='payload size of the large message scenario in bytes')
+ARGS.add_argument(
+    '--large-messages', action="store", dest='large_messages', type=int, default=20,
+    help='messages sent per connection in the large message scenario')
+ARGS.add_argument(
+    '--url', action="store", dest='url', default=None,
+    help='base ws:// URL of an already running server, memory is not reported then')
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def rss_kib(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+@asyncio.coroutine
+def wait_for_server(url, loop, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client = yield from connect(url + '/echo', loop=loop)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            yield from asyncio.sleep(0.1, loop=loop)
+        else:
+            yield from client.close()
+            return
+
+
+@asyncio.coroutine
+def open_clients(url, count, loop):
+    clients = []
+    for i in range(count):
+        clients.append((yield from connect(url, max_message_size=2**27, loop=loop)))
+    return clients
+
+
+@asyncio.coroutine
+def echo_client(client, messages, payload, latencies):
+    for i in range(messages):
+        started = time.perf_counter()
+        client.send(payload)
+        reply = yield from client.recv()
+        latencies.append(time.perf_counter() - started)
+        assert len(reply) == len(payload)
+
+
+@asyncio.coroutine
+def run_echo(url, args, loop, size, messages, measure_rss):
+    clients = yield from open_clients(url + '/echo', args.connections, loop)
+    rss = measure_rss()
+    payload = os.urandom(size)
+    latencies = []
+    started = time.perf_counter()
+    yield from asyncio.gather(*[echo_client(c, messages, payload, latencies) for c in clients], loop=loop)
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        yield from client.close()
+    return len(latencies) / elapsed, latencies, rss
+
+
+@asyncio.coroutine
+def broadcast_receiver(client, messages, latencies):
+    for i in range(messages):
+        message = yield from client.recv()
+        latencies.append(time.perf_counter() - float(message.split(' ', 1)[0]))
+
+
+@asyncio.coroutine
+def run_broadcast(url, args, loop, measure_rss):
+    clients = yield from open_clients(url + '/broadcast', args.connections, loop)
+    rss = measure_rss()
+    publisher, receivers = clients[0], clients[1:]
+    latencies = []
+    padding = 'x' * args.size
+    started = time.perf_counter()
+    tasks = [asyncio.async(broadcast_receiver(c, args.messages, latencies), loop=loop) for c in receivers]
+    for i in range(args.messages):
+        publisher.send('{!r} {}'.format(time.perf_counter(), padding))
+        # wait for our own copy, so that the fan-out is not measured under unbounded buffering
+        message = yield from publisher.recv()
+        latencies.append(time.perf_counter() - float(message.split(' ', 1)[0]))
+    yield from asyncio.gather(*tasks, loop=loop)
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        yield from client.close()
+    return len(latencies) / elapsed, latencies, rss
+
+
+@asyncio.coroutine
+def run(args, url, loop, measure_rss):
+    yield from wait_for_server(url, loop)
+    print('{:>10} {:>12} {:>10} {:>10} {:>14}'.format('scenario', 'msgs/s', 'p50 ms', 'p99 ms', 'RSS/conn KiB'))
+    for scenario in args.scenarios.split(','):
+        baseline = measure_rss()
+        if scenario == 'echo':
+            rate, latencies, rss = yield from run_echo(url, args, loop, args.size, args.messages, measure_rss)
+        elif scenario == 'large':
+            rate, latencies, rss = yield from run_echo(url, args, loop, args.large_size, args.large_messages,
+                                                       measure_rss)
+        elif scenario == 'broadcast':
+            rate, latencies, rss = yield from run_broadcast(url, args, loop, measure_rss)
+        else:
+            raise SystemExit("Unknown scenario '{}'".format(scenario))
+        per_connection = 'n/a'
+        if baseline is not None and rss is not None:
+            per_connection = '{:.1f}'.format((rss - baseline) / args.connections)
+        print('{:>10} {:>12.0f} {:>10.3f} {:>10.3f} {:>14}'.format(
+            scenario, rate, percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, per_connection))
+        # let the server release the closed connections
+        yield from asyncio.sleep(0.5, loop=loop)
+
+
+def main():
+    args = ARGS.parse_args()
+    if args.connections < 2:
+        raise SystemExit('at least 2 connections are needed')
+    loop = asyncio.get_event_loop()
+    server = None
+    if args.url is None:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, SERVER, '--port', str(port)])
+        url = 'ws://127.0.0.1:{}'.format(port)
+
+        def measure_rss():
+            return rss_kib(server.pid)
+    else:
+        url = args.url.rstrip('/')
+
+        def measure_rss():
+            return None
+    try:
+        loop.run_until_complete(run(args, url, loop, measure_rss))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import os.path
 from datetime import datetime
 import html
 from vase.response import HttpResponse
+from vase.websocket import broadcast
 
 app = Vase(__name__)
 
@@ -38,8 +39,7 @@ class Endpoint:
         self.broadcast(msg)
 
     def broadcast(self, message):
-        for username, transport in self.bag['users'].items():
-            transport.send(message)
+        broadcast(message, self.bag['users'].values())
 
 
     def on_close(self, exc=None):
@@ -0,0 +1,62 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from tests.util import BaseLoopTestCase
+from vase.cancellation import CancellationToken
+
+
+class CancellationTokenTests(BaseLoopTestCase):
+    def test_cancel(self):
+        token = CancellationToken(loop=self.loop)
+        self.assertFalse(token.cancelled)
+        token.raise_if_cancelled()
+
+        self.assertTrue(token.cancel())
+        self.assertTrue(token.cancelled)
+        self.assertFalse(token.cancel())
+        self.assertRaises(asyncio.CancelledError, token.raise_if_cancelled)
+
+    def test_callbacks(self):
+        token = CancellationToken(loop=self.loop)
+        called = []
+        token.add_callback(lambda: called.append(1))
+        cb = lambda: called.append(2)
+        token.add_callback(cb)
+        token.remove_callback(cb)
+        token.remove_callback(cb)
+        token.cancel()
+        self.assertEqual(called, [1])
+
+        token.add_callback(lambda: called.append(3))
+        self.assertEqual(called, [1, 3])
+
+    def test_link(self):
+        token = CancellationToken(loop=self.loop)
+        fut = token.link(asyncio.sleep(10, loop=self.loop))
+        self.loop.call_soon(token.cancel)
+        self.assertRaises(asyncio.CancelledError, self.loop.run_until_complete, fut)
+
+        token = CancellationToken(loop=self.loop)
+        fut = token.link(asyncio.sleep(0, result='done', loop=self.loop))
+        self.assertEqual(self.loop.run_until_complete(fut), 'done')
+        self.assertEqual(token._callbacks, [])
+
+    def test_run_in_executor(self):
+        token = CancellationToken(loop=self.loop)
+        started = threading.Event()
+
+        def work():
+            started.set()
+            while not token.cancelled:
+                started.wait(0.001)
+            return 'stopped'
+
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        try:
+            fut = token.run_in_executor(executor, work)
+            self.loop.run_until_complete(self.loop.run_in_executor(None, started.wait))
+            token.cancel()
+            self.assertRaises(asyncio.CancelledError, self.loop.run_until_complete, fut)
+        finally:
+            executor.shutdown(wait=True)
@@ -0,0 +1,56 @@
+import unittest
+import unittest.mock
+
+from vase.channels import ChannelRegistry
+from vase.sockjs import Session
+from vase.sockjs.handlers import FakeTransport
+from vase.websocket import WebSocketWriter
+
+
+class ChannelRegistryTests(unittest.TestCase):
+    def test_subscribe(self):
+        registry = ChannelRegistry()
+        a, b = object(), object()
+        registry.subscribe('room', a)
+        registry.subscribe('room', a)
+        registry.subscribe('room', b)
+        registry.subscribe('lobby', a)
+        self.assertEqual(registry.subscriber_count('room'), 2)
+        self.assertEqual(registry.counts(), {'room': 2, 'lobby': 1})
+        self.assertEqual(registry.channels_of(a), {'room', 'lobby'})
+
+        registry.unsubscribe('room', a)
+        registry.unsubscribe('room', a)
+        registry.unsubscribe('nowhere', a)
+        self.assertEqual(registry.counts(), {'room': 1, 'lobby': 1})
+
+        registry.unsubscribe_all(a)
+        registry.unsubscribe_all(b)
+        self.assertEqual(registry.counts(), {})
+        self.assertEqual(registry.subscriber_count('room'), 0)
+        self.assertEqual(registry.channels_of(a), frozenset())
+
+    def test_publish(self):
+        registry = ChannelRegistry()
+        transport = unittest.mock.Mock()
+        transport.transport.get_write_buffer_size.return_value = 0
+        writer = WebSocketWriter(transport)
+        session = Session('abc')
+        fake = FakeTransport(session)
+
+        registry.subscribe('room', writer)
+        registry.subscribe('room', fake)
+        self.assertEqual(registry.publish('room', 'Hi'), [])
+        self.assertEqual(registry.publish('lobby', 'Hi'), [])
+        transport.write.assert_called_once_with(b'\x81\x02Hi')
+        self.assertEqual(session.take_messages(), ['"Hi"'])
+
+    def test_session_close(self):
+        registry = ChannelRegistry()
+        session = Session('abc', channels=registry)
+        session.endpoint = unittest.mock.Mock()
+        session.endpoint.transport = FakeTransport(session)
+        registry.subscribe('room', session.endpoint.transport)
+        session.endpoint.transport.close()
+        self.assertTrue(session.closed)
+        self.assertEqual(registry.subscriber_count('room'), 0)
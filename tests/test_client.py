@@ -0,0 +1,105 @@
+import asyncio
+
+from tests.util import BaseLoopTestCase
+from vase.handlers import WebSocketProtocol
+from vase.protocol import BaseHttpProtocol
+from vase.routing import (
+    RequestSpec,
+    RoutingHttpProcessor,
+    WebSocketRoute,
+)
+from vase.websocket import (
+    WebSocketHandshakeError,
+    connect,
+)
+
+
+class EchoEndpoint:
+    def on_connect(self):
+        pass
+
+    def on_message(self, message):
+        if message == 'ping me':
+            self.transport._transport.write(b'\x89\x02hi')
+        self.transport.send(message)
+
+    def on_close(self, exc=None):
+        pass
+
+
+class LeanEchoEndpoint(EchoEndpoint):
+    lean = True
+    max_message_size = 2**17
+    instances = []
+
+    def on_connect(self):
+        self.closed = False
+        self.instances.append(self)
+
+    def on_close(self, exc=None):
+        self.closed = True
+
+
+class WebSocketClientTests(BaseLoopTestCase):
+    def setUp(self):
+        super().setUp()
+        LeanEchoEndpoint.instances = []
+        routes = [
+            WebSocketRoute(RequestSpec('/echo'), EchoEndpoint),
+            WebSocketRoute(RequestSpec('/lean'), LeanEchoEndpoint),
+        ]
+
+        def processor_factory(transport, protocol, reader, writer):
+            return RoutingHttpProcessor(transport, protocol, reader, writer, routes=routes)
+
+        self.server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: BaseHttpProtocol(processor_factory, loop=self.loop), '127.0.0.1', 0))
+        self.url = 'ws://127.0.0.1:{}'.format(self.server.sockets[0].getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        super().tearDown()
+
+    def test_echo(self):
+        @asyncio.coroutine
+        def go():
+            client = yield from connect(self.url + '/echo', loop=self.loop)
+            client.send('Привет')
+            self.assertEqual((yield from client.recv()), 'Привет')
+            client.send(b'\x00' * 70000)
+            self.assertEqual((yield from client.recv()), b'\x00' * 70000)
+            client.send('ping me')
+            self.assertEqual((yield from client.recv()), 'ping me')
+            yield from client.close()
+            self.assertTrue(client.closed)
+            self.assertIsNone((yield from client.recv()))
+
+        self.loop.run_until_complete(go())
+
+    def test_lean_endpoint(self):
+        @asyncio.coroutine
+        def go():
+            client = yield from connect(self.url + '/lean', loop=self.loop)
+            for message in ('Привет', b'\x00' * 70000, 'ping me'):
+                client.send(message)
+                self.assertEqual((yield from client.recv()), message)
+            endpoint, = LeanEchoEndpoint.instances
+            self.assertIsInstance(endpoint.transport._transport, WebSocketProtocol)
+            yield from client.close()
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            self.assertTrue(endpoint.closed)
+
+            client = yield from connect(self.url + '/lean', loop=self.loop)
+            client.send(b'\x00' * (2**17 + 1))
+            self.assertIsNone((yield from client.recv()))
+
+        self.loop.run_until_complete(go())
+
+    def test_handshake_refused(self):
+        with self.assertRaises(WebSocketHandshakeError):
+            self.loop.run_until_complete(connect(self.url + '/missing', loop=self.loop))
+
+    def test_invalid_url(self):
+        self.assertRaises(ValueError, self.loop.run_until_complete,
+                          connect('http://127.0.0.1/', loop=self.loop))
@@ -0,0 +1,53 @@
+import unittest
+
+from vase import codec
+from vase.codec import (
+    JsonCodec,
+    select_subprotocol,
+)
+
+
+class JsonCodecTests(unittest.TestCase):
+    def test_roundtrip(self):
+        c = JsonCodec()
+        self.assertFalse(c.binary)
+        self.assertEqual(c.encode({'a': [1, 2]}), '{"a":[1,2]}')
+        self.assertEqual(c.decode('{"a":[1,2]}'), {'a': [1, 2]})
+        self.assertEqual(c.decode('"пы"'.encode('utf-8')), 'пы')
+
+    def test_errors(self):
+        c = JsonCodec()
+        self.assertRaises(ValueError, c.decode, '{')
+        self.assertRaises(ValueError, c.decode, b'\xff')
+
+    def test_offload(self):
+        self.assertFalse(JsonCodec().should_offload('x' * 10**6))
+        c = JsonCodec(offload_threshold=10)
+        self.assertFalse(c.should_offload('x' * 9))
+        self.assertTrue(c.should_offload('x' * 10))
+
+
+@unittest.skipIf(codec.msgpack is None, 'msgpack is not installed')
+class MsgpackCodecTests(unittest.TestCase):
+    def test_roundtrip(self):
+        c = codec.MsgpackCodec()
+        self.assertEqual(c.decode(c.encode({'a': b'\x00'})), {'a': b'\x00'})
+        self.assertRaises(ValueError, c.decode, b'\xc1')
+        self.assertRaises(ValueError, c.decode, 'text')
+
+
+@unittest.skipIf(codec.cbor2 is None, 'cbor2 is not installed')
+class CborCodecTests(unittest.TestCase):
+    def test_roundtrip(self):
+        c = codec.CborCodec()
+        self.assertEqual(c.decode(c.encode({'a': [1]})), {'a': [1]})
+        self.assertRaises(ValueError, c.decode, b'\xff\xff')
+        self.assertRaises(ValueError, c.decode, 'text')
+
+
+class SelectSubprotocolTests(unittest.TestCase):
+    def test_server_preference(self):
+        subprotocols = ('v1.msgpack', 'v1.json')
+        self.assertEqual(select_subprotocol('v1.json, v1.msgpack', subprotocols), 'v1.msgpack')
+        self.assertEqual(select_subprotocol('chat,v1.json', subprotocols), 'v1.json')
+        self.assertIsNone(select_subprotocol('chat', subprotocols))
@@ -0,0 +1,186 @@
+import unittest
+from io import BytesIO
+import zlib
+
+from vase.deflate import (
+    DeflateOptions,
+    PerMessageDeflate,
+    parse_extensions,
+)
+from vase.websocket import (
+    FrameBuilder,
+    FrameDecoder,
+    MessageTooBigException,
+    OpCode,
+    WebSocketFormatException,
+    WebSocketParser,
+    WebSocketWriter,
+)
+
+
+def compress_client(payload, window_bits=15):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -window_bits)
+    return (compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+class ParseExtensionsTests(unittest.TestCase):
+    def test_parse(self):
+        header = 'permessage-deflate; client_max_window_bits, permessage-deflate; server_max_window_bits="10", x-foo'
+        self.assertEqual(parse_extensions(header), [
+            ('permessage-deflate', {'client_max_window_bits': None}),
+            ('permessage-deflate', {'server_max_window_bits': '10'}),
+            ('x-foo', {}),
+        ])
+
+    def test_empty(self):
+        self.assertEqual(parse_extensions(' , '), [])
+
+
+class DeflateOptionsTests(unittest.TestCase):
+    def test_default(self):
+        extension, response = DeflateOptions().negotiate('permessage-deflate')
+        self.assertEqual(response, 'permessage-deflate')
+        self.assertEqual(extension.server_max_window_bits, 15)
+        self.assertFalse(extension.server_no_context_takeover)
+
+    def test_unknown_extension(self):
+        self.assertEqual(DeflateOptions().negotiate('x-webkit-deflate-frame'), (None, None))
+
+    def test_params(self):
+        options = DeflateOptions(client_max_window_bits=12)
+        extension, response = options.negotiate(
+            'permessage-deflate; server_no_context_takeover; server_max_window_bits=10; client_max_window_bits')
+        self.assertEqual(response,
+                         'permessage-deflate; server_no_context_takeover; '
+                         'server_max_window_bits=10; client_max_window_bits=12')
+        self.assertTrue(extension.server_no_context_takeover)
+        self.assertEqual(extension.server_max_window_bits, 10)
+        self.assertEqual(extension.client_max_window_bits, 12)
+
+    def test_invalid_offers_are_skipped(self):
+        options = DeflateOptions()
+        for header in ('permessage-deflate; foo',
+                       'permessage-deflate; server_max_window_bits=16',
+                       'permessage-deflate; server_max_window_bits',
+                       'permessage-deflate; server_max_window_bits=8',
+                       'permessage-deflate; client_max_window_bits=7',
+                       'permessage-deflate; client_no_context_takeover=1'):
+            self.assertEqual(options.negotiate(header), (None, None), header)
+        extension, response = options.negotiate('permessage-deflate; foo, permessage-deflate')
+        self.assertEqual(response, 'permessage-deflate')
+
+    def test_max_memory(self):
+        options = DeflateOptions(max_memory=2**16)
+        extension, response = options.negotiate('permessage-deflate; client_max_window_bits')
+        self.assertEqual(extension.mem_level, 1)
+        self.assertLess(extension.server_max_window_bits, 15)
+        self.assertIn('server_max_window_bits', response)
+
+        options = DeflateOptions(max_memory=0)
+        extension, response = options.negotiate('permessage-deflate')
+        self.assertTrue(extension.server_no_context_takeover)
+        self.assertTrue(extension.client_no_context_takeover)
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, DeflateOptions, server_max_window_bits=8)
+        self.assertRaises(ValueError, DeflateOptions, client_max_window_bits=16)
+        self.assertRaises(ValueError, DeflateOptions, max_inflated_size=None)
+        self.assertRaises(ValueError, DeflateOptions, max_inflated_size=0)
+
+
+class PerMessageDeflateTests(unittest.TestCase):
+    def test_roundtrip(self):
+        for takeover in (False, True):
+            sender = PerMessageDeflate(server_no_context_takeover=takeover)
+            receiver = PerMessageDeflate(client_no_context_takeover=takeover)
+            for message in (b'Hello world' * 20, b'Hello world' * 20, b''):
+                data = sender.compress(message)
+                self.assertFalse(data.endswith(b'\x00\x00\xff\xff'))
+                self.assertEqual(receiver.decompress(data), message)
+
+    def test_context_takeover(self):
+        deflate = PerMessageDeflate()
+        first = deflate.compress(b'Hello world' * 20)
+        second = deflate.compress(b'Hello world' * 20)
+        self.assertLess(len(second), len(first))
+
+        deflate = PerMessageDeflate(server_no_context_takeover=True)
+        self.assertEqual(deflate.compress(b'Hello world' * 20), first)
+        self.assertEqual(deflate.compress(b'Hello world' * 20), first)
+
+    def test_decompress_parts(self):
+        deflate = PerMessageDeflate()
+        data = compress_client(b'Hello world')
+        self.assertEqual(deflate.decompress(data[:3], fin=False) + deflate.decompress(data[3:]), b'Hello world')
+
+    def test_corrupted(self):
+        self.assertRaises(zlib.error, PerMessageDeflate().decompress, b'\xff\xff\xff')
+
+
+class DeflateParserTests(unittest.TestCase):
+    def test_inflate_message(self):
+        parser = WebSocketParser(None, deflate=PerMessageDeflate())
+        payload = compress_client('Привет'.encode('utf-8'))
+        data = FrameBuilder.build(fin=False, opcode=OpCode.text, payload=payload[:2], masked=True, rsv1=True)
+        data += FrameBuilder.ping()
+        data += FrameBuilder.continuation(payload[2:])
+        messages = parser.feed(data)
+        self.assertEqual([(m.opcode, m.payload) for m in messages], [(OpCode.ping, b''), (OpCode.text, 'Привет')])
+        self.assertEqual(parser.feed(FrameBuilder.binary(b'raw'))[0].payload, b'raw')
+
+    def test_rsv1_without_extension(self):
+        frame = FrameBuilder.build(fin=True, opcode=OpCode.text, payload=compress_client(b'Hi'), masked=True, rsv1=True)
+        self.assertRaises(WebSocketFormatException, WebSocketParser(None).feed, frame)
+
+    def test_rsv1_on_control_frame(self):
+        frame = FrameBuilder.build(fin=True, opcode=OpCode.ping, payload=b'', masked=True, rsv1=True)
+        self.assertRaises(WebSocketFormatException, FrameDecoder(allow_rsv1=True).feed, frame)
+
+    def test_decompressed_size_limit(self):
+        payload = compress_client(b'x' * 1000)
+        frame = FrameBuilder.build(fin=True, opcode=OpCode.binary, payload=payload, masked=True, rsv1=True)
+        parser = WebSocketParser(None, deflate=PerMessageDeflate(), max_message_size=999)
+        self.assertRaises(MessageTooBigException, parser.feed, frame)
+        parser = WebSocketParser(None, deflate=PerMessageDeflate(), max_message_size=1000)
+        self.assertEqual(parser.feed(frame)[0].payload, b'x' * 1000)
+
+    def test_deflate_bomb(self):
+        payload = compress_client(b'\x00' * 2**20)
+        self.assertLess(len(payload), 2**11)
+        frame = FrameBuilder.build(fin=True, opcode=OpCode.binary, payload=payload, masked=True, rsv1=True)
+        deflate, response = DeflateOptions(max_inflated_size=2**16).negotiate('permessage-deflate')
+        self.assertEqual(deflate.max_inflated_size, 2**16)
+        # the cap applies without a max_message_size as well
+        for max_message_size in (None, 2**20):
+            parser = WebSocketParser(None, deflate=deflate, max_message_size=max_message_size)
+            self.assertRaises(MessageTooBigException, parser.feed, frame)
+        parser = WebSocketParser(None, deflate=PerMessageDeflate(max_inflated_size=2**16),
+                                 streaming=True)
+        self.assertRaises(MessageTooBigException, parser.feed, frame)
+
+    def test_streaming_inflate(self):
+        payload = compress_client(b'Hello world' * 10)
+        data = FrameBuilder.build(fin=False, opcode=OpCode.binary, payload=payload[:5], masked=True, rsv1=True)
+        data += FrameBuilder.continuation(payload[5:])
+        chunks = WebSocketParser(None, deflate=PerMessageDeflate(), streaming=True).feed(data)
+        self.assertEqual(b''.join(c.payload for c in chunks), b'Hello world' * 10)
+
+    def test_corrupted_payload(self):
+        frame = FrameBuilder.build(fin=True, opcode=OpCode.binary, payload=b'\xff\xff\xff', masked=True, rsv1=True)
+        parser = WebSocketParser(None, deflate=PerMessageDeflate())
+        self.assertRaises(WebSocketFormatException, parser.feed, frame)
+
+
+class DeflateWriterTests(unittest.TestCase):
+    def test_threshold(self):
+        transport = BytesIO()
+        ww = WebSocketWriter(transport, deflate=PerMessageDeflate(threshold=10))
+        ww.send(b'short')
+        self.assertEqual(transport.getvalue(), b'\x82\x05short')
+
+        transport = BytesIO()
+        ww = WebSocketWriter(transport, deflate=PerMessageDeflate(threshold=10))
+        ww.send('Hello world' * 20)
+        data = transport.getvalue()
+        self.assertEqual(data[0], 0xc1)
+        self.assertEqual(PerMessageDeflate().decompress(data[2:]), b'Hello world' * 20)
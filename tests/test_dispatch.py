@@ -0,0 +1,115 @@
+import asyncio
+import unittest.mock
+
+from tests.util import BaseLoopTestCase
+from vase.dispatch import MessageDispatcher
+
+
+class MessageDispatcherTests(BaseLoopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        self.gates = {}
+
+    def _callback(self, message):
+        self.events.append(('start', message))
+        gate = self.gates.setdefault(message, asyncio.Future(loop=self.loop))
+        yield from gate
+        self.events.append(('end', message))
+
+    def _open(self, message):
+        self.gates.setdefault(message, asyncio.Future(loop=self.loop)).set_result(None)
+        asyncio.test_utils.run_briefly(self.loop)
+
+    def test_window(self):
+        dispatcher = MessageDispatcher(self._callback, concurrency=2, loop=self.loop)
+        for message in 'abc':
+            dispatcher.submit(message)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events, [('start', 'a'), ('start', 'b')])
+        self.assertEqual((dispatcher.in_flight, dispatcher.pending), (2, 1))
+
+        self._open('b')
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events[2:], [('end', 'b'), ('start', 'c')])
+
+        self._open('a')
+        self._open('c')
+        self.loop.run_until_complete(dispatcher.join())
+        self.assertEqual(dispatcher.in_flight, 0)
+
+    def test_wait_for_room(self):
+        dispatcher = MessageDispatcher(self._callback, concurrency=1, max_pending=1, loop=self.loop)
+        dispatcher.submit('a')
+        self.loop.run_until_complete(dispatcher.wait_for_room())
+        dispatcher.submit('b')
+        waiter = asyncio.async(dispatcher.wait_for_room(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertFalse(waiter.done())
+        self._open('a')
+        self.loop.run_until_complete(waiter)
+        self._open('b')
+        self.loop.run_until_complete(dispatcher.join())
+
+    def test_key_ordering(self):
+        dispatcher = MessageDispatcher(self._callback, concurrency=3, key=lambda m: m[0], loop=self.loop)
+        for message in ('x1', 'y1', 'x2'):
+            dispatcher.submit(message)
+        asyncio.test_utils.run_briefly(self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events, [('start', 'x1'), ('start', 'y1')])
+        self._open('x1')
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events[2:], [('end', 'x1'), ('start', 'x2')])
+        self._open('x2')
+        self._open('y1')
+        self.loop.run_until_complete(dispatcher.join())
+        self.assertEqual(dispatcher._backlogs, {})
+
+    def test_key_backlog_does_not_block_other_keys(self):
+        dispatcher = MessageDispatcher(self._callback, concurrency=2, key=lambda m: m[0],
+                                       max_pending=10, loop=self.loop)
+        for message in ('x1', 'x2', 'x3', 'y1', 'z1'):
+            dispatcher.submit(message)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events, [('start', 'x1'), ('start', 'y1')])
+        self.assertEqual((dispatcher.in_flight, dispatcher.pending), (2, 3))
+
+        self._open('y1')
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events[2:], [('end', 'y1'), ('start', 'z1')])
+
+        self._open('x1')
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self.events[4:], [('end', 'x1'), ('start', 'x2')])
+        self.assertEqual((dispatcher.in_flight, dispatcher.pending), (2, 1))
+
+        for message in ('z1', 'x2', 'x3'):
+            self._open(message)
+        self.loop.run_until_complete(dispatcher.join())
+        self.assertEqual(dispatcher._backlogs, {})
+        self.assertEqual(dispatcher.pending, 0)
+
+    def test_errors_do_not_stop_dispatch(self):
+        handled = []
+
+        def callback(message):
+            handled.append(message)
+            raise ValueError(message)
+
+        dispatcher = MessageDispatcher(callback, concurrency=1, loop=self.loop)
+        with unittest.mock.patch('vase.dispatch.logger') as logger:
+            dispatcher.submit('a')
+            dispatcher.submit('b')
+            self.loop.run_until_complete(dispatcher.join())
+        self.assertEqual(handled, ['a', 'b'])
+        self.assertEqual(logger.error.call_count, 2)
+
+    def test_cancel(self):
+        dispatcher = MessageDispatcher(self._callback, concurrency=1, loop=self.loop)
+        dispatcher.submit('a')
+        dispatcher.submit('b')
+        asyncio.test_utils.run_briefly(self.loop)
+        dispatcher.cancel()
+        self.loop.run_until_complete(dispatcher.join())
+        self.assertEqual(self.events, [('start', 'a')])
@@ -0,0 +1,501 @@
+import asyncio
+import unittest.mock
+
+from tests.util import BaseLoopTestCase
+from vase.exceptions import UnauthorizedException
+from vase.channels import ChannelRegistry
+from vase.codec import JsonCodec
+from vase.deflate import DeflateOptions
+from vase.handlers import (
+    CallbackRouteHandler,
+    WebSocketHandler,
+    WebSocketProtocol,
+    WEBSOCKET_DEAD_PEERS,
+    WEBSOCKET_RTT,
+)
+from vase.http import (
+    HttpRequest,
+    HttpWriter,
+)
+from vase.response import HttpResponse
+from vase.websocket import (
+    DEFAULT_MAX_MESSAGE_SIZE,
+    FrameBuilder,
+    WebSocketParser,
+    WebSocketWriter,
+)
+
+
+class CallbackRouteHandlerTests(BaseLoopTestCase):
+    def _get_handler(self, callback, **kwargs):
+        request = HttpRequest('GET', '/', 'HTTP/1.1', extra={'loop': self.loop})
+        reader = asyncio.StreamReader(loop=self.loop)
+        transport = unittest.mock.Mock()
+        writer = HttpWriter(transport, None, reader, self.loop)
+        return CallbackRouteHandler(request, reader, writer, callback, **kwargs), request, transport
+
+    def test_handle(self):
+        @asyncio.coroutine
+        def callback(request, start_response):
+            start_response(b'200 OK', [(b'Content-Length', b'2')])
+            return [b'ok']
+
+        handler, request, transport = self._get_handler(callback, timeout=1)
+        self.loop.run_until_complete(handler.handle())
+        transport.writelines.assert_called_with([b'ok'])
+        self.assertFalse(request.cancel_token.cancelled)
+
+    def test_timeout(self):
+        @asyncio.coroutine
+        def callback(request, start_response):
+            yield from asyncio.sleep(10, loop=self.loop)
+
+        handler, request, transport = self._get_handler(callback, timeout=0.01)
+        self.loop.run_until_complete(handler.handle())
+        self.assertTrue(request.cancel_token.cancelled)
+        transport.write.assert_any_call(
+            b'HTTP/1.1 504 Gateway Timeout\r\nContent-Type: text/plain\r\nContent-Length: 19\r\n\r\n')
+        transport.write.assert_called_with(b'504 Gateway Timeout')
+
+    def test_bad_form(self):
+        @asyncio.coroutine
+        def callback(request, start_response):
+            yield from request.post()
+            self.fail('a malformed form must not parse')
+
+        handler, request, transport = self._get_handler(callback)
+        request.add_header('Content-Type', 'multipart/form-data; boundary=foo')
+        request.add_header('Content-Length', '3')
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(b'foo')
+        stream.feed_eof()
+        request.body = stream
+
+        self.loop.run_until_complete(handler.handle())
+        self.assertTrue(request.close_connection)
+        transport.write.assert_any_call(
+            b'HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\n'
+            b'Content-Length: 15\r\nConnection: close\r\n\r\n')
+
+    def test_form_not_parsed(self):
+        @asyncio.coroutine
+        def callback(request, start_response):
+            start_response(b'200 OK', [])
+            return [b'ok']
+
+        handler, request, transport = self._get_handler(callback)
+        request.add_header('Content-Type', 'multipart/form-data; boundary=foo')
+        request.add_header('Content-Length', '3')
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(b'foo')
+        stream.feed_eof()
+        request.body = stream
+
+        self.loop.run_until_complete(handler.handle())
+        transport.writelines.assert_called_with([b'ok'])
+        self.assertEqual(self.loop.run_until_complete(stream.read()), b'foo')
+
+    def _expect(self, request, body):
+        request.add_header('Expect', '100-continue')
+        request.add_header('Content-Type', 'application/x-www-form-urlencoded')
+        request.add_header('Content-Length', str(len(body)))
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(body)
+        request.body = stream
+        sent = []
+        request.body.expect_continue(lambda: sent.append(True))
+        return sent
+
+    def test_expect_handler_rejects(self):
+        @asyncio.coroutine
+        def callback(request, start_response):
+            self.fail('callback must not be called')
+
+        def expect_handler(request):
+            raise UnauthorizedException()
+
+        handler, request, transport = self._get_handler(callback, expect_handler=expect_handler)
+        sent = self._expect(request, b'foo=bar')
+        self.loop.run_until_complete(handler.handle())
+        self.assertEqual(sent, [])
+        self.assertTrue(request.body.continue_pending)
+        self.assertTrue(request.close_connection)
+        transport.write.assert_any_call(
+            b'HTTP/1.1 401 Unauthorized\r\nContent-Type: text/plain\r\n'
+            b'Content-Length: 16\r\nConnection: close\r\n\r\n')
+
+        handler, request, transport = self._get_handler(callback, expect_handler=lambda r: False)
+        self._expect(request, b'foo=bar')
+        self.loop.run_until_complete(handler.handle())
+        self.assertIn(b'417 Expectation Failed', transport.write.call_args_list[0][0][0])
+
+        response = HttpResponse('denied', status=403)
+        handler, request, transport = self._get_handler(callback, expect_handler=lambda r: response)
+        self._expect(request, b'foo=bar')
+        self.loop.run_until_complete(handler.handle())
+        self.assertIn(b'403 Forbidden', transport.write.call_args_list[0][0][0])
+
+    def test_expect_handler_accepts(self):
+        @asyncio.coroutine
+        def callback(request, start_response):
+            post = yield from request.post()
+            start_response(b'200 OK', [])
+            return [post['foo'].encode('utf-8')]
+
+        handler, request, transport = self._get_handler(callback, expect_handler=lambda r: True)
+        sent = self._expect(request, b'foo=bar')
+        self.loop.run_until_complete(handler.handle())
+        self.assertEqual(sent, [True])
+        self.assertFalse(request.body.continue_pending)
+        transport.writelines.assert_called_with([b'bar'])
+
+
+class WebSocketHandlerTests(BaseLoopTestCase):
+    def _get_handler(self, endpoint, extensions=None, channels=None, protocols=None):
+        request = HttpRequest('GET', '/', 'HTTP/1.1', extra={'loop': self.loop})
+        request.add_header('Sec-WebSocket-Key', 'dGhlIHNhbXBsZSBub25jZQ==')
+        if protocols is not None:
+            request.add_header('Sec-WebSocket-Protocol', protocols)
+        if extensions is not None:
+            request.add_header('Sec-WebSocket-Extensions', extensions)
+        reader = asyncio.StreamReader(loop=self.loop)
+        transport = unittest.mock.Mock()
+        transport.get_write_buffer_size.return_value = 0
+        writer = HttpWriter(transport, None, reader, self.loop)
+        handler = WebSocketHandler(request, reader, writer, lambda: endpoint, None, channels=channels)
+        return handler, reader, transport
+
+    def _make_endpoint(self, **attrs):
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'] + list(attrs))
+        for name, value in attrs.items():
+            setattr(endpoint, name, value)
+        return endpoint
+
+    def test_permessage_deflate(self):
+        endpoint = self._make_endpoint(permessage_deflate=DeflateOptions(threshold=0))
+        handler, reader, transport = self._get_handler(endpoint, 'permessage-deflate; client_max_window_bits')
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        headers = transport.write.call_args_list[0][0][0]
+        self.assertIn(b'Sec-WebSocket-Extensions: permessage-deflate\r\n', headers)
+        self.assertIsNotNone(endpoint.transport.deflate)
+
+    def test_no_extension_offered(self):
+        endpoint = self._make_endpoint(permessage_deflate=DeflateOptions())
+        handler, reader, transport = self._get_handler(endpoint)
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        self.assertNotIn(b'Sec-WebSocket-Extensions', transport.write.call_args_list[0][0][0])
+        self.assertIsNone(endpoint.transport.deflate)
+
+    def test_extension_disabled(self):
+        endpoint = self._make_endpoint()
+        handler, reader, transport = self._get_handler(endpoint, 'permessage-deflate')
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        self.assertNotIn(b'Sec-WebSocket-Extensions', transport.write.call_args_list[0][0][0])
+
+    def test_channels_cleanup(self):
+        channels = ChannelRegistry()
+        endpoint = self._make_endpoint()
+        endpoint.on_connect.side_effect = lambda: endpoint.channels.subscribe('room', endpoint.transport)
+        handler, reader, transport = self._get_handler(endpoint, channels=channels)
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        self.assertEqual(channels.subscriber_count('room'), 1)
+        handler.connection_lost(None)
+        endpoint.on_close.assert_called_once_with(None)
+        self.assertEqual(channels.subscriber_count('room'), 0)
+
+    def test_message_too_big(self):
+        endpoint = self._make_endpoint(max_message_size=4)
+        handler, reader, transport = self._get_handler(endpoint)
+        reader.feed_data(FrameBuilder.binary(b'Hello'))
+        self.loop.run_until_complete(handler.handle())
+        transport.write.assert_called_with(FrameBuilder.close(1009, masked=False))
+        transport.close.assert_called_once_with()
+        self.assertFalse(endpoint.on_message.called)
+
+    def test_default_message_size(self):
+        endpoint = self._make_endpoint()
+        handler, reader, transport = self._get_handler(endpoint)
+        reader.feed_data(FrameBuilder.binary(b'x' * (DEFAULT_MAX_MESSAGE_SIZE + 1)))
+        self.loop.run_until_complete(handler.handle())
+        transport.write.assert_called_with(FrameBuilder.close(1009, masked=False))
+        self.assertFalse(endpoint.on_message.called)
+
+        endpoint = self._make_endpoint(max_message_size=None)
+        handler, reader, transport = self._get_handler(endpoint)
+        reader.feed_data(FrameBuilder.binary(b'x' * (DEFAULT_MAX_MESSAGE_SIZE + 1)) + FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        self.assertEqual(len(endpoint.on_message.call_args[0][0]), DEFAULT_MAX_MESSAGE_SIZE + 1)
+
+    def test_message_chunks(self):
+        chunks = []
+        endpoint = self._make_endpoint(on_message_chunk=lambda payload, fin: chunks.append((payload, fin)))
+        handler, reader, transport = self._get_handler(endpoint)
+        reader.feed_data(FrameBuilder.text('Hello ', fin=False) + FrameBuilder.continuation('world'))
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        self.assertEqual(chunks, [('Hello ', 0), ('world', 1)])
+        self.assertFalse(endpoint.on_message.called)
+
+    def test_concurrent_dispatch(self):
+        release = asyncio.Future(loop=self.loop)
+        handled = []
+
+        @asyncio.coroutine
+        def on_message(message):
+            yield from release
+            handled.append(message)
+
+        endpoint = self._make_endpoint(max_concurrency=2)
+        endpoint.on_message = on_message
+        handler, reader, transport = self._get_handler(endpoint)
+        reader.feed_data(FrameBuilder.text('a') + FrameBuilder.text('b') + FrameBuilder.ping(b'p'))
+        task = asyncio.async(handler.handle(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        # the ping is answered while both handlers are still running
+        transport.write.assert_called_with(FrameBuilder.pong(b'p', masked=False))
+        self.assertEqual(handled, [])
+        release.set_result(None)
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(task)
+        self.assertEqual(handled, ['a', 'b'])
+
+    def test_keepalive_rtt(self):
+        endpoint = self._make_endpoint(ping_interval=0.01)
+        handler, reader, transport = self._get_handler(endpoint)
+        task = asyncio.async(handler.handle(), loop=self.loop)
+        self.loop.run_until_complete(asyncio.sleep(0.015, loop=self.loop))
+        ping = transport.write.call_args[0][0]
+        self.assertEqual(ping[:2], b'\x89\x08')
+        observed = WEBSOCKET_RTT.count
+        reader.feed_data(FrameBuilder.pong(ping[2:]))
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertGreater(endpoint.transport.rtt, 0)
+        self.assertEqual(WEBSOCKET_RTT.count, observed + 1)
+        self.assertEqual(len(handler._keepalive._pings), 0)
+        reader.feed_data(FrameBuilder.pong(b'unsolicited'))
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(task)
+        self.assertFalse(handler._keepalive.active)
+
+    def test_keepalive_dead_peer(self):
+        endpoint = self._make_endpoint(ping_interval=0.001, max_missed_pongs=2)
+        handler, reader, transport = self._get_handler(endpoint)
+        dead = WEBSOCKET_DEAD_PEERS.value
+        task = asyncio.async(handler.handle(), loop=self.loop)
+        self.loop.run_until_complete(asyncio.sleep(0.05, loop=self.loop))
+        transport.abort.assert_called_once_with()
+        self.assertEqual(len(handler._keepalive._pings), 2)
+        self.assertEqual(WEBSOCKET_DEAD_PEERS.value, dead + 1)
+        reader.feed_eof()
+        self.loop.run_until_complete(task)
+
+    def test_keepalive_slow_handler(self):
+        endpoint = self._make_endpoint(ping_interval=0.01, max_missed_pongs=2)
+        handled = []
+
+        @asyncio.coroutine
+        def on_message(message):
+            yield from asyncio.sleep(0.1, loop=self.loop)
+            handled.append(message)
+        endpoint.on_message.side_effect = on_message
+        handler, reader, transport = self._get_handler(endpoint)
+        task = asyncio.async(handler.handle(), loop=self.loop)
+        reader.feed_data(FrameBuilder.text('slow'))
+
+        pongs = 0
+        while not handled:
+            self.loop.run_until_complete(asyncio.sleep(0.005, loop=self.loop))
+            frame = transport.write.call_args[0][0] if transport.write.called else b''
+            if frame[:2] == b'\x89\x08':
+                transport.write.reset_mock()
+                reader.feed_data(FrameBuilder.pong(frame[2:]))
+                pongs += 1
+        # the pongs were read while the handler was running
+        self.assertGreater(pongs, 2)
+        self.assertGreater(endpoint.transport.rtt, 0)
+        self.assertFalse(transport.abort.called)
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(task)
+        self.assertEqual(handled, ['slow'])
+
+    def test_keepalive_suspended(self):
+        endpoint = self._make_endpoint(ping_interval=0.001, max_missed_pongs=1)
+        release = asyncio.Future(loop=self.loop)
+        endpoint.on_message.side_effect = asyncio.coroutine(lambda message: (yield from release))
+        handler, reader, transport = self._get_handler(endpoint)
+        task = asyncio.async(handler.handle(), loop=self.loop)
+        # the second message fills the backlog, reading stops until the first one is handled
+        reader.feed_data(FrameBuilder.text('a') + FrameBuilder.text('b'))
+        self.loop.run_until_complete(asyncio.sleep(0.02, loop=self.loop))
+        self.assertFalse(transport.abort.called)
+        release.set_result(None)
+        reader.feed_data(FrameBuilder.close())
+        self.loop.run_until_complete(task)
+        self.assertEqual(endpoint.on_message.call_count, 2)
+
+    def test_raw_text(self):
+        endpoint = self._make_endpoint(raw_text=True)
+        handler, reader, transport = self._get_handler(endpoint)
+        endpoint.on_message.side_effect = lambda message: endpoint.transport.send(message)
+        reader.feed_data(FrameBuilder.text('Привет') + FrameBuilder.text(b'\xff'))
+        self.loop.run_until_complete(handler.handle())
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), FrameBuilder.text('Привет', masked=False))
+        transport.write.assert_called_with(FrameBuilder.close(1007, masked=False))
+
+    def test_subprotocol_codec(self):
+        received = []
+        endpoint = self._make_endpoint(subprotocols={'v1.json': JsonCodec()})
+        endpoint.on_message.side_effect = lambda message: (received.append(message),
+                                                          endpoint.transport.send({'echo': message}))
+        handler, reader, transport = self._get_handler(endpoint, protocols='chat, v1.json')
+        reader.feed_data(FrameBuilder.text('{"a":1}') + FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        headers = transport.write.call_args_list[0][0][0]
+        self.assertIn(b'Sec-WebSocket-Protocol: v1.json\r\n', headers)
+        self.assertEqual(endpoint.transport.subprotocol, 'v1.json')
+        self.assertEqual(received, [{'a': 1}])
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), FrameBuilder.text('{"echo":{"a":1}}', masked=False))
+
+    def test_subprotocol_not_offered(self):
+        endpoint = self._make_endpoint(subprotocols={'v1.json': JsonCodec()})
+        handler, reader, transport = self._get_handler(endpoint, protocols='chat')
+        reader.feed_data(FrameBuilder.text('{"a":1}') + FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        self.assertNotIn(b'Sec-WebSocket-Protocol', transport.write.call_args_list[0][0][0])
+        endpoint.on_message.assert_called_once_with('{"a":1}')
+
+    def test_offloaded_decode(self):
+        endpoint = self._make_endpoint(subprotocols={'v1.json': JsonCodec(offload_threshold=1)})
+        handler, reader, transport = self._get_handler(endpoint, protocols='v1.json')
+        reader.feed_data(FrameBuilder.text('[1]') + FrameBuilder.close())
+        self.loop.run_until_complete(handler.handle())
+        endpoint.on_message.assert_called_once_with([1])
+
+    def test_invalid_payload(self):
+        endpoint = self._make_endpoint(subprotocols={'v1.json': JsonCodec()})
+        handler, reader, transport = self._get_handler(endpoint, protocols='v1.json')
+        reader.feed_data(FrameBuilder.text('{'))
+        reader.feed_eof()
+        self.loop.run_until_complete(handler.handle())
+        transport.write.assert_any_call(FrameBuilder.close(1007, masked=False))
+        self.assertFalse(endpoint.on_message.called)
+
+
+class WebSocketProtocolTests(BaseLoopTestCase):
+    def _connect(self, endpoint, **kwargs):
+        endpoint.transport = WebSocketWriter(None)
+        protocol = WebSocketProtocol(endpoint, WebSocketParser(None), loop=self.loop, **kwargs)
+        transport = unittest.mock.Mock()
+        protocol.connection_made(transport)
+        return protocol, transport
+
+    def test_messages(self):
+        received = []
+
+        @asyncio.coroutine
+        def on_message(message):
+            received.append(message)
+
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'])
+        endpoint.on_message = on_message
+        protocol, transport = self._connect(endpoint)
+        endpoint.on_connect.assert_called_once_with()
+        self.assertIs(endpoint.transport._transport, protocol)
+        protocol.data_received(FrameBuilder.text('a') + FrameBuilder.ping(b'p'))
+        transport.write.assert_called_once_with(FrameBuilder.pong(b'p', masked=False))
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(received, ['a'])
+        protocol.data_received(FrameBuilder.close())
+        transport.write.assert_called_with(FrameBuilder.close(masked=False))
+        transport.close.assert_called_once_with()
+        protocol.connection_lost(None)
+        endpoint.on_close.assert_called_once_with(None)
+
+    def test_invalid_payload(self):
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'])
+        protocol, transport = self._connect(endpoint, codec=JsonCodec())
+        protocol.data_received(FrameBuilder.text('{'))
+        transport.write.assert_called_once_with(FrameBuilder.close(1007, masked=False))
+        transport.close.assert_called_once_with()
+        self.assertFalse(endpoint.on_message.called)
+
+    def test_sequential_messages(self):
+        received = []
+        release = asyncio.Future(loop=self.loop)
+
+        @asyncio.coroutine
+        def on_message(message):
+            received.append(message)
+            if message == 'a':
+                yield from release
+
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'])
+        endpoint.on_message = on_message
+        protocol, transport = self._connect(endpoint)
+        protocol.data_received(FrameBuilder.text('a') + FrameBuilder.text('b') +
+                               FrameBuilder.ping(b'p') + FrameBuilder.close())
+        asyncio.test_utils.run_briefly(self.loop)
+        transport.pause_reading.assert_called_once_with()
+        # control frames other than close are answered right away
+        transport.write.assert_called_once_with(FrameBuilder.pong(b'p', masked=False))
+        self.assertEqual(received, ['a'])
+
+        release.set_result(None)
+        asyncio.test_utils.run_briefly(self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(received, ['a', 'b'])
+        transport.write.assert_called_with(FrameBuilder.close(masked=False))
+        transport.close.assert_called_once_with()
+        protocol.connection_lost(None)
+
+    def test_sync_messages_keep_reading(self):
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'])
+        protocol, transport = self._connect(endpoint)
+        protocol.data_received(FrameBuilder.text('a') + FrameBuilder.text('b'))
+        self.assertEqual(endpoint.on_message.call_args_list, [unittest.mock.call('a'), unittest.mock.call('b')])
+        self.assertFalse(transport.pause_reading.called)
+
+    def test_max_concurrency(self):
+        release = asyncio.Future(loop=self.loop)
+        received = []
+
+        @asyncio.coroutine
+        def on_message(message):
+            received.append(message)
+            yield from release
+
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close', 'max_concurrency', 'message_key'])
+        endpoint.on_message = on_message
+        endpoint.max_concurrency = 2
+        endpoint.message_key = lambda message: message[0]
+        protocol, transport = self._connect(endpoint)
+        protocol.data_received(b''.join(FrameBuilder.text(m) for m in ('x1', 'x2', 'y1', 'z1')))
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(received, ['x1', 'y1'])
+        # x2 and z1 fill the backlog of the dispatcher
+        transport.pause_reading.assert_called_once_with()
+        self.assertFalse(transport.resume_reading.called)
+
+        release.set_result(None)
+        for _ in range(4):
+            asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(sorted(received), ['x1', 'x2', 'y1', 'z1'])
+        transport.resume_reading.assert_called_once_with()
+        protocol.connection_lost(None)
+
+    def test_offloaded_decode(self):
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'])
+        protocol, transport = self._connect(endpoint, codec=JsonCodec(offload_threshold=1))
+        protocol.data_received(FrameBuilder.text('[1]') + FrameBuilder.text('[2]'))
+        transport.pause_reading.assert_called_once_with()
+        self.assertFalse(endpoint.on_message.called)
+        for _ in range(10):
+            self.loop.run_until_complete(asyncio.sleep(0.001, loop=self.loop))
+            if endpoint.on_message.call_count == 2:
+                break
+        self.assertEqual(endpoint.on_message.call_args_list, [unittest.mock.call([1]), unittest.mock.call([2])])
+        transport.resume_reading.assert_called_once_with()
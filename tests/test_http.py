@@ -9,8 +9,14 @@ from vase.http import (
     HttpParser,
     HttpWriter,
     BadRequestException,
+    HttpLimits,
     _FORM_URLENCODED,
 )
+from vase.exceptions import (
+    RequestEntityTooLargeException,
+    RequestHeaderFieldsTooLargeException,
+    RequestUriTooLongException,
+)
 from vase.util import MultiDict
 
 
@@ -195,6 +201,71 @@ class HttpParserTests(unittest.TestCase):
         body = self.loop.run_until_complete(asyncio.Task(result.body.read(), loop=self.loop))
         self.assertEqual(body, b'')
 
+    def test_chunked_body(self):
+        req = (b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+               b'5\r\nHello\r\n0\r\n\r\n')
+        transport = unittest.mock.Mock()
+        transport.get_extra_info.return_value = ('127.0.0.1', 1)
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.set_transport(transport)
+        task = asyncio.Task(HttpParser.parse(stream), loop=self.loop)
+        self.loop.call_soon(lambda: stream.feed_data(req))
+        result = self.loop.run_until_complete(task)
+        self.assertTrue(result.is_chunked())
+
+        body = self.loop.run_until_complete(asyncio.Task(result.body.read(), loop=self.loop))
+        self.assertEqual(body, b'Hello')
+
+    def test_form_is_lazy(self):
+        req = (b'POST / HTTP/1.1\r\nContent-Type: application/x-www-form-urlencoded\r\n'
+               b'Content-Length: 7\r\n\r\nfoo=bar')
+        transport = unittest.mock.Mock()
+        transport.get_extra_info.return_value = ('127.0.0.1', 1)
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.set_transport(transport)
+        task = asyncio.Task(HttpParser.parse(stream), loop=self.loop)
+        self.loop.call_soon(lambda: stream.feed_data(req))
+        result = self.loop.run_until_complete(task)
+        self.assertEqual(result.POST, MultiDict())
+        self.assertEqual(result.body.bytes_left, 7)
+
+        post = self.loop.run_until_complete(asyncio.Task(result.post(), loop=self.loop))
+        self.assertEqual(post, MultiDict(foo=['bar']))
+        self.assertIs(post, result.POST)
+
+    def _parse(self, data, limits):
+        transport = unittest.mock.Mock()
+        transport.get_extra_info.return_value = ('127.0.0.1', 1)
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.set_transport(transport)
+        stream.feed_data(data)
+        return self.loop.run_until_complete(HttpParser.parse(stream, limits))
+
+    def test_limits(self):
+        limits = HttpLimits(max_request_line=20, max_headers=2, max_header_size=40, max_body_size=10,
+                            max_form_parts=5)
+        req = self._parse(b'GET /foo HTTP/1.1\r\nFoo: bar\r\nContent-Length: 10\r\n\r\n', limits)
+        self.assertEqual(req.get('foo'), 'bar')
+        self.assertEqual(req.max_form_parts, 5)
+
+        self.assertRaises(RequestUriTooLongException, self._parse,
+                          b'GET /' + b'a' * 20 + b' HTTP/1.1\r\n\r\n', limits)
+        self.assertRaises(RequestHeaderFieldsTooLargeException, self._parse,
+                          b'GET / HTTP/1.1\r\nA: 1\r\nB: 2\r\nC: 3\r\n\r\n', limits)
+        self.assertRaises(RequestHeaderFieldsTooLargeException, self._parse,
+                          b'GET / HTTP/1.1\r\nA: ' + b'a' * 40 + b'\r\n\r\n', limits)
+        self.assertRaises(RequestHeaderFieldsTooLargeException, self._parse,
+                          b'GET / HTTP/1.1\r\nA: ' + b'a' * 20 + b'\r\nB: ' + b'b' * 20 + b'\r\n\r\n', limits)
+        self.assertRaises(RequestEntityTooLargeException, self._parse,
+                          b'GET / HTTP/1.1\r\nContent-Length: 11\r\n\r\n', limits)
+
+    def test_chunked_body_limit(self):
+        limits = HttpLimits(max_body_size=10)
+        req = self._parse(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                          b'6\r\nHello \r\n6\r\nworld!\r\n0\r\n\r\n', limits)
+        self.assertEqual(self.loop.run_until_complete(req.body.read(6)), b'Hello ')
+        self.assertRaises(RequestEntityTooLargeException, self.loop.run_until_complete, req.body.read())
+
 
 class HttpWriterTests(unittest.TestCase):
 
@@ -0,0 +1,30 @@
+import os
+import unittest
+
+from vase import masking
+
+
+class MaskingTests(unittest.TestCase):
+    SIZES = (0, 1, 3, 4, 5, 125, 4095, 4096, 4097, 70001)
+
+    def _check(self, func):
+        for size in self.SIZES:
+            payload = os.urandom(size)
+            mask = os.urandom(4)
+            expected = masking.mask_python(payload, mask)
+            self.assertEqual(func(payload, mask), expected)
+            self.assertEqual(func(memoryview(bytearray(payload)), mask), expected)
+            self.assertEqual(func(func(payload, mask), mask), payload)
+
+    def test_known_value(self):
+        self.assertEqual(masking.mask_payload(b"Hello", b'\xb4\x8dA\xa2'), b'\xfc\xe8-\xce\xdb')
+
+    def test_int(self):
+        self._check(masking.mask_int)
+
+    def test_mask_payload(self):
+        self._check(masking.mask_payload)
+
+    @unittest.skipUnless(masking.numpy, 'numpy is not installed')
+    def test_numpy(self):
+        self._check(masking.mask_numpy)
@@ -0,0 +1,40 @@
+import unittest
+
+from vase.metrics import (
+    Counter,
+    Histogram,
+    Registry,
+)
+
+
+class MetricsTests(unittest.TestCase):
+    def test_counter(self):
+        registry = Registry()
+        counter = Counter('drops_total', 'Dropped messages', registry=registry)
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.value, 3)
+        self.assertIs(registry.get('drops_total'), counter)
+        self.assertEqual(registry.render(), '# HELP drops_total Dropped messages\n# TYPE drops_total counter\n'
+                                            'drops_total 3\n')
+        self.assertRaises(ValueError, Counter, 'drops_total', registry=registry)
+        registry.unregister('drops_total')
+        self.assertIsNone(registry.get('drops_total'))
+
+    def test_histogram(self):
+        histogram = Histogram('rtt', buckets=(0.1, 1), registry=None)
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.75), 1)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+        self.assertEqual(histogram.render(), [
+            '# TYPE rtt histogram',
+            'rtt_bucket{le="0.1"} 2',
+            'rtt_bucket{le="1"} 3',
+            'rtt_bucket{le="+Inf"} 4',
+            'rtt_sum 5.65',
+            'rtt_count 4',
+        ])
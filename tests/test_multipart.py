@@ -0,0 +1,130 @@
+import asyncio
+import unittest
+
+from tests.util import BaseLoopTestCase
+from vase.exceptions import (
+    BadRequestException,
+    RequestEntityTooLargeException,
+)
+from vase.http import HttpRequest
+from vase.multipart import MultipartParser
+from vase.stream import LimitedReader
+
+
+BOUNDARY = 'xYzZY'
+
+BODY = (
+    b'preamble\r\n'
+    b'--xYzZY\r\n'
+    b'Content-Disposition: form-data; name="title"\r\n'
+    b'\r\n'
+    b'Hello\r\n'
+    b'--xYzZY\r\n'
+    b'Content-Disposition: form-data; name="upload"; filename="hello.txt"\r\n'
+    b'Content-Type: text/plain\r\n'
+    b'\r\n'
+    b'Hello world\r\n--xYz\r\n'
+    b'--xYzZY\r\n'
+    b'Content-Disposition: form-data; name="title"\r\n'
+    b'\r\n'
+    b'\xd0\xbf\xd1\x8b\r\n'
+    b'--xYzZY--\r\n'
+    b'epilogue'
+)
+
+
+class MultipartParserTests(BaseLoopTestCase):
+    def _get_body(self, data, chunk_size=3):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(data)
+        stream.feed_eof()
+        body = LimitedReader(stream, len(data))
+        body.chunk_size = chunk_size
+        return body
+
+    def _parse(self, data, **kwargs):
+        parser = MultipartParser(self._get_body(data), BOUNDARY, **kwargs)
+        return self.loop.run_until_complete(parser.parse())
+
+    def test_parse(self):
+        for chunk_size in (1, 3, 7, 2**16):
+            parser = MultipartParser(self._get_body(BODY, chunk_size), BOUNDARY)
+            fields, files = self.loop.run_until_complete(parser.parse())
+            self.assertEqual(fields.getlist('title'), ['Hello', 'пы'])
+            upload = files['upload']
+            self.assertEqual(upload.filename, 'hello.txt')
+            self.assertEqual(upload.content_type, 'text/plain')
+            self.assertEqual(upload.size, 18)
+            self.assertEqual(upload.read(), b'Hello world\r\n--xYz')
+            self.assertTrue(upload.in_memory)
+            upload.close()
+
+    def test_spill_to_disk(self):
+        fields, files = self._parse(BODY, spool_threshold=4)
+        self.assertFalse(files['upload'].in_memory)
+        self.assertEqual(files['upload'].read(), b'Hello world\r\n--xYz')
+        files['upload'].close()
+
+    def test_limits(self):
+        self.assertRaises(RequestEntityTooLargeException, self._parse, BODY, max_size=20)
+        self.assertRaises(RequestEntityTooLargeException, self._parse, BODY, max_part_size=10)
+        self.assertRaises(RequestEntityTooLargeException, self._parse, BODY, max_field_size=4)
+        self.assertRaises(RequestEntityTooLargeException, self._parse, BODY, max_header_size=20)
+        self.assertRaises(RequestEntityTooLargeException, self._parse, BODY, max_parts=2)
+        fields, files = self._parse(BODY, max_parts=3)
+        files['upload'].close()
+
+    def test_malformed(self):
+        self.assertRaises(BadRequestException, self._parse, BODY[:-30])
+        self.assertRaises(BadRequestException, self._parse, b'--xYzZYfoo')
+        self.assertRaises(BadRequestException, self._parse,
+                          b'--xYzZY\r\nContent-Type: text/plain\r\n\r\nfoo\r\n--xYzZY--')
+        self.assertRaises(BadRequestException, MultipartParser, None, '')
+
+    def test_bad_charset(self):
+        field = (b'--xYzZY\r\nContent-Disposition: form-data; name="title"\r\n'
+                 b'Content-Type: text/plain; charset={}\r\n\r\n{}\r\n--xYzZY--')
+        self.assertRaises(BadRequestException, self._parse, field.replace(b'{}', b'no-such-charset', 1))
+        self.assertRaises(BadRequestException, self._parse,
+                          field.replace(b'{}', b'utf-8', 1).replace(b'{}', b'\xff'))
+        fields, files = self._parse(field.replace(b'{}', b'latin-1', 1).replace(b'{}', b'\xff'))
+        self.assertEqual(fields['title'], '\xff')
+
+
+class MultipartRequestTests(BaseLoopTestCase):
+    def test_post(self):
+        request = HttpRequest('POST', '/', 'HTTP/1.1')
+        request.add_header('Content-Type', 'multipart/form-data; boundary="{}"'.format(BOUNDARY))
+        request.add_header('Content-Length', str(len(BODY)))
+        self.assertTrue(request._has_form())
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(BODY)
+        request.body = stream
+
+        post = self.loop.run_until_complete(request.post())
+        self.assertEqual(post['title'], 'Hello')
+        self.assertEqual(request.FILES['upload'].read(), b'Hello world\r\n--xYz')
+        request.close()
+        self.assertTrue(request.FILES['upload'].file.closed)
+
+    def test_max_form_parts(self):
+        request = HttpRequest('POST', '/', 'HTTP/1.1')
+        request.add_header('Content-Type', 'multipart/form-data; boundary="{}"'.format(BOUNDARY))
+        request.add_header('Content-Length', str(len(BODY)))
+        request.max_form_parts = 2
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(BODY)
+        request.body = stream
+        self.assertRaises(RequestEntityTooLargeException, self.loop.run_until_complete, request.post())
+
+    def test_urlencoded_limits(self):
+        for body, limit, exc in ((b'a=1&b=2&c=3', 2, RequestEntityTooLargeException),
+                                 (b'a=\xff', None, BadRequestException)):
+            request = HttpRequest('POST', '/', 'HTTP/1.1')
+            request.add_header('Content-Type', 'application/x-www-form-urlencoded')
+            request.add_header('Content-Length', str(len(body)))
+            request.max_form_parts = limit
+            stream = asyncio.StreamReader(loop=self.loop)
+            stream.feed_data(body)
+            request.body = stream
+            self.assertRaises(exc, self.loop.run_until_complete, request.post())
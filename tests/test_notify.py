@@ -0,0 +1,50 @@
+import asyncio
+
+from tests.util import BaseLoopTestCase
+from vase.notify import Notifier
+
+
+class NotifierTests(BaseLoopTestCase):
+    def test_wakeup(self):
+        notifier = Notifier(loop=self.loop)
+        task = asyncio.async(notifier.wait(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertTrue(notifier.waiting)
+        notifier.notify()
+        notifier.notify()
+        self.loop.run_until_complete(task)
+        self.assertFalse(notifier.waiting)
+
+    def test_coalesced(self):
+        notifier = Notifier(loop=self.loop)
+        for i in range(3):
+            notifier.notify()
+        self.assertIsNone(notifier._waiter)
+        self.loop.run_until_complete(notifier.wait())
+        task = asyncio.async(notifier.wait(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertFalse(task.done())
+        notifier.notify()
+        self.loop.run_until_complete(task)
+
+    def test_clear(self):
+        notifier = Notifier(loop=self.loop)
+        notifier.notify()
+        notifier.clear()
+        task = asyncio.async(notifier.wait(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertFalse(task.done())
+        task.cancel()
+        self.assertRaises(asyncio.CancelledError, self.loop.run_until_complete, task)
+        self.assertFalse(notifier.waiting)
+
+    def test_replaced_receiver(self):
+        notifier = Notifier(loop=self.loop)
+        first = asyncio.async(notifier.wait(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        second = asyncio.async(notifier.wait(), loop=self.loop)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+        notifier.notify()
+        self.loop.run_until_complete(second)
@@ -0,0 +1,151 @@
+import asyncio
+import unittest
+import unittest.mock
+
+from tests.util import BaseLoopTestCase
+from vase.outbound import (
+    COALESCE,
+    DISCONNECT,
+    DROP_NEWEST,
+    DROP_OLDEST,
+    OutboundLimits,
+    OutboundQueue,
+)
+from vase.websocket import (
+    FrameBuilder,
+    WebSocketWriter,
+)
+
+
+def drain_queue(queue):
+    frames = []
+    while queue:
+        frames.append(queue.pop())
+    return frames
+
+
+class OutboundQueueTests(unittest.TestCase):
+    def test_drop_oldest(self):
+        queue = OutboundLimits(max_bytes=10, policy=DROP_OLDEST).create_queue()
+        self.assertTrue(queue.put(b'aaaa'))
+        self.assertTrue(queue.put(b'bbbb'))
+        self.assertTrue(queue.put(b'cccc'))
+        self.assertEqual(queue.size, 8)
+        self.assertEqual((queue.dropped_messages, queue.dropped_bytes), (1, 4))
+        self.assertFalse(queue.put(b'x' * 11))
+        self.assertEqual(drain_queue(queue), [b'bbbb', b'cccc'])
+        self.assertEqual(queue.size, 0)
+
+    def test_drop_newest(self):
+        queue = OutboundQueue(OutboundLimits(max_messages=2, policy=DROP_NEWEST))
+        self.assertTrue(queue.put(b'a'))
+        self.assertTrue(queue.put(b'b'))
+        self.assertFalse(queue.put(b'c'))
+        self.assertEqual(queue.dropped_messages, 1)
+        self.assertEqual(drain_queue(queue), [b'a', b'b'])
+
+    def test_coalesce(self):
+        queue = OutboundQueue(OutboundLimits(max_messages=3, policy=COALESCE))
+        queue.put(b'price:1', key='price')
+        queue.put(b'news')
+        queue.put(b'price:2', key='price')
+        queue.put(b'other', key='other')
+        self.assertEqual(queue.coalesced, 1)
+        self.assertEqual(queue.dropped_messages, 0)
+        queue.put(b'more')
+        self.assertEqual(queue.dropped_messages, 1)
+        self.assertEqual(drain_queue(queue), [b'price:2', b'other', b'more'])
+
+    def test_keys_ignored_without_coalesce(self):
+        queue = OutboundQueue(OutboundLimits())
+        queue.put(b'1', key='k')
+        queue.put(b'2', key='k')
+        self.assertEqual(drain_queue(queue), [b'1', b'2'])
+
+    def test_disconnect(self):
+        queue = OutboundQueue(OutboundLimits(max_bytes=4, policy=DISCONNECT))
+        self.assertTrue(queue.put(b'aaa'))
+        self.assertFalse(queue.overflowed)
+        self.assertFalse(queue.put(b'bb'))
+        self.assertTrue(queue.overflowed)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.dropped_messages, 2)
+
+    def test_put_control(self):
+        queue = OutboundQueue(OutboundLimits(max_messages=1))
+        queue.put(b'a')
+        queue.put_control(b'close')
+        self.assertEqual(drain_queue(queue), [b'a', b'close'])
+
+    def test_invalid_limits(self):
+        self.assertRaises(ValueError, OutboundLimits, policy='block')
+        self.assertRaises(ValueError, OutboundLimits, max_messages=0)
+
+
+class QueuedWriterTests(BaseLoopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buffer_size = 0
+        self.resumed = asyncio.Future(loop=self.loop)
+        self.http_writer = unittest.mock.Mock()
+        self.http_writer._loop = self.loop
+        del self.http_writer._ws_closing
+        self.http_writer.transport.get_write_buffer_size.side_effect = lambda: self.buffer_size
+
+        @asyncio.coroutine
+        def drain():
+            yield from self.resumed
+        self.http_writer.drain = drain
+
+    def _written(self):
+        written = []
+        for name, args, kwargs in self.http_writer.method_calls:
+            if name == 'write':
+                written.append(args[0])
+            elif name == 'writelines':
+                written.append(b''.join(args[0]))
+        return written
+
+    def test_direct_write_below_high_water(self):
+        writer = WebSocketWriter(self.http_writer, queue=OutboundLimits(high_water=10).create_queue())
+        self.assertTrue(writer.send(b'a'))
+        self.assertEqual(self._written(), [b'\x82\x01a'])
+
+    def test_queue_until_drained(self):
+        writer = WebSocketWriter(self.http_writer, queue=OutboundLimits(high_water=10, max_messages=2).create_queue())
+        self.buffer_size = 100
+        self.assertTrue(writer.send(b'a'))
+        self.assertTrue(writer.send(b'b'))
+        self.assertTrue(writer.send(b'c'))
+        self.assertEqual(writer.queue.dropped_messages, 1)
+        self.assertEqual(writer.get_write_buffer_size(), 106)
+        writer.close()
+        self.assertEqual(self._written(), [])
+
+        self.buffer_size = 0
+        self.resumed.set_result(None)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(self._written(), [b'\x82\x01b', b'\x82\x01c', FrameBuilder.close(masked=False)])
+        self.assertIsNone(writer._flusher)
+
+    def test_disconnect(self):
+        writer = WebSocketWriter(self.http_writer, queue=OutboundLimits(max_bytes=3, policy=DISCONNECT).create_queue())
+        self.buffer_size = 2**20
+        self.assertTrue(writer.send(b'a'))
+        self.assertFalse(writer.send(b'b'))
+        self.assertEqual(self._written(), [FrameBuilder.close(1008, masked=False)])
+        self.http_writer.close.assert_called_once_with()
+        self.buffer_size = 0
+        self.assertFalse(writer.send(b'c'))
+        self.resumed.set_result(None)
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(len(self._written()), 1)
+
+    def test_connection_lost(self):
+        writer = WebSocketWriter(self.http_writer, queue=OutboundLimits(high_water=10).create_queue())
+        self.buffer_size = 100
+        writer.send(b'a')
+        self.resumed.set_exception(ConnectionResetError())
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertEqual(len(writer.queue), 0)
+        self.assertEqual(self._written(), [])
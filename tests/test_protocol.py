@@ -1,8 +1,16 @@
+import asyncio
+import asyncio.test_utils
+import unittest.mock
+
 from tests.util import BaseLoopTestCase
 from vase.http import (
+    HttpLimits,
     HttpRequest,
 )
-from vase.protocol import BaseHttpProtocol
+from vase.protocol import (
+    BaseHttpProtocol,
+    BaseProcessor,
+)
 
 class BaseHttpProtocolTests(BaseLoopTestCase):
     def test_should_close_conn(self):
@@ -28,4 +36,88 @@ class BaseHttpProtocolTests(BaseLoopTestCase):
         proto1 = BaseHttpProtocol(keep_alive=0, loop=self.loop)
         self.assertTrue(proto1._should_close_conn_immediately(req))
 
+    def _connect(self, proto):
+        transport = unittest.mock.Mock()
+        transport.get_extra_info.return_value = ('127.0.0.1', 1)
+        proto.connection_made(transport)
+        return transport
+
+    def test_header_timeout(self):
+        proto = BaseHttpProtocol(limits=HttpLimits(header_timeout=0.01), loop=self.loop)
+        transport = self._connect(proto)
+        self.loop.run_until_complete(asyncio.sleep(0.02, loop=self.loop))
+        self.assertFalse(transport.write.called)
+
+        proto.data_received(b'GET / HT')
+        proto.data_received(b'TP/1.1\r\n')
+        self.loop.run_until_complete(asyncio.sleep(0.02, loop=self.loop))
+        transport.write.assert_called_with(
+            b'HTTP/1.1 408 Request Timeout\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        transport.close.assert_called_with()
+        proto.connection_lost(None)
+
+    def test_bad_request(self):
+        proto = BaseHttpProtocol(limits=HttpLimits(max_headers=1), loop=self.loop)
+        transport = self._connect(proto)
+        proto.data_received(b'GET / HTTP/1.1\r\nA: 1\r\nB: 2\r\n\r\n')
+        asyncio.test_utils.run_briefly(self.loop)
+        transport.write.assert_called_with(
+            b'HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        self.assertIsNone(proto.h_header_timeout)
+        proto.connection_lost(None)
+
+    def test_expect_continue_not_read(self):
+        proto = BaseHttpProtocol(loop=self.loop)
+        transport = self._connect(proto)
+        proto.data_received(b'POST / HTTP/1.1\r\nExpect: 100-continue\r\nContent-Length: 10\r\n\r\n')
+        asyncio.test_utils.run_briefly(self.loop)
+        transport.write.assert_called_with(b'HTTP/1.1 404 NOT FOUND\r\nContent-Length: 13\r\n\r\n404 Not Found')
+        transport.close.assert_called_with()
+        proto.connection_lost(None)
+
+    def test_unknown_expectation(self):
+        proto = BaseHttpProtocol(loop=self.loop)
+        transport = self._connect(proto)
+        proto.data_received(b'POST / HTTP/1.1\r\nExpect: foo\r\n\r\n')
+        asyncio.test_utils.run_briefly(self.loop)
+        transport.write.assert_called_with(
+            b'HTTP/1.1 417 Expectation Failed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        proto.connection_lost(None)
+
+    def _upgrade(self, transport):
+        target = unittest.mock.Mock()
+
+        class Processor(BaseProcessor):
+            @asyncio.coroutine
+            def handle_request(self, request):
+                self._protocol.upgrade(target)
+
+        proto = BaseHttpProtocol(Processor, loop=self.loop)
+        transport.get_extra_info.return_value = ('127.0.0.1', 1)
+        proto.connection_made(transport)
+        proto.data_received(b'GET / HTTP/1.1\r\nConnection: Upgrade\r\n\r\nleftover')
+        asyncio.test_utils.run_briefly(self.loop)
+        target.connection_made.assert_called_once_with(transport)
+        target.data_received.assert_called_once_with(b'leftover')
+        self.assertIsNone(proto._handler)
+        self.assertIsNone(proto.h_timeout)
+        return proto, target
+
+    def test_upgrade(self):
+        transport = unittest.mock.Mock()
+        self._upgrade(transport)
+        transport.set_protocol.assert_called_once_with(unittest.mock.ANY)
+        self.assertFalse(transport.close.called)
 
+    def test_upgrade_forwarding(self):
+        transport = unittest.mock.Mock(spec=['write', 'close', 'get_extra_info', 'resume_reading'])
+        proto, target = self._upgrade(transport)
+        proto.data_received(b'more')
+        target.data_received.assert_called_with(b'more')
+        proto.pause_writing()
+        proto.resume_writing()
+        target.pause_writing.assert_called_once_with()
+        target.resume_writing.assert_called_once_with()
+        proto.connection_lost(None)
+        target.connection_lost.assert_called_once_with(None)
+        self.assertFalse(transport.close.called)
@@ -0,0 +1,257 @@
+import asyncio
+import unittest.mock
+
+from tests.util import BaseLoopTestCase
+from vase.channels import ChannelRegistry
+from vase.http import (
+    HttpRequest,
+    HttpWriter,
+)
+from vase.sockjs import (
+    Session,
+    SessionStore,
+    SockJsHandler,
+    SockJsRoute,
+)
+from vase.outbound import (
+    DISCONNECT,
+    OutboundLimits,
+)
+from vase.sockjs.handlers import (
+    FakeTransport,
+    SOCKJS_DROPPED_MESSAGES,
+    SOCKJS_RECYCLED_RESPONSES,
+)
+
+
+class SockJsTestCase(BaseLoopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = SessionStore(disconnect_delay=0.01, loop=self.loop)
+        self.endpoints = []
+        self.handler_options = {}
+
+    def tearDown(self):
+        self.store.close()
+        super().tearDown()
+
+    def _make_endpoint(self):
+        endpoint = unittest.mock.Mock(spec=['on_connect', 'on_message', 'on_close'])
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    def _make_session(self, name, channels=None, limits=None):
+        session = Session(name, channels=channels, limits=limits, loop=self.loop)
+        session.endpoint = self._make_endpoint()
+        session.endpoint.transport = FakeTransport(session)
+        self.store.add(name, session)
+        return session
+
+    def _start(self, method, path):
+        request = HttpRequest(method, path, 'HTTP/1.1', extra={'loop': self.loop})
+        reader = asyncio.StreamReader(loop=self.loop)
+        transport = unittest.mock.Mock()
+        writer = HttpWriter(transport, None, reader, self.loop)
+        handler = SockJsHandler(request, reader, writer, self._make_endpoint, None, self.store,
+                                **self.handler_options)
+        task = asyncio.async(handler.handle(**{SockJsRoute.SOCKJS_ROUTE_MATCH: path}), loop=self.loop)
+        return task, transport
+
+    def _request(self, method, path):
+        task, transport = self._start(method, path)
+        self.loop.run_until_complete(task)
+        return self._written(transport)
+
+    def _written(self, transport):
+        return b''.join(call[0][0] for call in transport.write.call_args_list)
+
+    def _sleep(self, delay):
+        self.loop.run_until_complete(asyncio.sleep(delay, loop=self.loop))
+
+
+class SessionStoreTests(SockJsTestCase):
+    def test_expiry(self):
+        channels = ChannelRegistry()
+        session = self._make_session('a', channels)
+        channels.subscribe('room', session.endpoint.transport)
+        self.assertEqual(len(self.store), 1)
+        self._sleep(0.015)
+        # the session is marked on the first sweep and dropped on the next one
+        self.assertIn('a', self.store)
+        self._sleep(0.02)
+        self.assertNotIn('a', self.store)
+        self.assertTrue(session.expired)
+        session.endpoint.on_close.assert_called_once_with(None)
+        self.assertEqual(channels.subscriber_count('room'), 0)
+        self.assertIsNone(self.store._timer)
+
+    def test_attached_session_is_kept(self):
+        session = self._make_session('a')
+        session.attached = True
+        self._sleep(0.04)
+        self.assertIn('a', self.store)
+        session.detach()
+        self._sleep(0.04)
+        self.assertNotIn('a', self.store)
+
+    def test_closed_session(self):
+        session = self._make_session('a')
+        session.attached = True
+        session.endpoint.transport.close()
+        self._sleep(0.015)
+        # kept for a grace period to tell reconnecting clients that it is closed
+        self.assertIn('a', self.store)
+        self.assertFalse(session.endpoint.on_close.called)
+        session.detach()
+        self._sleep(0.02)
+        self.assertEqual(len(self.store), 0)
+        session.endpoint.on_close.assert_called_once_with(None)
+
+
+    def test_on_close_error(self):
+        broken = self._make_session('a')
+        broken.endpoint.on_close.side_effect = RuntimeError('on_close')
+        with unittest.mock.patch('vase.sockjs.logger') as logger:
+            self._sleep(0.035)
+        self.assertNotIn('a', self.store)
+        self.assertEqual(logger.exception.call_count, 1)
+        # the sweep is still scheduled for the sessions added afterwards
+        session = self._make_session('b')
+        self._sleep(0.035)
+        self.assertNotIn('b', self.store)
+        session.endpoint.on_close.assert_called_once_with(None)
+
+
+class SockJsHandlerTests(SockJsTestCase):
+    def test_closed_session_reconnect(self):
+        self.assertIn(b'o\n', self._request('POST', '/000/abc/xhr'))
+        session = self.store.get('abc')
+        session.endpoint.transport.close()
+        self._sleep(0.015)
+        self.assertIn(b'c[3000,"Go away!"]\n', self._request('POST', '/000/abc/xhr'))
+        self.assertIs(self.store.get('abc'), session)
+        self._sleep(0.02)
+        self.assertEqual(len(self.store), 0)
+
+    def test_xhr_session_detached(self):
+        self.assertIn(b'o\n', self._request('POST', '/000/abc/xhr'))
+        session = self.store.get('abc')
+        self.assertFalse(session.attached)
+        self.endpoints[0].on_connect.assert_called_once_with()
+
+        session.endpoint.transport.send('hi')
+        self.assertIn(b'a["hi"]\n', self._request('POST', '/000/abc/xhr'))
+        self._sleep(0.04)
+        self.assertEqual(len(self.store), 0)
+        self.endpoints[0].on_close.assert_called_once_with(None)
+
+
+class HeartbeatTests(SockJsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = SessionStore(heartbeat_delay=0.01, loop=self.loop)
+
+    def test_xhr_polling(self):
+        self._request('POST', '/000/abc/xhr')
+        task, transport = self._start('POST', '/000/abc/xhr')
+        self.loop.run_until_complete(task)
+        self.assertTrue(self._written(transport).endswith(b'\r\n\r\nh\n'))
+        self.assertIsNone(self.store.get('abc').receiver)
+
+    def _stream(self, transport_name):
+        task, transport = self._start('POST', '/000/abc/' + transport_name)
+        self._sleep(0.025)
+        self.assertIsNotNone(self.store.get('abc').receiver._writer)
+        task.cancel()
+        self.assertRaises(asyncio.CancelledError, self.loop.run_until_complete, task)
+        return self._written(transport)
+
+    def test_xhr_streaming(self):
+        self.assertIn(b'2\r\nh\n\r\n', self._stream('xhr_streaming'))
+
+    def test_eventsource(self):
+        self.assertIn(b'data: h\r\n\r\n\r\n', self._stream('eventsource'))
+
+    def test_heartbeat_error(self):
+        broken = self._make_session('a')
+        broken.receiver = unittest.mock.Mock()
+        broken.receiver.heartbeat.side_effect = ConnectionResetError()
+        session = self._make_session('b')
+        session.receiver = unittest.mock.Mock()
+        with unittest.mock.patch('vase.sockjs.logger') as logger:
+            self._sleep(0.025)
+        self.assertGreaterEqual(logger.exception.call_count, 2)
+        self.assertGreaterEqual(session.receiver.heartbeat.call_count, 2)
+        self.assertIsNotNone(self.store._heartbeat_timer)
+
+
+class ResponseLimitTests(SockJsTestCase):
+    def test_recycle(self):
+        self.handler_options['response_limit'] = 16
+        recycled = SOCKJS_RECYCLED_RESPONSES.value
+        task, transport = self._start('POST', '/000/abc/xhr_streaming')
+        asyncio.test_utils.run_briefly(self.loop)
+        fake = self.store.get('abc').endpoint.transport
+        fake.send('hello')
+        asyncio.test_utils.run_briefly(self.loop)
+        self.assertFalse(task.done())
+        fake.send('world, and more')
+        self.loop.run_until_complete(task)
+        self.assertTrue(self._written(transport).endswith(b'0\r\n\r\n'))
+        self.assertEqual(SOCKJS_RECYCLED_RESPONSES.value, recycled + 1)
+        self.assertFalse(self.store.get('abc').attached)
+
+
+class SessionNotifyTests(SockJsTestCase):
+    def test_burst_is_sent_at_once(self):
+        self._request('POST', '/000/abc/xhr')
+        task, transport = self._start('POST', '/000/abc/xhr')
+        asyncio.test_utils.run_briefly(self.loop)
+        fake = self.store.get('abc').endpoint.transport
+        for i in range(3):
+            fake.send(i)
+        self.loop.run_until_complete(task)
+        self.assertTrue(self._written(transport).endswith(b'a[0,1,2]\n'))
+
+    def test_close_ends_stream(self):
+        task, transport = self._start('POST', '/000/abc/xhr_streaming')
+        asyncio.test_utils.run_briefly(self.loop)
+        self.store.get('abc').endpoint.transport.close()
+        self.loop.run_until_complete(task)
+        self.assertTrue(self._written(transport).endswith(b'c[3000,"Go away!"]\n\r\n0\r\n\r\n'))
+
+
+class OutgoingQueueTests(SockJsTestCase):
+    def test_drop_oldest(self):
+        session = self._make_session('a', limits=OutboundLimits(max_messages=2))
+        dropped = SOCKJS_DROPPED_MESSAGES.value
+        for i in range(4):
+            self.assertTrue(session.endpoint.transport.send(i))
+        self.assertEqual(session.take_messages(), ['2', '3'])
+        self.assertEqual(SOCKJS_DROPPED_MESSAGES.value, dropped + 2)
+
+    def test_disconnect(self):
+        session = self._make_session('a', limits=OutboundLimits(max_bytes=4, policy=DISCONNECT))
+        fake = session.endpoint.transport
+        self.assertTrue(fake.send('ab'))
+        self.assertEqual(fake.get_write_buffer_size(), 4)
+        self.assertFalse(fake.send('c'))
+        self.assertTrue(session.closed)
+        self.assertEqual(session.close_frame, 'c[1008,"Message queue overflow"]')
+        self.assertFalse(fake.send('d'))
+        self.assertEqual(session.take_messages(), [])
+
+    def test_overflow_ends_stream(self):
+        self.handler_options['response_limit'] = 2**20
+        task, transport = self._start('POST', '/000/abc/xhr_streaming')
+        asyncio.test_utils.run_briefly(self.loop)
+        session = self.store.get('abc')
+        session.outgoing_messages.limits = OutboundLimits(max_messages=1, policy=DISCONNECT)
+        session.endpoint.transport.send(1)
+        session.endpoint.transport.send(2)
+        self.loop.run_until_complete(task)
+        self.assertTrue(self._written(transport).endswith(b'c[1008,"Message queue overflow"]\n\r\n0\r\n\r\n'))
+
+    def test_default_limits(self):
+        self._request('POST', '/000/abc/xhr')
+        self.assertEqual(self.store.get('abc').outgoing_messages.limits.max_bytes, 2**20)
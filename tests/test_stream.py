@@ -1,7 +1,12 @@
 import asyncio
 import unittest
 
-from vase.stream import LimitedReader
+from vase.exceptions import BadRequestException
+from vase.stream import (
+    LimitedReader,
+    ChunkedReader,
+    CountingStreamReader,
+)
 import io
 
 
@@ -56,3 +61,116 @@ class LimitedReaderTests(unittest.TestCase):
 
         result = self.loop.run_until_complete(task)
         self.assertEqual(data[:3], result)
+
+    def test_readinto(self):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(b"hello world")
+        reader = LimitedReader(stream, 5)
+        buf = bytearray(10)
+        n = self.loop.run_until_complete(reader.readinto(buf))
+        self.assertEqual(buf[:n], b"hello")
+        self.assertEqual(self.loop.run_until_complete(reader.readinto(buf)), 0)
+        self.assertTrue(reader.at_eof)
+
+    def test_expect_continue(self):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(b"hello")
+        reader = LimitedReader(stream, 5)
+        sent = []
+        reader.expect_continue(lambda: sent.append(True))
+        self.assertTrue(reader.continue_pending)
+        self.assertEqual(self.loop.run_until_complete(reader.read()), b"hello")
+        self.assertEqual(sent, [True])
+        self.assertFalse(reader.continue_pending)
+
+    def test_drain(self):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(b"hello world")
+        reader = LimitedReader(stream, 5)
+        self.loop.run_until_complete(reader.drain())
+        self.assertEqual(self.loop.run_until_complete(stream.read(6)), b" world")
+
+
+class ChunkedReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _get_reader(self, data):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(data)
+        stream.feed_eof()
+        return ChunkedReader(stream), stream
+
+    def test_read(self):
+        reader, stream = self._get_reader(b'5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\nFoo: bar\r\n\r\nGET')
+        result = self.loop.run_until_complete(reader.read())
+        self.assertEqual(result, b'hello world')
+        self.assertTrue(reader.at_eof)
+        self.assertEqual(self.loop.run_until_complete(reader.read()), b'')
+        self.assertEqual(self.loop.run_until_complete(stream.read()), b'GET')
+
+    def test_read_n(self):
+        reader, stream = self._get_reader(b'5\r\nhello\r\n0\r\n\r\n')
+        self.assertEqual(self.loop.run_until_complete(reader.read(3)), b'hel')
+        self.assertEqual(self.loop.run_until_complete(reader.read(3)), b'lo')
+        self.assertEqual(self.loop.run_until_complete(reader.read(3)), b'')
+
+    def test_iteration(self):
+        reader, stream = self._get_reader(b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+
+        @asyncio.coroutine
+        def collect():
+            chunks = []
+            while True:
+                try:
+                    chunk = yield from reader.__anext__()
+                except StopAsyncIteration:
+                    return chunks
+                chunks.append(chunk)
+
+        self.assertEqual(self.loop.run_until_complete(collect()), [b'hello', b' world'])
+
+    def test_readinto(self):
+        reader, stream = self._get_reader(b'b\r\nhello world\r\n0\r\n\r\n')
+        buf = bytearray(5)
+        n = self.loop.run_until_complete(reader.readinto(buf))
+        self.assertEqual(n, 5)
+        self.assertEqual(buf, b'hello')
+
+    def test_malformed(self):
+        for data in (b'x\r\nhello\r\n', b'5\r\nhelloXX', b'5\r\nhel', b'5'):
+            reader, stream = self._get_reader(data)
+            self.assertRaises(BadRequestException, self.loop.run_until_complete, reader.read())
+
+    def test_bad_chunk_size(self):
+        for size in (b'-1', b'0x5', b'+5', b'1_0', b' 5', b''):
+            reader, stream = self._get_reader(size + b'\r\nhello\r\n0\r\n\r\n')
+            self.assertRaises(BadRequestException, self.loop.run_until_complete, reader.read())
+            self.assertEqual(reader._read_count, 0)
+
+
+class CountingStreamReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_buffered(self):
+        stream = CountingStreamReader(loop=self.loop)
+        self.assertEqual(stream.buffered, 0)
+        stream.feed_data(b'GET / HTTP/1.1\r\n\r\nhello')
+        self.assertEqual(stream.buffered, 23)
+        self.loop.run_until_complete(stream.readline())
+        self.assertEqual(stream.buffered, 7)
+        self.loop.run_until_complete(stream.readexactly(2))
+        self.loop.run_until_complete(stream.read(3))
+        self.assertEqual(stream.buffered, 2)
+        stream.feed_eof()
+        self.loop.run_until_complete(stream.read())
+        self.assertEqual(stream.buffered, 0)
@@ -1,13 +1,22 @@
 import unittest
 import unittest.mock
 import asyncio
+from tests.util import BaseLoopTestCase
+from vase.codec import JsonCodec
+from vase.outbound import OutboundLimits
 from vase.websocket import (
     WebSocketParser,
     WebSocketWriter,
     WebSocketFormatException,
     OpCode,
     FrameBuilder,
-    Message
+    FrameDecoder,
+    Message,
+    MessageTooBigException,
+    InvalidPayloadException,
+    Utf8Text,
+    broadcast,
+    BROADCAST_DROP,
 )
 from io import BytesIO
 import gc
@@ -35,6 +44,15 @@ class FrameBuilderTests(unittest.TestCase):
         for fin, opcode, result in EXPECTED:
             self.assertEqual(FrameBuilder._build_first_byte(fin=fin, opcode=opcode), result)
 
+    def test_build_header(self):
+        for length in (0, 125, 126, 2**16 - 1, 2**16):
+            for masked in (False, True):
+                expected = (FrameBuilder._build_first_byte(True, OpCode.binary, True) +
+                            FrameBuilder._build_mask_and_length(masked, length))
+                self.assertEqual(FrameBuilder.build_header(True, OpCode.binary, length, masked=masked, rsv1=True),
+                                 expected)
+        self.assertEqual(FrameBuilder.build_header(False, OpCode.text, 5), b'\x01\x05')
+
     def test_build_mask_and_length(self):
         EXPECTED = (
             (False, 15, b'\x0f'),
@@ -359,6 +377,21 @@ class WebSocketParserTests(unittest.TestCase):
 
         self.assertIsNone(self.loop.run_until_complete(task))
 
+    def test_feed(self):
+        parser = WebSocketParser(None)
+        data = FrameBuilder.text("Hello", fin=False) + FrameBuilder.ping() + FrameBuilder.continuation(" world!")
+        messages = parser.feed(data[:-3])
+        self.assertEqual([m.opcode for m in messages], [OpCode.ping])
+        messages = parser.feed(data[-3:])
+        self.assertEqual([(m.opcode, m.payload) for m in messages], [(OpCode.text, 'Hello world!')])
+
+    def test_invalid_utf8(self):
+        reader = asyncio.StreamReader(loop=self.loop)
+        parser = WebSocketParser(reader)
+        self.loop.call_soon(lambda: reader.feed_data(FrameBuilder.text(b'\xff\xfe')))
+        task = asyncio.Task(parser.get_message(), loop=self.loop)
+        self.assertRaises(WebSocketFormatException, self.loop.run_until_complete, task)
+
     def test_eof_when_reading_payload(self):
         reader = asyncio.StreamReader(loop=self.loop)
         parser = WebSocketParser(reader)
@@ -371,6 +404,157 @@ class WebSocketParserTests(unittest.TestCase):
         self.assertIsNone(self.loop.run_until_complete(task))
 
 
+class MessageSizeTests(unittest.TestCase):
+    def test_single_frame(self):
+        parser = WebSocketParser(None, max_message_size=10)
+        self.assertEqual(parser.feed(FrameBuilder.binary(b'x' * 10))[0].payload, b'x' * 10)
+        # rejected on the header alone
+        self.assertRaises(MessageTooBigException, parser.feed, FrameBuilder.binary(b'x' * 300)[:4])
+
+    def test_fragmented(self):
+        parser = WebSocketParser(None, max_message_size=10)
+        parser.feed(FrameBuilder.text('x' * 6, fin=False))
+        with self.assertRaises(MessageTooBigException) as cm:
+            parser.feed(FrameBuilder.continuation('x' * 6))
+        self.assertEqual(cm.exception.code, 1009)
+
+    def test_control_frames_not_counted(self):
+        parser = WebSocketParser(None, max_message_size=10)
+        data = FrameBuilder.text('x' * 6, fin=False) + FrameBuilder.ping(b'p' * 20) + FrameBuilder.continuation('x' * 4)
+        self.assertEqual(len(parser.feed(data)), 2)
+
+
+class StreamingParserTests(unittest.TestCase):
+    def test_chunks(self):
+        parser = WebSocketParser(None, streaming=True)
+        data = 'Привет'.encode('utf-8')
+        chunks = parser.feed(FrameBuilder.text(data[:3], fin=False) + FrameBuilder.ping() +
+                             FrameBuilder.continuation(data[3:7], fin=False))
+        chunks += parser.feed(FrameBuilder.continuation(data[7:]) + FrameBuilder.binary(b'raw'))
+        self.assertEqual([(c.opcode, c.payload, bool(getattr(c, 'fin', True))) for c in chunks], [
+            (OpCode.text, 'П', False),
+            (OpCode.ping, b'', True),
+            (OpCode.text, 'ри', False),
+            (OpCode.text, 'вет', True),
+            (OpCode.binary, b'raw', True),
+        ])
+
+    def test_invalid_utf8(self):
+        parser = WebSocketParser(None, streaming=True)
+        parser.feed(FrameBuilder.text(b'\xd0', fin=False))
+        with self.assertRaises(InvalidPayloadException) as cm:
+            parser.feed(FrameBuilder.continuation(b''))
+        self.assertEqual(cm.exception.code, 1007)
+        self.assertRaises(InvalidPayloadException, WebSocketParser(None, streaming=True).feed,
+                          FrameBuilder.text(b'\xff', fin=False))
+
+    def test_max_size(self):
+        parser = WebSocketParser(None, streaming=True, max_message_size=8)
+        self.assertEqual(len(parser.feed(FrameBuilder.binary(b'x' * 5, fin=False))), 1)
+        self.assertRaises(MessageTooBigException, parser.feed, FrameBuilder.continuation(b'x' * 5))
+
+
+class TextValidationTests(unittest.TestCase):
+    def test_split_character(self):
+        data = 'Привет'.encode('utf-8')
+        parser = WebSocketParser(None)
+        self.assertEqual(parser.feed(FrameBuilder.text(data[:3], fin=False)), [])
+        message, = parser.feed(FrameBuilder.continuation(data[3:]))
+        self.assertEqual(message.payload, 'Привет')
+
+    def test_fails_on_first_frame(self):
+        parser = WebSocketParser(None)
+        with self.assertRaises(InvalidPayloadException) as cm:
+            parser.feed(FrameBuilder.text(b'ok \xff', fin=False))
+        self.assertEqual(cm.exception.code, 1007)
+
+    def test_truncated_character(self):
+        self.assertRaises(InvalidPayloadException, WebSocketParser(None).feed, FrameBuilder.text(b'\xd0'))
+
+    def test_raw_text(self):
+        data = 'Привет'.encode('utf-8')
+        parser = WebSocketParser(None, raw_text=True)
+        message, = parser.feed(FrameBuilder.text(data[:3], fin=False) + FrameBuilder.continuation(data[3:]))
+        self.assertIsInstance(message.payload, Utf8Text)
+        self.assertEqual(message.payload, data)
+        self.assertRaises(InvalidPayloadException, parser.feed, FrameBuilder.text(b'\xff'))
+
+    def test_send_raw_text(self):
+        transport = unittest.mock.Mock()
+        transport.transport.get_write_buffer_size.return_value = 0
+        writer = WebSocketWriter(transport)
+        writer.send(Utf8Text('Привет'.encode('utf-8')))
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), FrameBuilder.text('Привет', masked=False))
+        self.assertEqual(writer.prepare(Utf8Text(b'hi')), FrameBuilder.text('hi', masked=False))
+
+    def test_send_codec_frame_type(self):
+        class BinaryJsonCodec(JsonCodec):
+            binary = True
+
+        class TextCodec(JsonCodec):
+            def encode(self, obj):
+                return super().encode(obj).encode('utf-8')
+
+        transport = unittest.mock.Mock()
+        transport.transport.get_write_buffer_size.return_value = 0
+        writer = WebSocketWriter(transport)
+        writer.codec = BinaryJsonCodec()
+        writer.send([1])
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), FrameBuilder.binary(b'[1]', masked=False))
+        self.assertEqual(writer.prepare([1]), FrameBuilder.binary(b'[1]', masked=False))
+        writer.codec = TextCodec()
+        writer.send([1])
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), FrameBuilder.text('[1]', masked=False))
+        self.assertEqual(writer.prepare([1]), FrameBuilder.text('[1]', masked=False))
+
+
+class FrameDecoderTests(unittest.TestCase):
+    def test_many_frames_in_one_feed(self):
+        data = b''.join((
+            FrameBuilder.text("Hello", fin=False),
+            FrameBuilder.ping(b'p'),
+            FrameBuilder.continuation(" world!"),
+            FrameBuilder.binary(b' ' * 1000),
+            FrameBuilder.binary(b' ' * 67000),
+        ))
+        frames = FrameDecoder().feed(data)
+        self.assertEqual([f.opcode for f in frames],
+                         [OpCode.text, OpCode.ping, OpCode.continuation, OpCode.binary, OpCode.binary])
+        self.assertEqual([f.fin for f in frames], [0, 1, 1, 1, 1])
+        self.assertEqual(frames[0].payload, b'Hello')
+        self.assertEqual(frames[1].payload, b'p')
+        self.assertEqual(len(frames[4].payload), 67000)
+
+    def test_byte_by_byte(self):
+        data = FrameBuilder.text("Hello") + FrameBuilder.binary(b' ' * 300)
+        decoder = FrameDecoder()
+        frames = []
+        for i in range(len(data)):
+            frames.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual([f.payload for f in frames], [b'Hello', b' ' * 300])
+        self.assertEqual(decoder._buffer, b'')
+
+    def test_errors(self):
+        for frame in (b'\xff' + FrameBuilder.close()[1:],
+                      b'\x70' + FrameBuilder.close()[1:],
+                      FrameBuilder.build(fin=False, opcode=OpCode.close, payload=b'', masked=True),
+                      FrameBuilder.close(1000, payload=' ' * 126),
+                      FrameBuilder.close(masked=False)):
+            self.assertRaises(WebSocketFormatException, FrameDecoder().feed, frame)
+
+    def test_server_frames(self):
+        decoder = FrameDecoder(masked=False)
+        frames = decoder.feed(FrameBuilder.text('Hello', masked=False) + FrameBuilder.binary(b' ' * 300, masked=False))
+        self.assertEqual([f.payload for f in frames], [b'Hello', b' ' * 300])
+        self.assertRaises(WebSocketFormatException, FrameDecoder(masked=False).feed, FrameBuilder.text('Hello'))
+
+    def test_error_after_complete_frames(self):
+        decoder = FrameDecoder()
+        frames = decoder.feed(FrameBuilder.text("Hello") + FrameBuilder.close(masked=False))
+        self.assertEqual(len(frames), 1)
+        self.assertRaises(WebSocketFormatException, decoder.feed, b'')
+
+
 class WebsocketWriterTests(unittest.TestCase):
     def test_writer_creation(self):
         transport = BytesIO()
@@ -390,9 +574,135 @@ class WebsocketWriterTests(unittest.TestCase):
         transport.seek(0)
         self.assertEqual(transport.read(), b'\x81\x04\xd0\xbf\xd1\x8b')
 
+    def test_writer_send_buffers(self):
+        transport = unittest.mock.Mock()
+        transport.transport.get_write_buffer_size.return_value = 0
+        ww = WebSocketWriter(transport)
+        payload = bytearray(b'x' * 200)
+        ww.send(payload)
+        header, sent = transport.writelines.call_args[0][0]
+        self.assertEqual(header, b'\x82\x7e\x00\xc8')
+        self.assertIs(sent, payload)
+
+        view = memoryview(struct.pack('!2I', 1, 2)).cast('I')
+        ww.send(view)
+        header, sent = transport.writelines.call_args[0][0]
+        self.assertEqual(header, b'\x82\x08')
+        self.assertEqual(bytes(sent), struct.pack('!2I', 1, 2))
+
+    def test_writer_send_behind_buffered_data(self):
+        transport = unittest.mock.Mock()
+        transport.transport.get_write_buffer_size.return_value = 10
+        ww = WebSocketWriter(transport)
+        payload = bytearray(b'x' * 200)
+        ww.send(payload)
+        self.assertFalse(transport.writelines.called)
+        self.assertEqual(transport.write.call_args_list, [unittest.mock.call(b'\x82\x7e\x00\xc8'),
+                                                          unittest.mock.call(payload)])
+        self.assertIs(transport.write.call_args[0][0], payload)
+
     def test_writer_close(self):
         transport = BytesIO()
         ww = WebSocketWriter(transport)
         ww.close()
         transport.seek(0)
         self.assertEqual(transport.read(), FrameBuilder.close(masked=False))
+
+
+class CoalescingWriterTests(BaseLoopTestCase):
+    def _writer(self, limit):
+        transport = unittest.mock.Mock()
+        transport._loop = self.loop
+        transport.transport.get_write_buffer_size.return_value = 0
+        return WebSocketWriter(transport, coalesce_limit=limit), transport
+
+    def test_frames_of_one_iteration(self):
+        writer, transport = self._writer(2**16)
+        payload = bytearray(b'abc')
+        writer.send('a')
+        writer.send(payload)
+        payload[:] = b'xyz'
+        writer.send_prepared(writer.prepare('c'))
+        self.assertFalse(transport.writelines.called)
+        self.assertEqual(writer.get_write_buffer_size(), 11)
+        test_utils.run_briefly(self.loop)
+        transport.writelines.assert_called_once_with(unittest.mock.ANY)
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), b''.join((
+            FrameBuilder.text('a', masked=False),
+            FrameBuilder.binary(b'abc', masked=False),
+            FrameBuilder.text('c', masked=False),
+        )))
+        self.assertEqual(writer.get_write_buffer_size(), 0)
+
+    def test_limit(self):
+        writer, transport = self._writer(10)
+        writer.send(b'x' * 4)
+        self.assertFalse(transport.writelines.called)
+        writer.send(b'y' * 4)
+        self.assertEqual(transport.writelines.call_count, 1)
+        writer.send(b'z')
+        test_utils.run_briefly(self.loop)
+        self.assertEqual(transport.writelines.call_count, 2)
+
+    def test_high_water_counts_coalesced_frames(self):
+        transport = unittest.mock.Mock()
+        transport._loop = self.loop
+        transport.transport.get_write_buffer_size.return_value = 0
+        queue = OutboundLimits(high_water=8).create_queue()
+        writer = WebSocketWriter(transport, queue=queue, coalesce_limit=2**16)
+        writer.send(b'x' * 4)
+        writer.send(b'y' * 4)
+        self.assertEqual(len(queue), 0)
+        # 12 bytes are coalesced already, the frame is held back by the queue
+        writer.send(b'z' * 4)
+        self.assertEqual(len(queue), 1)
+        transport.writelines.assert_called_once_with(unittest.mock.ANY)
+        self.assertEqual(b''.join(transport.writelines.call_args[0][0]), b'\x82\x04xxxx\x82\x04yyyy')
+        queue.clear()
+
+    def test_close_flushes_first(self):
+        writer, transport = self._writer(2**16)
+        writer.send('bye')
+        writer.close()
+        self.assertEqual(transport.method_calls[0][0], 'writelines')
+        transport.write.assert_called_once_with(FrameBuilder.close(masked=False))
+
+
+class BroadcastTests(unittest.TestCase):
+    def _make_writer(self, buffer_size=0):
+        transport = unittest.mock.Mock()
+        transport.transport.get_write_buffer_size.return_value = buffer_size
+        return WebSocketWriter(transport), transport
+
+    def test_encode_once(self):
+        writers = [self._make_writer() for i in range(3)]
+        fake = unittest.mock.Mock(spec=['send'])
+        with unittest.mock.patch.object(FrameBuilder, 'build', wraps=FrameBuilder.build) as build:
+            slow = broadcast('пы', [w for w, t in writers] + [fake])
+        self.assertEqual(slow, [])
+        self.assertEqual(build.call_count, 1)
+        for w, t in writers:
+            t.write.assert_called_once_with(b'\x81\x04\xd0\xbf\xd1\x8b')
+        fake.send.assert_called_once_with('пы')
+
+    def test_slow_receivers(self):
+        fast, fast_transport = self._make_writer()
+        slow, slow_transport = self._make_writer(2**21)
+        self.assertEqual(broadcast(b'Hello', [fast, slow]), [slow])
+        fast_transport.write.assert_called_once_with(b'\x82\x05Hello')
+        self.assertFalse(slow_transport.write.called)
+        self.assertFalse(slow_transport.transport.abort.called)
+
+        self.assertEqual(broadcast(b'Hello', [fast, slow], policy=BROADCAST_DROP), [slow])
+        slow_transport.transport.abort.assert_called_once_with()
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, broadcast, b'', [], policy='block')
+
+    def test_cache_per_codec(self):
+        plain, plain_transport = self._make_writer()
+        json_writer, json_transport = self._make_writer()
+        json_writer.codec = JsonCodec()
+        broadcast('a', [plain, json_writer])
+        plain_transport.write.assert_called_once_with(b'\x81\x01a')
+        json_transport.write.assert_called_once_with(b'\x81\x03"a"')
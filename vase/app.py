@@ -11,6 +11,7 @@ from .routing import (
     WebSocketRoute,
 )
 from .sockjs import SockJsRoute
+from .channels import ChannelRegistry
 from .routing import RequestSpec
 
 __all__ = ["Vase"]
@@ -30,6 +31,7 @@ class Vase:
     def __init__(self, name):
         self._name = name
         self._routes = []
+        self.channels = ChannelRegistry()
 
     @asyncio.coroutine
     def _handle_404(self, request, start_response):
@@ -41,33 +43,37 @@ class Vase:
         start_response(b'404 Not Found', headers)
         return [data]
 
-    def route(self, *, path, methods=('get', 'post')):
+    def route(self, *, path, methods=('get', 'post'), timeout=None, expect_handler=None):
         spec = RequestSpec(path, methods)
         def wrap(func):
-            self._routes.append(CallbackRoute(CallbackRouteHandler, spec, self._decorate_callback(func)))
+            self._routes.append(CallbackRoute(CallbackRouteHandler, spec, self._decorate_callback(func),
+                                              timeout=timeout, expect_handler=expect_handler))
             return func
 
         return wrap
 
-    def endpoint(self, *, path, with_sockjs=True):
+    def endpoint(self, *, path, with_sockjs=True, **sockjs_options):
+        """
+        Registers an endpoint class, `sockjs_options` such as `disconnect_delay` are passed to the SockJsRoute
+        """
         spec = RequestSpec(path)
 
         def wrap(cls):
             if with_sockjs:
-                self._routes.append(SockJsRoute(spec, cls))
+                self._routes.append(SockJsRoute(spec, cls, channels=self.channels, **sockjs_options))
             else:
-                self._routes.append(WebSocketRoute(spec, cls))
+                self._routes.append(WebSocketRoute(spec, cls, channels=self.channels))
             return cls
 
         return wrap
 
-    def run(self, *, host='0.0.0.0', port=3000, loop=None):
+    def run(self, *, host='0.0.0.0', port=3000, limits=None, loop=None):
         if loop is None:
             loop = asyncio.get_event_loop()
 
         def processor_factory(transport, protocol, reader, writer):
             return RoutingHttpProcessor(transport, protocol, reader, writer, routes=self._routes)
-        asyncio.async(loop.create_server(lambda: BaseHttpProtocol(processor_factory, loop=loop),
+        asyncio.async(loop.create_server(lambda: BaseHttpProtocol(processor_factory, limits=limits, loop=loop),
                     host, port))
         loop.run_forever()
 
@@ -0,0 +1,68 @@
+import asyncio
+
+
+class CancellationToken:
+    """
+    Request scoped cancellation flag
+
+    The token is cancelled when the client goes away or the request deadline
+    is exceeded. Coroutines can check `cancelled` or call `raise_if_cancelled()`,
+    functions running in a thread pool can poll `cancelled` safely.
+    Futures linked with `link()` are cancelled together with the token.
+    """
+    def __init__(self, *, loop=None):
+        self._loop = loop
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        if self._cancelled:
+            return False
+        self._cancelled = True
+        callbacks = self._callbacks
+        self._callbacks = []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def add_callback(self, callback):
+        if self._cancelled:
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        try:
+            self._callbacks.remove(callback)
+        except ValueError:
+            pass
+
+    def raise_if_cancelled(self):
+        if self._cancelled:
+            raise asyncio.CancelledError()
+
+    def link(self, fut):
+        """
+        Cancels `fut` when the token is cancelled
+        """
+        fut = asyncio.async(fut, loop=self._loop)
+        callback = fut.cancel
+        self.add_callback(callback)
+        fut.add_done_callback(lambda f: self.remove_callback(callback))
+        return fut
+
+    def run_in_executor(self, executor, func, *args):
+        """
+        Runs `func` in `executor`, the resulting future is linked to the token.
+
+        A function that has not started yet is not run at all after cancellation,
+        a running one should poll `cancelled` to stop early.
+        """
+        loop = self._loop
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        return self.link(loop.run_in_executor(executor, func, *args))
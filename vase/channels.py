@@ -0,0 +1,59 @@
+"""
+Publish/subscribe channels shared by the endpoints of an application
+"""
+from .websocket import broadcast
+
+
+class ChannelRegistry:
+    """
+    Keeps track of the transports subscribed to each channel
+
+    Any transport can be subscribed, raw WebSocket and SockJS alike.
+    Handlers remove a transport from all of its channels once its connection is gone.
+    """
+    def __init__(self):
+        self._channels = {}
+        self._memberships = {}
+
+    def subscribe(self, channel, transport):
+        self._channels.setdefault(channel, set()).add(transport)
+        self._memberships.setdefault(transport, set()).add(channel)
+
+    def unsubscribe(self, channel, transport):
+        subscribers = self._channels.get(channel)
+        if subscribers is None or transport not in subscribers:
+            return
+        subscribers.discard(transport)
+        if not subscribers:
+            del self._channels[channel]
+        channels = self._memberships[transport]
+        channels.discard(channel)
+        if not channels:
+            del self._memberships[transport]
+
+    def unsubscribe_all(self, transport):
+        for channel in tuple(self._memberships.get(transport, ())):
+            self.unsubscribe(channel, transport)
+
+    def publish(self, channel, message, **kwargs):
+        """
+        Sends `message` to every subscriber of `channel`
+
+        `kwargs` are passed to `broadcast()`, returns the list of slow subscribers.
+        """
+        subscribers = self._channels.get(channel)
+        if not subscribers:
+            return []
+        return broadcast(message, subscribers, **kwargs)
+
+    def subscriber_count(self, channel):
+        return len(self._channels.get(channel, ()))
+
+    def counts(self):
+        """
+        Returns a dict of channel names to their number of subscribers
+        """
+        return {channel: len(subscribers) for channel, subscribers in self._channels.items()}
+
+    def channels_of(self, transport):
+        return frozenset(self._memberships.get(transport, ()))
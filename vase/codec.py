@@ -0,0 +1,113 @@
+"""
+Message codecs for negotiated WebSocket subprotocols
+
+An endpoint maps subprotocol names to codecs, preferred ones first:
+
+    subprotocols = OrderedDict([('v1.msgpack', MsgpackCodec()), ('v1.json', JsonCodec())])
+
+Messages are then decoded before `on_message` and `transport.send()` encodes them.
+msgpack and cbor2 are optional dependencies, their codecs raise RuntimeError when they are missing.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+
+class Codec:
+    """
+    Base class of codecs
+
+    `binary` codecs are sent in binary frames, the others in text frames.
+    Payloads of at least `offload_threshold` bytes are decoded in `executor`
+    instead of the event loop. `decode` raises ValueError on malformed payloads.
+    """
+    name = None
+    binary = True
+
+    def __init__(self, *, offload_threshold=None, executor=None):
+        self.offload_threshold = offload_threshold
+        self.executor = executor
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+    def decode(self, payload):
+        raise NotImplementedError
+
+    def should_offload(self, payload):
+        return self.offload_threshold is not None and len(payload) >= self.offload_threshold
+
+
+class JsonCodec(Codec):
+    name = 'json'
+    binary = False
+
+    def encode(self, obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    def decode(self, payload):
+        if isinstance(payload, bytes):
+            try:
+                payload = payload.decode('utf-8')
+            except UnicodeDecodeError as e:
+                raise ValueError(str(e)) from e
+        return json.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+
+    def __init__(self, **kwargs):
+        if msgpack is None:  # pragma: no cover
+            raise RuntimeError('msgpack is not installed')
+        super().__init__(**kwargs)
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, payload):
+        if isinstance(payload, str):
+            raise ValueError('msgpack messages must be binary')
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise ValueError(str(e)) from e
+
+
+class CborCodec(Codec):
+    name = 'cbor'
+
+    def __init__(self, **kwargs):
+        if cbor2 is None:  # pragma: no cover
+            raise RuntimeError('cbor2 is not installed')
+        super().__init__(**kwargs)
+
+    def encode(self, obj):
+        return cbor2.dumps(obj)
+
+    def decode(self, payload):
+        if isinstance(payload, str):
+            raise ValueError('CBOR messages must be binary')
+        try:
+            return cbor2.loads(payload)
+        except Exception as e:
+            raise ValueError(str(e)) from e
+
+
+def select_subprotocol(header, subprotocols):
+    """
+    Returns the first of `subprotocols` offered in the Sec-WebSocket-Protocol header, or None
+    """
+    offered = {p.strip() for p in header.split(',')}
+    for name in subprotocols:
+        if name in offered:
+            return name
+    return None
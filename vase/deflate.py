@@ -0,0 +1,245 @@
+"""
+permessage-deflate WebSocket extension (RFC 7692)
+"""
+import zlib
+
+EXTENSION_NAME = 'permessage-deflate'
+
+# a few KB of compressed data can inflate to gigabytes
+DEFAULT_MAX_INFLATED_SIZE = 2**24
+
+_EMPTY_BLOCK = b'\x00\x00\xff\xff'
+
+_PARAMS = frozenset((
+    'server_no_context_takeover',
+    'client_no_context_takeover',
+    'server_max_window_bits',
+    'client_max_window_bits',
+))
+
+
+def parse_extensions(header):
+    """
+    Parses a Sec-WebSocket-Extensions header into a list of (name, params) tuples
+    """
+    result = []
+    for offer in header.split(','):
+        parts = [p.strip() for p in offer.split(';')]
+        name = parts[0].lower()
+        if not name:
+            continue
+        params = {}
+        for part in parts[1:]:
+            if not part:
+                continue
+            key, sep, value = part.partition('=')
+            params[key.strip().lower()] = value.strip().strip('"') if sep else None
+        result.append((name, params))
+    return result
+
+
+def _window_bits(value):
+    try:
+        bits = int(value)
+    except (TypeError, ValueError):
+        return None
+    if 8 <= bits <= 15:
+        return bits
+    return None
+
+
+def _deflate_memory(window_bits, mem_level):
+    # see zconf.h
+    return (1 << (window_bits + 2)) + (1 << (mem_level + 9))
+
+
+def _inflate_memory(window_bits):
+    return (1 << window_bits) + 7168
+
+
+class DeflateOptions:
+    """
+    permessage-deflate settings of an endpoint
+
+    Messages shorter than `threshold` bytes are sent uncompressed.
+    `max_memory` caps the memory held by the zlib contexts of a single connection,
+    window sizes are reduced and context takeover is disabled until they fit.
+    Incoming messages are never inflated past `max_inflated_size` bytes, whatever
+    the `max_message_size` of the endpoint.
+    """
+    def __init__(self, *, server_no_context_takeover=False, client_no_context_takeover=False,
+                 server_max_window_bits=15, client_max_window_bits=None,
+                 compress_level=zlib.Z_DEFAULT_COMPRESSION, mem_level=8,
+                 threshold=128, max_memory=None, max_inflated_size=DEFAULT_MAX_INFLATED_SIZE):
+        if max_inflated_size is None or max_inflated_size < 1:
+            raise ValueError('max_inflated_size must be positive')
+        if not 9 <= server_max_window_bits <= 15:
+            raise ValueError('server_max_window_bits must be between 9 and 15')
+        if client_max_window_bits is not None and not 9 <= client_max_window_bits <= 15:
+            raise ValueError('client_max_window_bits must be between 9 and 15')
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.compress_level = compress_level
+        self.mem_level = mem_level
+        self.threshold = threshold
+        self.max_memory = max_memory
+        self.max_inflated_size = max_inflated_size
+
+    def negotiate(self, header):
+        """
+        Picks the first acceptable offer of the Sec-WebSocket-Extensions header
+
+        Returns a tuple of (PerMessageDeflate, response header value),
+        or (None, None) when nothing could be accepted.
+        """
+        for name, params in parse_extensions(header):
+            if name != EXTENSION_NAME:
+                continue
+            result = self._accept(params)
+            if result is not None:
+                return result
+        return None, None
+
+    def _accept(self, params):
+        if not _PARAMS.issuperset(params):
+            return None
+        for name in ('server_no_context_takeover', 'client_no_context_takeover'):
+            if name in params and params[name] is not None:
+                return None
+
+        server_no_context_takeover = self.server_no_context_takeover or 'server_no_context_takeover' in params
+        client_no_context_takeover = self.client_no_context_takeover or 'client_no_context_takeover' in params
+
+        server_bits = self.server_max_window_bits
+        if 'server_max_window_bits' in params:
+            bits = _window_bits(params['server_max_window_bits'])
+            if bits is None:
+                return None
+            if bits < server_bits:
+                server_bits = bits
+                if server_bits == 8:
+                    # zlib cannot produce raw deflate streams with 256 bytes window
+                    return None
+
+        client_bits_negotiable = 'client_max_window_bits' in params
+        client_bits = 15
+        if client_bits_negotiable:
+            offered = params['client_max_window_bits']
+            if offered is not None:
+                client_bits = _window_bits(offered)
+                if client_bits is None:
+                    return None
+            if self.client_max_window_bits is not None:
+                client_bits = min(client_bits, self.client_max_window_bits)
+
+        mem_level = self.mem_level
+        if self.max_memory is not None:
+            while True:
+                used = 0
+                if not server_no_context_takeover:
+                    used += _deflate_memory(server_bits, mem_level)
+                if not client_no_context_takeover:
+                    used += _inflate_memory(client_bits)
+                if used <= self.max_memory:
+                    break
+                if mem_level > 1:
+                    mem_level -= 1
+                elif server_bits > 9:
+                    server_bits -= 1
+                elif client_bits_negotiable and client_bits > 9:
+                    client_bits -= 1
+                elif not server_no_context_takeover:
+                    server_no_context_takeover = True
+                elif not client_no_context_takeover:
+                    client_no_context_takeover = True
+                else:  # pragma: no cover
+                    break
+
+        response = [EXTENSION_NAME]
+        if server_no_context_takeover:
+            response.append('server_no_context_takeover')
+        if client_no_context_takeover:
+            response.append('client_no_context_takeover')
+        if server_bits != 15:
+            response.append('server_max_window_bits={}'.format(server_bits))
+        if client_bits_negotiable and client_bits != 15:
+            response.append('client_max_window_bits={}'.format(client_bits))
+
+        extension = PerMessageDeflate(
+            server_no_context_takeover=server_no_context_takeover,
+            client_no_context_takeover=client_no_context_takeover,
+            server_max_window_bits=server_bits,
+            client_max_window_bits=client_bits,
+            compress_level=self.compress_level,
+            mem_level=mem_level,
+            threshold=self.threshold,
+            max_inflated_size=self.max_inflated_size,
+        )
+        return extension, '; '.join(response)
+
+
+class PerMessageDeflate:
+    """
+    Negotiated permessage-deflate state of a single connection
+
+    zlib contexts are created lazily and dropped after every message
+    when context takeover is disabled for that direction.
+    """
+    __slots__ = ('server_no_context_takeover', 'client_no_context_takeover',
+                 'server_max_window_bits', 'client_max_window_bits',
+                 'compress_level', 'mem_level', 'threshold', 'max_inflated_size',
+                 '_compressor', '_decompressor')
+
+    def __init__(self, *, server_no_context_takeover=False, client_no_context_takeover=False,
+                 server_max_window_bits=15, client_max_window_bits=15,
+                 compress_level=zlib.Z_DEFAULT_COMPRESSION, mem_level=8, threshold=128,
+                 max_inflated_size=DEFAULT_MAX_INFLATED_SIZE):
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.compress_level = compress_level
+        self.mem_level = mem_level
+        self.threshold = threshold
+        self.max_inflated_size = max_inflated_size
+        self._compressor = None
+        self._decompressor = None
+
+    def should_compress(self, length):
+        return length >= self.threshold
+
+    def compress(self, payload):
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                                          -self.server_max_window_bits, self.mem_level)
+        data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data.endswith(_EMPTY_BLOCK):
+            data = data[:-4]
+        if self.server_no_context_takeover:
+            self._compressor = None
+        else:
+            self._compressor = compressor
+        return data
+
+    def decompress(self, payload, fin=True, max_length=0):
+        """
+        Inflates a part of a compressed message, `fin` marks its last part
+
+        At most `max_length` bytes are returned unless it is 0, the rest of the
+        message is then lost. Raises zlib.error on corrupted data.
+        """
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = self._decompressor = zlib.decompressobj(-self.client_max_window_bits)
+        data = decompressor.decompress(payload, max_length)
+        if decompressor.unconsumed_tail:
+            self._decompressor = None
+            return data
+        if fin:
+            data += decompressor.decompress(_EMPTY_BLOCK)
+            if self.client_no_context_takeover:
+                self._decompressor = None
+        return data
@@ -0,0 +1,119 @@
+"""
+Concurrent dispatch of incoming messages to an endpoint
+"""
+import asyncio
+from collections import deque
+
+from .log import logger
+
+
+class MessageDispatcher:
+    """
+    Runs `callback` for up to `concurrency` messages at a time
+
+    Messages that arrive while the window is full wait in a backlog of
+    `max_pending` messages, `wait_for_room()` blocks the reader once it is full.
+    When `key` is given, messages with the same `key(message)` are handled
+    one after another in the order they were submitted. A message whose key is
+    busy waits in a backlog of that key without taking a slot, it is started as
+    soon as its predecessor is done.
+    """
+    def __init__(self, callback, *, concurrency=1, key=None, max_pending=None, loop=None):
+        if concurrency < 1:
+            raise ValueError('concurrency must be positive')
+        self._callback = asyncio.coroutine(callback)
+        self._concurrency = concurrency
+        self._key = key
+        self._max_pending = concurrency if max_pending is None else max_pending
+        self._loop = loop
+        self._running = set()
+        self._pending = deque()
+        # messages waiting for a running message with the same key, by key
+        self._backlogs = {}
+        self._backlogged = 0
+        self._room = None
+        self._idle = None
+
+    @property
+    def in_flight(self):
+        return len(self._running)
+
+    @property
+    def pending(self):
+        return len(self._pending) + self._backlogged
+
+    @property
+    def has_room(self):
+        return self.pending < self._max_pending
+
+    def submit(self, message):
+        key = None if self._key is None else self._key(message)
+        if key is not None and key in self._backlogs:
+            self._backlogs[key].append(message)
+            self._backlogged += 1
+        elif len(self._running) < self._concurrency:
+            self._start(message, key)
+        else:
+            self._pending.append((message, key))
+
+    @asyncio.coroutine
+    def wait_for_room(self):
+        while not self.has_room:
+            self._room = asyncio.Future(loop=self._loop)
+            yield from self._room
+
+    @asyncio.coroutine
+    def join(self):
+        """
+        Waits until every submitted message has been handled
+        """
+        while self._running:
+            self._idle = asyncio.Future(loop=self._loop)
+            yield from self._idle
+
+    def cancel(self):
+        self._pending.clear()
+        for backlog in self._backlogs.values():
+            backlog.clear()
+        self._backlogged = 0
+        for task in self._running:
+            task.cancel()
+
+    def _start(self, message, key):
+        if key is not None:
+            self._backlogs.setdefault(key, deque())
+        task = asyncio.async(self._callback(message), loop=self._loop)
+        self._running.add(task)
+        task.add_done_callback(lambda task: self._done(task, key))
+
+    def _done(self, task, key):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("An exception occurred while handling a message", exc_info=task.exception())
+
+        if key is not None:
+            backlog = self._backlogs[key]
+            if backlog:
+                # the next message of the key takes over the slot
+                self._backlogged -= 1
+                self._start(backlog.popleft(), key)
+            else:
+                del self._backlogs[key]
+        while self._pending and len(self._running) < self._concurrency:
+            message, message_key = self._pending.popleft()
+            if message_key is not None and message_key in self._backlogs:
+                self._backlogs[message_key].append(message)
+                self._backlogged += 1
+            else:
+                self._start(message, message_key)
+        if self._room is not None and self.has_room:
+            _wake(self._room)
+            self._room = None
+        if self._idle is not None and not self._running:
+            _wake(self._idle)
+            self._idle = None
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -1,6 +1,30 @@
-
 class HttpException(Exception):
-    pass
+    status = 500
+
 
 class BadRequestException(HttpException):
-    pass
\ No newline at end of file
+    status = 400
+
+
+class UnauthorizedException(HttpException):
+    status = 401
+
+
+class RequestEntityTooLargeException(HttpException):
+    status = 413
+
+
+class ExpectationFailedException(HttpException):
+    status = 417
+
+
+class RequestTimeoutException(HttpException):
+    status = 408
+
+
+class RequestUriTooLongException(HttpException):
+    status = 414
+
+
+class RequestHeaderFieldsTooLargeException(HttpException):
+    status = 431
@@ -1,16 +1,102 @@
 import asyncio
+import collections
+import struct
 from vase.websocket import WebSocketFormatException
+from .http import RESPONSES
+from .response import HttpResponse
+from .codec import select_subprotocol
+from .dispatch import MessageDispatcher
+from .metrics import (
+    Counter,
+    Histogram,
+)
+from .exceptions import (
+    ExpectationFailedException,
+    HttpException,
+)
+from .log import logger
 from .websocket import (
+    DEFAULT_MAX_MESSAGE_SIZE,
     WebSocketWriter,
     MAGIC,
     WebSocketParser,
     FrameBuilder,
+    MessageChunk,
     OpCode
 )
 
 from hashlib import sha1
 from base64 import b64encode
 
+_timestamp = struct.Struct('!d')
+
+WEBSOCKET_RTT = Histogram('vase_websocket_rtt_seconds', 'Round-trip time of WebSocket keepalive pings')
+WEBSOCKET_DEAD_PEERS = Counter('vase_websocket_dead_peers_total',
+                               'WebSocket connections dropped after missing keepalive pongs')
+
+
+class Keepalive:
+    """
+    Pings the peer of a WebSocket connection every `interval` seconds
+
+    Pings carry the time they were sent at, so that their pongs give the round-trip time,
+    which is stored on `writer`. The connection is dropped once `max_missed` pings are left unanswered.
+    While the connection is not being read, the peer cannot be blamed for missing pongs,
+    `suspend()` skips pings and the check for missed pongs until `resume()`.
+    """
+    __slots__ = ('_stream', '_writer', '_interval', '_max_missed', '_loop', '_handle', '_pings', '_suspended')
+
+    def __init__(self, stream, writer, interval, max_missed=2, *, loop):
+        self._stream = stream
+        self._writer = writer
+        self._interval = interval
+        self._max_missed = max_missed
+        self._loop = loop
+        self._handle = None
+        self._pings = []
+        self._suspended = False
+
+    @property
+    def active(self):
+        return self._handle is not None
+
+    def start(self):
+        self._handle = self._loop.call_later(self._interval, self._send_ping)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def suspend(self):
+        self._suspended = True
+
+    def resume(self):
+        self._suspended = False
+
+    def pong_received(self, payload):
+        if payload not in self._pings:
+            return
+        # a pong answers every ping sent before it
+        del self._pings[:self._pings.index(payload) + 1]
+        rtt = self._loop.time() - _timestamp.unpack(payload)[0]
+        self._writer.rtt = rtt
+        WEBSOCKET_RTT.observe(rtt)
+
+    def _send_ping(self):
+        if self._suspended:
+            self._handle = self._loop.call_later(self._interval, self._send_ping)
+            return
+        if len(self._pings) >= self._max_missed:
+            self._handle = None
+            WEBSOCKET_DEAD_PEERS.inc()
+            self._stream.transport.abort()
+            return
+        payload = _timestamp.pack(self._loop.time())
+        self._pings.append(payload)
+        self._stream.write(FrameBuilder.ping(payload, masked=False))
+        self._handle = self._loop.call_later(self._interval, self._send_ping)
+
 
 class RequestHandler:
 
@@ -28,11 +114,13 @@ class RequestHandler:
 
 
 class CallbackRouteHandler(RequestHandler):
-    def __init__(self, request, reader, writer, callback):
+    def __init__(self, request, reader, writer, callback, *, timeout=None, expect_handler=None):
         self._request = request
         self._reader = reader
         self._writer = writer
         self._callback = callback
+        self._timeout = timeout
+        self._expect_handler = expect_handler
 
     def handle(self, **kwargs):
         def start_response(status, headers):
@@ -43,24 +131,86 @@ class CallbackRouteHandler(RequestHandler):
                 self._writer.write(data)
             return write
 
-        result = yield from self._callback(self._request, start_response, **kwargs)
+        try:
+            response = yield from self._check_expectation()
+            if response is not None:
+                self._request.close_connection = True
+                self._writer.writelines(response(start_response))
+                return
+            # the form is parsed by the callback itself with `request.post()`
+            coro = self._callback(self._request, start_response, **kwargs)
+            if self._timeout is None:
+                result = yield from coro
+            else:
+                try:
+                    result = yield from asyncio.wait_for(coro, self._timeout, loop=self._reader._loop)
+                except asyncio.TimeoutError:
+                    self._request.cancel_token.cancel()
+                    self._write_error(504)
+                    return
+        except HttpException as e:
+            # the rest of the body is in unknown state
+            self._request.close_connection = True
+            self._write_error(e.status)
+            return
         self._writer.writelines(result)
 
+    @asyncio.coroutine
+    def _check_expectation(self):
+        """
+        Runs the expect handler before the client is allowed to send the body
+
+        The handler may return an HttpResponse to reject the request with,
+        False to answer with 417 or raise an HttpException.
+        """
+        if self._expect_handler is None or not self._request.expects_continue():
+            return None
+        result = yield from asyncio.coroutine(self._expect_handler)(self._request)
+        if result is False:
+            raise ExpectationFailedException()
+        if isinstance(result, HttpResponse):
+            return result
+        return None
+
+    def _write_error(self, status):
+        if self._writer._headers_sent:
+            self._writer.close()
+            return
+        content = RESPONSES[status].encode('ascii')
+        self._writer.restore()
+        self._writer.status = status
+        self._writer.add_headers(
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(content))),
+        )
+        if self._request.close_connection:
+            self._writer['Connection'] = 'close'
+        self._writer.write_body(content)
+
 
 class WebSocketHandler(RequestHandler):
-    def __init__(self, request, reader, writer, endpoint_factory, context):
+    def __init__(self, request, reader, writer, endpoint_factory, context, *, channels=None):
         self._request = request
         self._reader = reader
         self._writer = writer
         self._endpoint_factory = endpoint_factory
         self._endpoint = None
         self._context = context
+        self._channels = channels
+        self._deflate = None
+        self._codec = None
+        self._dispatcher = None
+        self._keepalive = None
 
     def handle(self, **kwargs):
         self._endpoint = self._endpoint_factory()
         self._endpoint.bag = self._context
+        self._endpoint.channels = self._channels
 
-        self._endpoint.transport = WebSocketWriter(self._writer)
+        limits = getattr(self._endpoint, 'outbound_limits', None)
+        queue = limits.create_queue() if limits is not None else None
+        self._endpoint.transport = WebSocketWriter(self._writer, queue=queue,
+                                                   coalesce_limit=getattr(self._endpoint, 'coalesce_limit', None))
 
         if hasattr(self._endpoint, 'authorize_request'):
             if not (yield from asyncio.coroutine(self._endpoint.authorize_request)(self._request)):
@@ -84,45 +234,438 @@ class WebSocketHandler(RequestHandler):
             (b'Connection', b'Upgrade'),
             (b'Sec-WebSocket-Accept', b64encode(accept))
         )
+        extensions = self._negotiate_extensions()
+        if extensions is not None:
+            self._writer[b'Sec-WebSocket-Extensions'] = extensions.encode('ascii')
+        subprotocol = self._negotiate_subprotocol()
+        if subprotocol is not None:
+            self._writer[b'Sec-WebSocket-Protocol'] = subprotocol.encode('ascii')
         self._writer.write_body(b'')
 
+        protocol = self._writer._protocol
+        if getattr(self._endpoint, 'lean', False) and hasattr(protocol, 'upgrade'):
+            protocol.upgrade(WebSocketProtocol(
+                self._endpoint, self._build_parser(hasattr(self._endpoint, 'on_message_chunk')),
+                codec=self._codec, channels=self._channels, loop=self._reader._loop))
+            return
         yield from self._switch_protocol()
 
+    def _negotiate_extensions(self):
+        options = getattr(self._endpoint, 'permessage_deflate', None)
+        header = self._request.get('sec-websocket-extensions', '')
+        if options is None or not header:
+            return None
+        self._deflate, response = options.negotiate(header)
+        self._endpoint.transport.deflate = self._deflate
+        return response
+
+    def _negotiate_subprotocol(self):
+        subprotocols = getattr(self._endpoint, 'subprotocols', None)
+        header = self._request.get('sec-websocket-protocol', '')
+        if not subprotocols or not header:
+            return None
+        name = select_subprotocol(header, subprotocols)
+        if name is not None:
+            self._codec = subprotocols[name]
+            self._endpoint.transport.subprotocol = name
+            self._endpoint.transport.codec = self._codec
+        return name
+
     def _switch_protocol(self):
         self._endpoint.on_connect()
+        self._start_keepalive()
+        try:
+            yield from self._parse_messages()
+        finally:
+            self._stop_keepalive()
+
+    def _start_keepalive(self):
+        interval = getattr(self._endpoint, 'ping_interval', None)
+        if interval is None:
+            return
+        self._keepalive = Keepalive(self._writer, self._endpoint.transport, interval,
+                                    getattr(self._endpoint, 'max_missed_pongs', 2), loop=self._reader._loop)
+        self._keepalive.start()
 
-        yield from self._parse_messages()
+    def _stop_keepalive(self):
+        if self._keepalive is not None:
+            self._keepalive.stop()
 
     @asyncio.coroutine
     def _parse_messages(self):
-        parser = WebSocketParser(self._reader)
+        streaming = hasattr(self._endpoint, 'on_message_chunk')
+        concurrency = getattr(self._endpoint, 'max_concurrency', None)
+        # with keepalive, messages are handled one at a time by a dispatcher,
+        # so that pongs are read while a slow handler runs
+        sequential = concurrency is None and self._keepalive is not None
+        if sequential:
+            concurrency = 1
+        if concurrency is not None and not streaming:
+            self._dispatcher = MessageDispatcher(self._deliver, concurrency=concurrency,
+                                                 key=getattr(self._endpoint, 'message_key', None),
+                                                 loop=self._reader._loop)
+        parser = self._build_parser(streaming)
         while True:
             try:
                 msg = yield from parser.get_message()
-            except WebSocketFormatException:
-                self._writer.close()
+            except WebSocketFormatException as e:
+                self._close(e.code)
                 return
             if msg is None:
+                if sequential:
+                    yield from self._dispatcher.join()
+                self._endpoint.transport.flush()
                 self._writer.close()
                 return
             if msg.is_ctrl:
                 if msg.opcode == OpCode.close:
-                    if not hasattr(self._writer, '_ws_closing'):
-                        self._writer.write(FrameBuilder.close(masked=False))
-                    self._writer.close()
+                    if sequential:
+                        yield from self._dispatcher.join()
+                    self._close()
                     return
                 elif msg.opcode == OpCode.ping:
                     self._writer.write(FrameBuilder.pong(masked=False, payload=msg.payload))
+                elif msg.opcode == OpCode.pong and self._keepalive is not None:
+                    self._keepalive.pong_received(msg.payload)
+            elif streaming:
+                yield from self._while_not_reading(
+                    asyncio.coroutine(self._endpoint.on_message_chunk)(msg.payload, msg.fin))
+            elif self._dispatcher is not None:
+                # keep reading control frames while the handlers run
+                self._dispatcher.submit(msg.payload)
+                yield from self._while_not_reading(self._dispatcher.wait_for_room())
             else:
-                yield from asyncio.coroutine(self._endpoint.on_message)(msg.payload)
+                yield from self._deliver(msg.payload)
+
+    @asyncio.coroutine
+    def _while_not_reading(self, coro):
+        """
+        Runs `coro` with the keepalive suspended, pongs are not read in the meantime
+        """
+        if self._keepalive is None:
+            return (yield from coro)
+        self._keepalive.suspend()
+        try:
+            return (yield from coro)
+        finally:
+            self._keepalive.resume()
+
+    def _build_parser(self, streaming):
+        return WebSocketParser(self._reader, deflate=self._deflate,
+                               max_message_size=getattr(self._endpoint, 'max_message_size', DEFAULT_MAX_MESSAGE_SIZE),
+                               streaming=streaming, raw_text=getattr(self._endpoint, 'raw_text', False))
+
+    @asyncio.coroutine
+    def _deliver(self, payload):
+        codec = self._codec
+        if codec is not None:
+            try:
+                if codec.should_offload(payload):
+                    payload = yield from self._reader._loop.run_in_executor(codec.executor, codec.decode, payload)
+                else:
+                    payload = codec.decode(payload)
+            except ValueError:
+                self._close(1007)
+                return
+        yield from asyncio.coroutine(self._endpoint.on_message)(payload)
+
+    def _close(self, code=None):
+        """
+        Sends the close frame after the frames coalesced so far and closes the connection
+        """
+        self._endpoint.transport.flush()
+        if not hasattr(self._writer, '_ws_closing'):
+            self._writer._ws_closing = True
+            self._writer.write(FrameBuilder.close(code, masked=False))
+        self._writer.close()
 
     def persistent_connection(self):
         return True
 
     def connection_lost(self, exc):
+        self._stop_keepalive()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
         self._endpoint.on_close(exc)
+        if self._channels is not None:
+            self._channels.unsubscribe_all(self._endpoint.transport)
         if self._writer:
             self._writer.close()
 
     def on_timeout(self):
-        self._writer.write(FrameBuilder.ping(masked=False))
+        if self._keepalive is None or not self._keepalive.active:
+            self._writer.write(FrameBuilder.ping(masked=False))
+
+
+class WebSocketProtocol:
+    """
+    Compact protocol serving a WebSocket connection of a `lean` endpoint
+
+    It takes the connection over from the HTTP protocol after the handshake, so that
+    an idle connection only holds this object, its parser, the endpoint and its writer.
+    The endpoint writer uses this object as its stream.
+
+    Endpoint callbacks are called as messages arrive. When one returns a coroutine,
+    reading is paused and the following messages wait until it is done, so messages are
+    handled in order and at most one read of data is held back. `max_concurrency` and
+    `message_key` go through a `MessageDispatcher`, reading is paused while its backlog is full.
+    Codec decoding is offloaded as with `WebSocketHandler`.
+
+    Unlike `WebSocketHandler`, the connection is not pinged on the HTTP keep-alive timeout,
+    it is only pinged when `ping_interval` is set. An exception raised by a sequential
+    callback closes the connection.
+    """
+    __slots__ = ('_endpoint', '_parser', '_codec', '_channels', '_loop', '_transport',
+                 '_keepalive', '_paused', '_drain_waiter', '_ws_closing',
+                 '_backlog', '_dispatcher', '_room_waiter', '_reading_paused')
+
+    def __init__(self, endpoint, parser, *, codec=None, channels=None, loop=None):
+        self._endpoint = endpoint
+        self._parser = parser
+        self._codec = codec
+        self._channels = channels
+        self._loop = loop
+        self._transport = None
+        self._keepalive = None
+        self._paused = False
+        self._drain_waiter = None
+        self._ws_closing = False
+        # messages waiting for a sequential callback, None while nothing is pending
+        self._backlog = None
+        self._dispatcher = None
+        self._room_waiter = None
+        self._reading_paused = False
+
+    @property
+    def transport(self):
+        return self._transport
+
+    def write(self, data):
+        if self._transport is not None:
+            self._transport.write(data)
+
+    def writelines(self, data):
+        if self._transport is not None:
+            self._transport.writelines(data)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    @asyncio.coroutine
+    def drain(self):
+        if self._transport is None:
+            raise ConnectionResetError('Connection lost')
+        if self._paused:
+            self._drain_waiter = asyncio.Future(loop=self._loop)
+            yield from self._drain_waiter
+
+    def connection_made(self, transport):
+        self._transport = transport
+        endpoint = self._endpoint
+        endpoint.transport._transport = self
+        coro = self._call(endpoint.on_connect)
+        if coro is not None:
+            self._run(coro)
+        interval = getattr(endpoint, 'ping_interval', None)
+        if interval is not None:
+            self._keepalive = Keepalive(self, endpoint.transport, interval,
+                                        getattr(endpoint, 'max_missed_pongs', 2), loop=self._loop)
+            self._keepalive.start()
+
+    def data_received(self, data):
+        try:
+            messages = self._parser.feed(data)
+        except WebSocketFormatException as e:
+            self._send_close(e.code)
+            return
+        for msg in messages:
+            if self._transport is None or self._ws_closing:
+                return
+            if msg.is_ctrl and msg.opcode == OpCode.ping:
+                self.write(FrameBuilder.pong(masked=False, payload=msg.payload))
+            elif msg.is_ctrl and msg.opcode == OpCode.pong:
+                if self._keepalive is not None:
+                    self._keepalive.pong_received(msg.payload)
+            elif self._backlog is not None:
+                # the close frame waits for the messages before it as well
+                self._backlog.append(msg)
+            elif msg.is_ctrl:
+                if msg.opcode == OpCode.close:
+                    self._send_close()
+                    return
+            else:
+                self._deliver(msg)
+
+    def eof_received(self):
+        # the transport is closed
+        return False
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake_drain(None)
+
+    def connection_lost(self, exc):
+        self._transport = None
+        if self._keepalive is not None:
+            self._keepalive.stop()
+            self._keepalive = None
+        self._backlog = None
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        if self._room_waiter is not None:
+            self._room_waiter.cancel()
+        self._wake_drain(ConnectionResetError('Connection lost'))
+        self._endpoint.on_close(exc)
+        if self._channels is not None:
+            self._channels.unsubscribe_all(self._endpoint.transport)
+
+    def _deliver(self, msg):
+        concurrency = getattr(self._endpoint, 'max_concurrency', None)
+        if concurrency is not None and not isinstance(msg, MessageChunk):
+            self._dispatch(msg.payload, concurrency)
+            return
+        coro = self._handle(msg)
+        if coro is not None:
+            self._run(coro)
+
+    def _handle(self, msg):
+        """
+        Calls the endpoint with `msg`, returns the coroutine to run if it is not done yet
+        """
+        if isinstance(msg, MessageChunk):
+            return self._call(self._endpoint.on_message_chunk, msg.payload, msg.fin)
+        payload = msg.payload
+        codec = self._codec
+        if codec is not None:
+            if codec.should_offload(payload):
+                return self._decode_and_call(payload)
+            try:
+                payload = codec.decode(payload)
+            except ValueError:
+                self._send_close(1007)
+                return None
+        return self._call(self._endpoint.on_message, payload)
+
+    def _call(self, callback, *args):
+        try:
+            result = callback(*args)
+        except Exception:
+            logger.exception("An exception occurred in a WebSocket endpoint")
+            self.close()
+            return None
+        if asyncio.iscoroutine(result):
+            return result
+        return None
+
+    @asyncio.coroutine
+    def _decode_and_call(self, payload):
+        codec = self._codec
+        try:
+            payload = yield from self._loop.run_in_executor(codec.executor, codec.decode, payload)
+        except ValueError:
+            self._send_close(1007)
+            return
+        yield from asyncio.coroutine(self._endpoint.on_message)(payload)
+
+    def _run(self, coro):
+        if self._backlog is None:
+            self._backlog = collections.deque()
+        self._pause_reading()
+        asyncio.async(coro, loop=self._loop).add_done_callback(self._handled)
+
+    def _handled(self, task):
+        self._log_exception(task)
+        backlog = self._backlog
+        concurrency = getattr(self._endpoint, 'max_concurrency', None)
+        while backlog and self._transport is not None and not self._ws_closing:
+            msg = backlog.popleft()
+            if msg.is_ctrl:
+                self._backlog = None
+                self._send_close()
+                return
+            if concurrency is not None and not isinstance(msg, MessageChunk):
+                self._dispatch(msg.payload, concurrency)
+                continue
+            coro = self._handle(msg)
+            if coro is not None:
+                asyncio.async(coro, loop=self._loop).add_done_callback(self._handled)
+                return
+        self._backlog = None
+        self._maybe_resume_reading()
+
+    def _dispatch(self, payload, concurrency):
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            dispatcher = self._dispatcher = MessageDispatcher(
+                self._dispatched, concurrency=concurrency,
+                key=getattr(self._endpoint, 'message_key', None), loop=self._loop)
+        dispatcher.submit(payload)
+        if not dispatcher.has_room and self._room_waiter is None:
+            self._pause_reading()
+            self._room_waiter = asyncio.async(self._wait_for_room(), loop=self._loop)
+
+    @asyncio.coroutine
+    def _dispatched(self, payload):
+        codec = self._codec
+        if codec is not None and codec.should_offload(payload):
+            yield from self._decode_and_call(payload)
+            return
+        if codec is not None:
+            try:
+                payload = codec.decode(payload)
+            except ValueError:
+                self._send_close(1007)
+                return
+        yield from asyncio.coroutine(self._endpoint.on_message)(payload)
+
+    @asyncio.coroutine
+    def _wait_for_room(self):
+        try:
+            yield from self._dispatcher.wait_for_room()
+        finally:
+            self._room_waiter = None
+        self._maybe_resume_reading()
+
+    def _maybe_resume_reading(self):
+        if self._backlog is None and self._room_waiter is None:
+            self._resume_reading()
+
+    def _pause_reading(self):
+        # pongs are not read either, the peer is not blamed for them meanwhile
+        if not self._reading_paused and self._transport is not None:
+            self._reading_paused = True
+            self._transport.pause_reading()
+            if self._keepalive is not None:
+                self._keepalive.suspend()
+
+    def _resume_reading(self):
+        if self._reading_paused and self._transport is not None:
+            self._reading_paused = False
+            self._transport.resume_reading()
+            if self._keepalive is not None:
+                self._keepalive.resume()
+
+    def _log_exception(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("An exception occurred in a WebSocket endpoint", exc_info=task.exception())
+            self.close()
+
+    def _send_close(self, code=None):
+        self._endpoint.transport.flush()
+        if not self._ws_closing:
+            self._ws_closing = True
+            self.write(FrameBuilder.close(code, masked=False))
+        self.close()
+
+    def _wake_drain(self, exc):
+        waiter = self._drain_waiter
+        self._drain_waiter = None
+        if waiter is not None and not waiter.done():
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
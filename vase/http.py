@@ -8,9 +8,24 @@ from http.client import responses as http_responses
 from email.message import Message as EmailMessage
 import urllib.parse
 
-from .stream import LimitedReader
-from .exceptions import BadRequestException
+from .stream import (
+    LimitedReader,
+    ChunkedReader,
+)
+from .cancellation import CancellationToken
+from .exceptions import (
+    BadRequestException,
+    ExpectationFailedException,
+    RequestEntityTooLargeException,
+    RequestHeaderFieldsTooLargeException,
+    RequestUriTooLongException,
+)
 from .util import MultiDict
+from .multipart import (
+    DEFAULT_MAX_PARTS,
+    MULTIPART_FORM_DATA,
+    MultipartParser,
+)
 
 from collections import OrderedDict
 
@@ -23,6 +38,27 @@ _FORM_URLENCODED = 'application/x-www-form-urlencoded'
 RESPONSES = {x: "{} {}".format(x, y) for x, y in http_responses.items()}
 
 
+class HttpLimits:
+    """
+    Limits applied to incoming requests
+
+    `header_timeout` is the number of seconds a client has to send the request line
+    and headers once the first byte of a request has arrived.
+    `max_form_parts` bounds the number of fields and files of a form body.
+    """
+    def __init__(self, *, max_request_line=8190, max_headers=100, max_header_size=2**16,
+                 max_body_size=2**30, max_form_parts=DEFAULT_MAX_PARTS, header_timeout=10):
+        self.max_request_line = max_request_line
+        self.max_headers = max_headers
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.max_form_parts = max_form_parts
+        self.header_timeout = header_timeout
+
+
+DEFAULT_LIMITS = HttpLimits()
+
+
 class HttpRequest(EmailMessage):
     def __init__(self, method, uri, version, extra={}):
         self.method = method.upper()
@@ -37,12 +73,17 @@ class HttpRequest(EmailMessage):
         self.version = version
 
         self._content_length = 0
+        self.max_body_size = None
+        self.max_form_parts = DEFAULT_MAX_PARTS
         self._body = LimitedReader(None, 0)
         self.POST = MultiDict()
+        self.FILES = MultiDict()
         self._get = None
         self._cookies = None
         self.extra = extra
+        self.cancel_token = CancellationToken(loop=extra.get('loop'))
         self._post_inited = False
+        self.close_connection = False
         super().__init__()
 
     def add_header(self, name, value, **params):
@@ -59,7 +100,17 @@ class HttpRequest(EmailMessage):
 
     @body.setter
     def body(self, value):
-        self._body = LimitedReader(value, self._content_length)
+        if self.is_chunked():
+            self._body = ChunkedReader(value, self.max_body_size)
+        else:
+            self._body = LimitedReader(value, self._content_length)
+
+    def expects_continue(self):
+        return self.version == 'HTTP/1.1' and self.get('expect', '').lower() == '100-continue'
+
+    def is_chunked(self):
+        codings = self.get('transfer-encoding', '').lower().split(',')
+        return codings[-1].strip() == 'chunked'
 
     @property
     def GET(self):
@@ -97,16 +148,43 @@ class HttpRequest(EmailMessage):
         self._headers.append((name, v + ' ' + value))
 
     def _has_form(self):
-        return self.get('content-type', '').lower() == _FORM_URLENCODED
+        return self.get_content_type() in (_FORM_URLENCODED, MULTIPART_FORM_DATA)
 
     @asyncio.coroutine
-    def _maybe_init_post(self):
+    def _maybe_init_post(self, **options):
         if self._post_inited:
             return
-        if self._has_form():
-            body = yield from self.body.read()
-            self.POST = MultiDict(urllib.parse.parse_qs(body.decode('utf-8')))
         self._post_inited = True
+        content_type = self.get_content_type()
+        if content_type == _FORM_URLENCODED:
+            body = yield from self.body.read()
+            if self.max_form_parts is not None and body.count(b'&') >= self.max_form_parts:
+                raise RequestEntityTooLargeException()
+            try:
+                body = body.decode('utf-8')
+            except UnicodeDecodeError:
+                raise BadRequestException()
+            self.POST = MultiDict(urllib.parse.parse_qs(body))
+        elif content_type == MULTIPART_FORM_DATA:
+            options.setdefault('max_parts', self.max_form_parts)
+            parser = MultipartParser(self.body, self.get_param('boundary', ''), **options)
+            self.POST, self.FILES = yield from parser.parse()
+
+    @asyncio.coroutine
+    def post(self, **options):
+        """
+        Reads and parses the form body on first call, returns `POST`
+
+        Uploaded files of a multipart body are available in `FILES`,
+        `options` are passed to the `MultipartParser`.
+        """
+        yield from self._maybe_init_post(**options)
+        return self.POST
+
+    def close(self):
+        for name, files in self.FILES.lists():
+            for f in files:
+                f.close()
 
 
 class HttpWriter(StreamWriter):
@@ -201,8 +279,20 @@ class HttpWriter(StreamWriter):
 class HttpParser:
     @staticmethod
     @asyncio.coroutine
-    def parse(reader):
-        l = yield from reader.readline()
+    def _readline(reader, limit, exc_class):
+        try:
+            l = yield from reader.readline()
+        except ValueError:
+            # the line does not fit into the reader's buffer
+            raise exc_class()
+        if len(l) > limit + len(DELIMITER):
+            raise exc_class()
+        return l
+
+    @staticmethod
+    @asyncio.coroutine
+    def parse(reader, limits=DEFAULT_LIMITS):
+        l = yield from HttpParser._readline(reader, limits.max_request_line, RequestUriTooLongException)
         if not l:
             return
         l = l.rstrip(DELIMITER)
@@ -219,19 +309,30 @@ class HttpParser:
         extra = {
             "peername": peer,
             "sslcontext": sslctx,
+            "loop": reader._loop,
         }
 
         request = HttpRequest(method, uri, version, extra)
 
+        header_count = 0
+        header_size = 0
         while True:
-            l = yield from reader.readline()
+            l = yield from HttpParser._readline(reader, limits.max_header_size,
+                                                RequestHeaderFieldsTooLargeException)
             if not l:
                 return
             if l == DELIMITER:
                 break
 
+            header_size += len(l)
+            if header_size > limits.max_header_size:
+                raise RequestHeaderFieldsTooLargeException()
+
             l = l.rstrip(DELIMITER)
             if chr(l[0]) not in (' ', '\t'):
+                header_count += 1
+                if header_count > limits.max_headers:
+                    raise RequestHeaderFieldsTooLargeException()
                 try:
                     name, value = (x.strip().decode('ascii') for x in l.split(b':', 1))
                 except ValueError:
@@ -242,6 +343,14 @@ class HttpParser:
                 value = l.strip().decode('ascii')
                 request.append_to_last_header(value)
 
+        expect = request.get('expect')
+        if expect is not None and expect.lower() != '100-continue':
+            raise ExpectationFailedException()
+
+        max_body_size = limits.max_body_size
+        if max_body_size is not None and request._content_length > max_body_size:
+            raise RequestEntityTooLargeException()
+        request.max_body_size = max_body_size
+        request.max_form_parts = limits.max_form_parts
         request.body = reader
-        yield from request._maybe_init_post()
         return request
@@ -0,0 +1,61 @@
+"""
+WebSocket payload masking as defined in RFC 6455, section 5.3
+
+All backends return identical bytes, `mask_payload` picks the fastest one
+available for the payload size.
+"""
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# below this size the fixed cost of creating numpy arrays dominates
+NUMPY_THRESHOLD = 2**12
+
+
+def mask_python(payload, mask):
+    """Reference implementation, xors byte by byte"""
+    return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def mask_int(payload, mask):
+    """Xors the whole payload at once as a single big integer"""
+    length = len(payload)
+    if not length:
+        return b''
+    key = (bytes(mask) * (length // 4 + 1))[:length]
+    value = int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')
+    return value.to_bytes(length, 'little')
+
+
+def mask_numpy(payload, mask):
+    """Xors the payload in 32 bit words with numpy"""
+    length = len(payload)
+    if not length:
+        return b''
+    data = numpy.frombuffer(payload, dtype=numpy.uint8)
+    result = numpy.empty(length, dtype=numpy.uint8)
+    words = length // 4
+    if words:
+        key = numpy.frombuffer(bytes(mask), dtype=numpy.uint32)[0]
+        numpy.bitwise_xor(data[:words * 4].view(numpy.uint32), key, out=result[:words * 4].view(numpy.uint32))
+    for i in range(words * 4, length):
+        result[i] = data[i] ^ mask[i % 4]
+    return result.tobytes()
+
+
+BACKENDS = {
+    'python': mask_python,
+    'int': mask_int,
+}
+if numpy is not None:  # pragma: no branch
+    BACKENDS['numpy'] = mask_numpy
+
+
+def mask_payload(payload, mask):
+    """
+    Masks or unmasks `payload` (any bytes-like object) with the 4 byte `mask`
+    """
+    if numpy is not None and len(payload) >= NUMPY_THRESHOLD:
+        return mask_numpy(payload, mask)
+    return mask_int(payload, mask)
@@ -0,0 +1,111 @@
+"""
+Minimal process wide metrics
+
+Metrics are registered in `REGISTRY` and can be rendered in the Prometheus
+text exposition format with `REGISTRY.render()`.
+"""
+import bisect
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError("Metric '{}' is already registered".format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation='', *, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        return _header(self) + ['{} {}'.format(self.name, _format(self.value))]
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed upper bounds
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation='', *, buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        if registry is not None:
+            registry.register(self)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the `q` quantile
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = _header(self)
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, _format(bound), seen))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, self.count))
+        lines.append('{}_sum {}'.format(self.name, _format(self.sum)))
+        lines.append('{}_count {}'.format(self.name, self.count))
+        return lines
+
+
+def _header(metric):
+    lines = []
+    if metric.documentation:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+    lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+    return lines
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
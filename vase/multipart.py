@@ -0,0 +1,238 @@
+import asyncio
+import codecs
+import tempfile
+from email.parser import BytesHeaderParser
+
+from .exceptions import (
+    BadRequestException,
+    RequestEntityTooLargeException,
+)
+from .util import MultiDict
+
+
+MULTIPART_FORM_DATA = 'multipart/form-data'
+
+DEFAULT_MAX_SIZE = 2**30
+DEFAULT_MAX_PART_SIZE = 2**30
+DEFAULT_MAX_FIELD_SIZE = 2**16
+DEFAULT_MAX_HEADER_SIZE = 2**13
+DEFAULT_SPOOL_THRESHOLD = 2**16
+DEFAULT_MAX_PARTS = 1000
+
+_CRLF = b'\r\n'
+
+
+class UploadedFile:
+    """
+    File part of a multipart/form-data body
+
+    The content is kept in memory until it grows past the spool threshold,
+    after that it is written to a temporary file.
+    """
+    def __init__(self, name, filename, content_type, headers, *, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.size = 0
+        self._spool_threshold = spool_threshold
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+
+    def write(self, data):
+        self.size += len(data)
+        self.file.write(data)
+
+    def read(self, n=-1):
+        return self.file.read(n)
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def in_memory(self):
+        # the file is only appended to, so it rolls over once it grows past the threshold
+        return not self._spool_threshold or self.size <= self._spool_threshold
+
+    def __repr__(self):  # pragma: no cover
+        return "<UploadedFile name='{}' filename='{}' size={}>".format(self.name, self.filename, self.size)
+
+
+class _Field:
+    def __init__(self, name, charset):
+        self.name = name
+        self.charset = charset
+        self.size = 0
+        self._chunks = []
+
+    def write(self, data):
+        self.size += len(data)
+        self._chunks.append(data)
+
+    def value(self):
+        try:
+            return b''.join(self._chunks).decode(self.charset)
+        except UnicodeDecodeError:
+            raise BadRequestException()
+
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser
+
+    Reads the body chunk by chunk, only a chunk plus a boundary worth of data
+    is buffered at any time. Plain fields are collected in memory and are limited
+    by `max_field_size`, files are spooled to disk past `spool_threshold`.
+    A body of more than `max_parts` fields and files is rejected.
+    """
+    def __init__(self, body, boundary, *,
+                 max_size=DEFAULT_MAX_SIZE,
+                 max_part_size=DEFAULT_MAX_PART_SIZE,
+                 max_field_size=DEFAULT_MAX_FIELD_SIZE,
+                 max_header_size=DEFAULT_MAX_HEADER_SIZE,
+                 max_parts=DEFAULT_MAX_PARTS,
+                 spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        if isinstance(boundary, str):
+            boundary = boundary.encode('latin-1')
+        if not boundary or len(boundary) > 70:
+            raise BadRequestException()
+        self._body = body
+        self._delimiter = _CRLF + b'--' + boundary
+        self._max_size = max_size
+        self._max_part_size = max_part_size
+        self._max_field_size = max_field_size
+        self._max_header_size = max_header_size
+        self._max_parts = max_parts
+        self._part_count = 0
+        self._spool_threshold = spool_threshold
+        # the leading CRLF makes the first delimiter look like the rest of them
+        self._buffer = bytearray(_CRLF)
+        self._read_count = 0
+        self._eof = False
+        self.fields = MultiDict()
+        self.files = MultiDict()
+
+    @asyncio.coroutine
+    def _fill(self):
+        if self._eof:
+            raise BadRequestException()
+        chunk = yield from self._body.readchunk()
+        if not chunk:
+            self._eof = True
+            return
+        self._read_count += len(chunk)
+        if self._read_count > self._max_size:
+            raise RequestEntityTooLargeException()
+        self._buffer.extend(chunk)
+
+    @asyncio.coroutine
+    def parse(self):
+        """
+        Parses the body, returns a tuple of (fields, files)
+        """
+        try:
+            yield from self._parse()
+        except:
+            for f in self._all_files():
+                f.close()
+            raise
+        return self.fields, self.files
+
+    def _all_files(self):
+        for name, files in self.files.lists():
+            yield from files
+
+    @asyncio.coroutine
+    def _parse(self):
+        buf = self._buffer
+        delimiter = self._delimiter
+
+        # skip the preamble
+        while True:
+            pos = buf.find(delimiter)
+            if pos >= 0:
+                del buf[:pos + len(delimiter)]
+                break
+            del buf[:max(0, len(buf) - len(delimiter))]
+            yield from self._fill()
+
+        while True:
+            while len(buf) < 2:
+                yield from self._fill()
+            if buf[:2] == b'--':
+                break
+            if buf[:2] != _CRLF:
+                raise BadRequestException()
+            del buf[:2]
+
+            part = yield from self._read_headers()
+            yield from self._read_part_body(part)
+            if isinstance(part, UploadedFile):
+                part.seek(0)
+                self.files.setdefault(part.name, []).append(part)
+            else:
+                self.fields.setdefault(part.name, []).append(part.value())
+
+        # the epilogue is ignored
+        yield from self._body.drain()
+
+    @asyncio.coroutine
+    def _read_headers(self):
+        buf = self._buffer
+        while True:
+            pos = buf.find(_CRLF * 2)
+            if pos >= 0:
+                break
+            if len(buf) > self._max_header_size:
+                raise RequestEntityTooLargeException()
+            yield from self._fill()
+        if pos > self._max_header_size:
+            raise RequestEntityTooLargeException()
+
+        headers = BytesHeaderParser().parsebytes(bytes(buf[:pos + 4]))
+        del buf[:pos + 4]
+
+        self._part_count += 1
+        if self._max_parts is not None and self._part_count > self._max_parts:
+            raise RequestEntityTooLargeException()
+
+        name = headers.get_param('name', header='content-disposition')
+        if name is None:
+            raise BadRequestException()
+        filename = headers.get_filename()
+        if filename is None:
+            charset = headers.get_content_charset('utf-8')
+            try:
+                codecs.lookup(charset)
+            except LookupError:
+                raise BadRequestException()
+            return _Field(name, charset)
+        return UploadedFile(name, filename, headers.get_content_type(), headers,
+                            spool_threshold=self._spool_threshold)
+
+    @asyncio.coroutine
+    def _read_part_body(self, part):
+        buf = self._buffer
+        delimiter = self._delimiter
+        if isinstance(part, UploadedFile):
+            limit = self._max_part_size
+        else:
+            limit = self._max_field_size
+
+        while True:
+            pos = buf.find(delimiter)
+            if pos >= 0:
+                data, tail = pos, pos + len(delimiter)
+            else:
+                # the end of the buffer may hold the beginning of the delimiter
+                data = tail = max(0, len(buf) - len(delimiter) + 1)
+            if part.size + data > limit:
+                raise RequestEntityTooLargeException()
+            if data:
+                part.write(bytes(buf[:data]))
+            del buf[:tail]
+            if pos >= 0:
+                return
+            yield from self._fill()
@@ -0,0 +1,53 @@
+"""
+Wakeup primitive for a single receiver
+"""
+import asyncio
+
+
+class Notifier:
+    """
+    Wakes up the coroutine waiting in `wait()`
+
+    Notifications sent while nobody waits are remembered as one, so a burst of them
+    results in a single wakeup. Only the latest receiver waits, an earlier one is woken
+    up when it is replaced. Nothing is allocated unless a receiver is waiting.
+    """
+    __slots__ = ('_loop', '_waiter', '_pending')
+
+    def __init__(self, *, loop=None):
+        self._loop = loop
+        self._waiter = None
+        self._pending = False
+
+    @property
+    def waiting(self):
+        return self._waiter is not None
+
+    def notify(self):
+        waiter = self._waiter
+        if waiter is None:
+            self._pending = True
+            return
+        self._waiter = None
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def clear(self):
+        """
+        Forgets the notifications sent while nobody was waiting
+        """
+        self._pending = False
+
+    @asyncio.coroutine
+    def wait(self):
+        if self._pending:
+            self._pending = False
+            return
+        if self._waiter is not None:
+            self.notify()
+        waiter = self._waiter = asyncio.Future(loop=self._loop)
+        try:
+            yield from waiter
+        finally:
+            if self._waiter is waiter:
+                self._waiter = None
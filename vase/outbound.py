@@ -0,0 +1,128 @@
+"""
+Bounded outbound queues for slow WebSocket consumers
+
+Frames are queued only while the transport write buffer is above its high-water mark,
+the queue then keeps at most `max_bytes` and `max_messages` and applies
+the overflow policy to everything beyond that.
+"""
+from collections import OrderedDict
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+
+POLICIES = frozenset((DROP_OLDEST, DROP_NEWEST, COALESCE, DISCONNECT))
+
+# close code sent on overflow with the DISCONNECT policy
+POLICY_VIOLATION = 1008
+
+_UNKEYED = object()
+
+
+class OutboundLimits:
+    """
+    Outbound queue settings of an endpoint
+
+    With the COALESCE policy a queued message is replaced by a newer one sent
+    with the same `key`, overflow then drops the oldest messages.
+    """
+    def __init__(self, *, max_bytes=2**20, max_messages=None, policy=DROP_OLDEST, high_water=2**16):
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy '{}'".format(policy))
+        if max_messages is not None and max_messages < 1:
+            raise ValueError('max_messages must be positive')
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.policy = policy
+        self.high_water = high_water
+
+    def create_queue(self):
+        return OutboundQueue(self)
+
+
+class OutboundQueue:
+    """
+    Per connection queue of encoded frames
+    """
+    __slots__ = ('limits', 'size', 'dropped_messages', 'dropped_bytes', 'coalesced', 'overflowed',
+                 '_frames', '_counter')
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.size = 0
+        self.dropped_messages = 0
+        self.dropped_bytes = 0
+        self.coalesced = 0
+        self.overflowed = False
+        self._frames = OrderedDict()
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame, key=None):
+        """
+        Queues `frame`, returns False if it has been dropped
+
+        With the DISCONNECT policy an overflow clears the queue and sets `overflowed`,
+        the connection is expected to be closed by the caller.
+        """
+        limits = self.limits
+        if key is None or limits.policy != COALESCE:
+            self._counter += 1
+            key = (_UNKEYED, self._counter)
+        elif key in self._frames:
+            self.size -= len(self._frames.pop(key))
+            self.coalesced += 1
+
+        length = len(frame)
+        if not self._fits(length):
+            policy = limits.policy
+            if policy == DISCONNECT:
+                self._drop_all()
+                self._drop(frame)
+                self.overflowed = True
+                return False
+            if policy == DROP_NEWEST or (limits.max_bytes is not None and length > limits.max_bytes):
+                self._drop(frame)
+                return False
+            while not self._fits(length):
+                self._drop(self.pop())
+
+        self._frames[key] = frame
+        self.size += length
+        return True
+
+    def put_control(self, frame):
+        """
+        Queues a frame bypassing the limits
+        """
+        self._counter += 1
+        self._frames[(_UNKEYED, self._counter)] = frame
+        self.size += len(frame)
+
+    def pop(self):
+        frame = self._frames.popitem(last=False)[1]
+        self.size -= len(frame)
+        return frame
+
+    def clear(self):
+        self._frames.clear()
+        self.size = 0
+
+    def _fits(self, length):
+        limits = self.limits
+        if limits.max_bytes is not None and self.size + length > limits.max_bytes:
+            return False
+        if limits.max_messages is not None and len(self._frames) >= limits.max_messages:
+            return False
+        return True
+
+    def _drop(self, frame):
+        self.dropped_messages += 1
+        self.dropped_bytes += len(frame)
+
+    def _drop_all(self):
+        while self._frames:
+            self._drop(self.pop())
@@ -1,13 +1,28 @@
 import asyncio
 from .log import logger
 from vase.http import (
+    DEFAULT_LIMITS,
+    RESPONSES,
     HttpParser,
     HttpWriter
 )
-from vase.exceptions import BadRequestException
+from vase.exceptions import HttpException
+from vase.stream import CountingStreamReader
 
 _DEFAULT_KEEP_ALIVE = 20
 
+_CONTINUE_RESPONSE = b'HTTP/1.1 100 Continue\r\n\r\n'
+
+_ERROR_RESPONSES = {}
+
+
+def _error_response(status):
+    response = _ERROR_RESPONSES.get(status)
+    if response is None:
+        response = 'HTTP/1.1 {}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.format(RESPONSES[status])
+        response = _ERROR_RESPONSES[status] = response.encode('ascii')
+    return response
+
 
 class BaseProcessor:
     """Base class responsible for processing http requests"""
@@ -31,14 +46,21 @@ class BaseProcessor:
 class BaseHttpProtocol(asyncio.StreamReaderProtocol):
     processor_factory = BaseProcessor
 
-    def __init__(self, handler_factory=None, *, keep_alive=_DEFAULT_KEEP_ALIVE, loop=None):
+    def __init__(self, handler_factory=None, *, keep_alive=_DEFAULT_KEEP_ALIVE, limits=None, loop=None):
 
         if handler_factory is not None:
             self.processor_factory = handler_factory
-        self._reader = asyncio.StreamReader(loop=loop)
+        self._reader = CountingStreamReader(loop=loop)
         self._keep_alive = keep_alive
+        if limits is None:
+            limits = DEFAULT_LIMITS
+        self._limits = limits
         super().__init__(self._reader, None, loop)
         self.h_timeout = None
+        self.h_header_timeout = None
+        self._parsing_headers = False
+        self._request = None
+        self._upgraded = None
 
     def connection_made(self, transport):
         self._transport = transport
@@ -50,50 +72,156 @@ class BaseHttpProtocol(asyncio.StreamReaderProtocol):
 
         self._handler = self._build_handler()
 
-        self._task = asyncio.async(self._handle_client())
+        self._task = asyncio.async(self._handle_client(), loop=self._loop)
         self._task.add_done_callback(self._maybe_log_exception)
 
         self._reset_timeout()
 
     def connection_lost(self, exc):
+        if self._upgraded is not None:
+            self._upgraded.connection_lost(exc)
+            return
         self._task.cancel()
         self._task = None
+        if self._request is not None:
+            self._request.cancel_token.cancel()
+            self._request = None
         handler = self._handler
         self._writer = None
         self._handler = None
         self._stop_timeout()
+        self._stop_header_timeout()
         try:
             handler.connection_lost(exc)
         finally:
             super().connection_lost(exc)
 
     def data_received(self, data):
+        if self._upgraded is not None:
+            self._upgraded.data_received(data)
+            return
         self._reset_timeout()
+        if self._parsing_headers and self.h_header_timeout is None:
+            self._start_header_timeout()
         super().data_received(data)
 
     @asyncio.coroutine
     def _handle_client(self):
         while True:
+            self._parsing_headers = True
+            if self._reader.buffered:
+                self._start_header_timeout()
             try:
-                req = yield from HttpParser.parse(self._reader)
-            except BadRequestException as e:
-                self._bad_request(self._writer, e)
-                self._writer.close()
+                req = yield from HttpParser.parse(self._reader, self._limits)
+            except HttpException as e:
+                self._write_error(e.status)
                 break
+            finally:
+                self._parsing_headers = False
+                self._stop_header_timeout()
             # connection has been closed
             if req is None:
                 break
 
+            self._request = req
+            if req.expects_continue():
+                req.body.expect_continue(self._send_continue)
             try:
                 yield from self._handler.handle_request(req)
+            except HttpException as e:
+                req.close_connection = True
+                if self._writer is not None and not self._writer._headers_sent:
+                    self._write_error(e.status)
             finally:
+                self._request = None
+                req.close()
+                if req.body.continue_pending:
+                    # the client is still waiting for '100 Continue', there is no body to drain
+                    req.close_connection = True
                 if self._should_close_conn_immediately(req):
                     if self._writer:
                         self._writer.close()
                 else:
-                    yield from req.body.read()
+                    try:
+                        yield from req.body.drain()
+                    except HttpException as e:
+                        self._write_error(e.status)
+                        break
                     if self._writer is not None:
                         self._writer.restore()
+            if self._upgraded is not None:
+                # the connection belongs to another protocol now
+                return
+
+    def upgrade(self, protocol):
+        """
+        Hands the connection over to `protocol` after a protocol switch
+
+        Data read past the request is passed on and the HTTP objects are released.
+        When the transport cannot switch protocols, this one keeps forwarding to `protocol`.
+        """
+        reader = self._reader
+        data = bytes(reader._buffer)
+        reader._buffer.clear()
+        self._stop_timeout()
+        self._stop_header_timeout()
+        self._upgraded = protocol
+        self._reader = self._stream_reader = None
+        self._writer = None
+        self._handler = None
+        self._request = None
+        self._task = None
+        set_protocol = getattr(self._transport, 'set_protocol', None)
+        if set_protocol is not None:
+            set_protocol(protocol)
+        if reader._paused:
+            reader._paused = False
+            self._transport.resume_reading()
+        protocol.connection_made(self._transport)
+        if data:
+            protocol.data_received(data)
+
+    def eof_received(self):
+        if self._upgraded is not None:
+            return self._upgraded.eof_received()
+        return super().eof_received()
+
+    def pause_writing(self):
+        if self._upgraded is not None:
+            self._upgraded.pause_writing()
+        else:
+            super().pause_writing()
+
+    def resume_writing(self):
+        if self._upgraded is not None:
+            self._upgraded.resume_writing()
+        else:
+            super().resume_writing()
+
+    def _send_continue(self):
+        if self._writer is not None and not self._writer._headers_sent:
+            self._transport.write(_CONTINUE_RESPONSE)
+
+    def _write_error(self, status):
+        if self._transport is not None:
+            self._transport.write(_error_response(status))
+            self._transport.close()
+
+    def _start_header_timeout(self):
+        self._stop_header_timeout()
+        if self._limits.header_timeout is None:
+            return
+        self.h_header_timeout = self._loop.call_later(
+            self._limits.header_timeout, self._handle_header_timeout)
+
+    def _stop_header_timeout(self):
+        if self.h_header_timeout is not None:
+            self.h_header_timeout.cancel()
+            self.h_header_timeout = None
+
+    def _handle_header_timeout(self):
+        self.h_header_timeout = None
+        self._write_error(408)
 
     def _reset_timeout(self):
         self._stop_timeout()
@@ -116,7 +244,7 @@ class BaseHttpProtocol(asyncio.StreamReaderProtocol):
                             self._writer)
 
     def _should_close_conn_immediately(self, req):
-        if self._keep_alive < 1:
+        if self._keep_alive < 1 or req.close_connection:
             return True
 
         should_close = False
@@ -2,6 +2,7 @@ import asyncio
 import re
 from .protocol import BaseProcessor
 from vase.handlers import WebSocketHandler
+from .channels import ChannelRegistry
 
 
 class RoutingHttpProcessor(BaseProcessor):
@@ -112,24 +113,31 @@ class UrlRoute(Route):
 
 
 class CallbackRoute(UrlRoute):
-    def __init__(self, handler_factory, spec, callback):
+    def __init__(self, handler_factory, spec, callback, *, timeout=None, expect_handler=None):
         super().__init__(spec)
         self._handler_factory = handler_factory
         self._callback = callback
+        self._timeout = timeout
+        self._expect_handler = expect_handler
 
     def handler_factory(self, request, reader, writer):
-        return self._handler_factory(request, reader, writer, self._callback)
+        return self._handler_factory(request, reader, writer, self._callback,
+                                     timeout=self._timeout, expect_handler=self._expect_handler)
 
 
 class ContextHandlingCallbackRoute(CallbackRoute):
-    def __init__(self, handler_factory, spec, callback):
+    def __init__(self, handler_factory, spec, callback, *, channels=None):
         super().__init__(handler_factory, spec, callback)
         self._context_map = {}
+        if channels is None:
+            channels = ChannelRegistry()
+        self._channels = channels
 
     def handler_factory(self, request, reader, writer):
-        return self._handler_factory(request, reader, writer, self._callback, self._context_map)
+        return self._handler_factory(request, reader, writer, self._callback, self._context_map,
+                                     channels=self._channels)
 
 
 class WebSocketRoute(ContextHandlingCallbackRoute):
-    def __init__(self, spec, callback):
-        super().__init__(WebSocketHandler, spec, callback)
\ No newline at end of file
+    def __init__(self, spec, callback, *, channels=None):
+        super().__init__(WebSocketHandler, spec, callback, channels=channels)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import asyncio
+import json
 from enum import Enum
 
 from ..routing import (
@@ -7,6 +8,10 @@ from ..routing import (
 from ..handlers import (
     RequestHandler,
 )
+from ..log import logger
+from ..metrics import Counter
+from ..notify import Notifier
+from ..outbound import OutboundLimits
 from .handlers import (
     InfoHandler,
     IFrameHandler,
@@ -18,10 +23,21 @@ from .handlers import (
     HtmlFileHandler,
     JsonpHandler,
     JsonpSendingHandler,
+    FakeTransport,
+    RESPONSE_LIMIT,
 )
 
 from collections import deque
 
+DISCONNECT_DELAY = 5
+HEARTBEAT_DELAY = 25
+
+# outgoing queue of sessions whose endpoint has no `outbound_limits`
+SESSION_LIMITS = OutboundLimits()
+
+SOCKJS_EXPIRED_SESSIONS = Counter('vase_sockjs_expired_sessions_total',
+                                  'SockJS sessions dropped after their disconnect delay or close')
+
 
 def forbid_websocket(cls):
     cls._forbid_websocket = True
@@ -30,20 +46,73 @@ def forbid_websocket(cls):
 
 class Session(object):
 
-    def __init__(self, name):
+    def __init__(self, name, *, channels=None, limits=None, loop=None):
         self._name = name
+        self.channels = channels
         self.pending_messages = deque()
-        self.outgoing_messages = deque()
+        self.outgoing_messages = (limits or SESSION_LIMITS).create_queue()
         self.endpoint = None
-        self.waiter = None
+        # handler of the request receiving messages of the session
+        self.receiver = None
+        # wakes the receiver up when there is something to send
+        self.notifier = Notifier(loop=loop)
         self.is_new = True
         self.attached = False
         self.closed = False
+        self.close_frame = None
         self.terminated = False
+        # set by the sweeper of the store once the session is left detached
+        self.expires_at = None
+        self.expired = False
 
     def attach(self, endpoint):
         self.endpoint = endpoint
 
+    def detach(self):
+        """
+        Called once the request that received messages of the session has finished
+        """
+        self.attached = False
+        self.receiver = None
+        if not self.closed:
+            # requests answered with the close frame do not extend the grace period
+            self.expires_at = None
+
+    def take_messages(self):
+        """
+        Returns the outgoing messages and empties the queue
+        """
+        queue = self.outgoing_messages
+        messages = [queue.pop() for i in range(len(queue))]
+        self.notifier.clear()
+        return messages
+
+    def close(self, code=3000, reason='Go away!'):
+        """
+        Closes the session, the client is sent a close frame with `code` and `reason`
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.close_frame = 'c' + json.dumps([code, reason], separators=(',', ':'))
+        if self.channels is not None and self.endpoint is not None:
+            self.channels.unsubscribe_all(self.endpoint.transport)
+        # the receiver tells the client
+        self.notifier.notify()
+
+    def expire(self):
+        """
+        Releases the session, the endpoint is told with `on_close()`
+        """
+        if self.expired:
+            return
+        self.expired = True
+        self.close()
+        self.pending_messages.clear()
+        self.outgoing_messages.clear()
+        if self.endpoint is not None:
+            self.endpoint.on_close(None)
+
     @asyncio.coroutine
     def consume(self):
         if self.endpoint:
@@ -52,34 +121,129 @@ class Session(object):
                 yield from asyncio.coroutine(self.endpoint.on_message)(msg)
 
 
+class SessionStore:
+    """
+    Sessions of a SockJS route
+
+    Sessions left without a receiving request for `disconnect_delay` seconds are expired by
+    a single periodic sweep, which only runs while there are sessions. A sweep marks the
+    sessions it finds detached and the next one past their deadline expires them, so they
+    live between one and two `disconnect_delay` after they were detached.
+    Closed sessions get the same grace period, so that a reconnecting client is sent the close
+    frame rather than a new session.
+    Receiving requests are sent a heartbeat every `heartbeat_delay` seconds by another timer.
+    """
+    def __init__(self, *, disconnect_delay=DISCONNECT_DELAY, heartbeat_delay=HEARTBEAT_DELAY, loop=None):
+        self._sessions = {}
+        self._disconnect_delay = disconnect_delay
+        self._heartbeat_delay = heartbeat_delay
+        self._loop = loop
+        self._timer = None
+        self._heartbeat_timer = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, name):
+        return name in self._sessions
+
+    def get(self, name):
+        return self._sessions.get(name)
+
+    def add(self, name, session, *, loop=None):
+        self._sessions[name] = session
+        if self._loop is None:
+            self._loop = loop or asyncio.get_event_loop()
+        if self._timer is None:
+            self._timer = self._loop.call_later(self._disconnect_delay, self.sweep)
+        if self._heartbeat_timer is None and self._heartbeat_delay is not None:
+            self._heartbeat_timer = self._loop.call_later(self._heartbeat_delay, self._send_heartbeats)
+
+    def sweep(self):
+        # cleared first, `add()` reschedules the sweep whatever happens below
+        self._timer = None
+        now = self._loop.time()
+        for name, session in list(self._sessions.items()):
+            if session.attached and not session.closed:
+                session.expires_at = None
+            elif session.expires_at is None:
+                session.expires_at = now + self._disconnect_delay
+            elif session.expires_at <= now:
+                del self._sessions[name]
+                SOCKJS_EXPIRED_SESSIONS.inc()
+                self._expire(session)
+        if self._sessions:
+            self._timer = self._loop.call_later(self._disconnect_delay, self.sweep)
+
+    def _send_heartbeats(self):
+        self._heartbeat_timer = None
+        for session in list(self._sessions.values()):
+            if session.receiver is not None:
+                try:
+                    session.receiver.heartbeat()
+                except Exception:
+                    logger.exception("An exception occurred while sending a SockJS heartbeat")
+        if self._sessions:
+            self._heartbeat_timer = self._loop.call_later(self._heartbeat_delay, self._send_heartbeats)
+
+    def _expire(self, session):
+        try:
+            session.expire()
+        except Exception:
+            logger.exception("An exception occurred while expiring a SockJS session")
+
+    def close(self):
+        """
+        Expires every session and stops the sweep
+        """
+        for timer in (self._timer, self._heartbeat_timer):
+            if timer is not None:
+                timer.cancel()
+        self._timer = self._heartbeat_timer = None
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            self._expire(session)
+
+
 class SockJsRoute(ContextHandlingCallbackRoute):
 
     SOCKJS_ROUTE_MATCH = 'vasesockjsmatch'
 
-    def __init__(self, spec, callback):
-        self._session_store = {}
+    def __init__(self, spec, callback, *, channels=None, disconnect_delay=DISCONNECT_DELAY,
+                 heartbeat_delay=HEARTBEAT_DELAY, response_limit=RESPONSE_LIMIT):
+        self._session_store = SessionStore(disconnect_delay=disconnect_delay, heartbeat_delay=heartbeat_delay)
+        self._response_limit = response_limit
         if spec.pattern.endswith('/'):
             spec.pattern = spec.pattern[:-1]
         spec.pattern += "{%s:.*}" % self.SOCKJS_ROUTE_MATCH
 
-        super().__init__(None, spec, callback)
+        super().__init__(None, spec, callback, channels=channels)
+
+    @property
+    def session_count(self):
+        return len(self._session_store)
 
     def handler_factory(self, request, reader, writer):
-        return SockJsHandler(request, reader, writer, self._callback, self._context_map, self._session_store)
+        return SockJsHandler(request, reader, writer, self._callback, self._context_map, self._session_store,
+                             channels=self._channels, response_limit=self._response_limit)
 
 
 class SockJsHandler(RequestHandler):
-    def __init__(self, request, reader, writer, endpoint, context, sessions):
+    def __init__(self, request, reader, writer, endpoint, context, sessions, *, channels=None,
+                 response_limit=RESPONSE_LIMIT):
         self._request = request
         self._reader = reader
         self._writer = writer
         self._endpoint = endpoint
         self._context = context
         self._sessions = sessions
+        self._channels = channels
+        self._response_limit = response_limit
         self._websocket_enabled = not bool(getattr(self._endpoint, '_forbid_websocket', False))
         self._info_handler = InfoHandler(self._websocket_enabled)
         self._iframe_handler = IFrameHandler()
-        self._ws_handler = WebSocketSockJsHandler(reader, endpoint, context)
+        self._ws_handler = WebSocketSockJsHandler(reader, endpoint, context, channels=channels)
 
         self._transport_handlers = {
             'xhr': XhrTransportHandler,
@@ -157,10 +321,12 @@ class SockJsHandler(RequestHandler):
                         self._writer.write_body('')
                         return
 
-                sess = Session(session)
+                sess = Session(session, channels=self._channels,
+                               limits=getattr(endpoint, 'outbound_limits', None), loop=self._reader._loop)
                 sess.endpoint = endpoint
+                endpoint.transport = FakeTransport(sess)
                 sess.attached = True
-                self._sessions[session] = sess
+                self._sessions.add(session, sess, loop=self._reader._loop)
         else:
             if handler.initiates_session:
                 if sess.attached:
@@ -173,12 +339,21 @@ class SockJsHandler(RequestHandler):
         self._session = sess
 
         handler = handler(self._request, sess, self._context)
+        if isinstance(handler, XhrStreamingHandler):
+            handler.response_limit = self._response_limit
         self._current_handler = handler
-        yield from handler.handle(self._request, self._writer)
+        if handler.initiates_session:
+            sess.receiver = handler
+        try:
+            yield from handler.handle(self._request, self._writer)
+        finally:
+            if handler.initiates_session:
+                sess.detach()
 
     def _instantiate_endpoint(self):
         end = self._endpoint()
         end.bag = self._context
+        end.channels = self._channels
         return end
 
     def not_found(self):
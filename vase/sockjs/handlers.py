@@ -1,5 +1,4 @@
 import asyncio
-from asyncio.futures import Future
 import json
 import email.utils
 import sys
@@ -12,6 +11,17 @@ from datetime import (
 from hashlib import md5
 
 from ..handlers import WebSocketHandler
+from ..metrics import Counter
+from ..outbound import POLICY_VIOLATION
+from ..websocket import Utf8Text
+
+# bytes streamed in one response before the client is made to open a new one
+RESPONSE_LIMIT = 128 * 1024
+
+SOCKJS_RECYCLED_RESPONSES = Counter('vase_sockjs_recycled_responses_total',
+                                    'Streaming SockJS responses ended after reaching their response limit')
+SOCKJS_DROPPED_MESSAGES = Counter('vase_sockjs_dropped_messages_total',
+                                  'Messages dropped by the outgoing queues of SockJS sessions')
 
 
 class Handler(object):
@@ -21,6 +31,11 @@ class Handler(object):
     def handle(self, request, writer):
         raise NotImplementedError
 
+    def heartbeat(self):
+        """
+        Called periodically while the handler is receiving messages of its session
+        """
+
     def connection_lost(self, exc):
         pass
 
@@ -181,14 +196,16 @@ class IFrameHandler(Handler):
 
 
 class WebSocketSockJsHandler(Handler):
-    def __init__(self, reader, endpoint, context):
+    def __init__(self, reader, endpoint, context, *, channels=None):
         self._endpoint = endpoint
         self._context = context
         self._reader = reader
+        self._channels = channels
 
     @asyncio.coroutine
     def handle(self, request, writer):
-        ws_handler = WebSocketHandler(request, self._reader, writer, self._endpoint, self._context)
+        ws_handler = WebSocketHandler(request, self._reader, writer, self._endpoint, self._context,
+                                      channels=self._channels)
         return (yield from ws_handler.handle())
 
 
@@ -198,7 +215,6 @@ class XhrTransportHandler(Handler):
 
     def __init__(self, reader, session, context):
         self._session = session
-        self._session.endpoint.transport = FakeTransport(session)
         self._context = context
         self._reader = reader
 
@@ -210,21 +226,24 @@ class XhrTransportHandler(Handler):
             return self._send_message(request, writer, b'o\n')
 
         if self._session.closed:
-            self.go_away(request, writer, 'c[3000,"Go away!"]')
+            return self.go_away(request, writer, self._session.close_frame)
 
         if not self._session.outgoing_messages:
-            self._session.waiter = Future()
-            yield from self._session.waiter
+            yield from self._session.notifier.wait()
 
             if self._session.closed:
-                self._send_message(request, writer, 'c[3000,"Go away!"]')
+                return self._send_message(request, writer, (self._session.close_frame + '\n').encode('utf-8'))
 
-        msgs = []
-        while self._session.outgoing_messages:
-            msgs.append(self._session.outgoing_messages.popleft())
-        resp = ("a[" + ','.join(json.dumps(x) for x in msgs) + "]\n").encode('utf-8')
+        msgs = self._session.take_messages()
+        if not msgs:
+            # woken up by a heartbeat
+            return self._send_message(request, writer, b'h\n')
+        resp = (encode_messages(msgs) + "\n").encode('utf-8')
         return self._send_message(request, writer, resp)
 
+    def heartbeat(self):
+        self._session.notifier.notify()
+
     def _send_message(self, request, writer, msg):
         allow = request.get('access-control-request-headers')
         origin = request.get('origin', 'null')
@@ -248,29 +267,72 @@ class XhrTransportHandler(Handler):
         self._session.attached = False
 
 
+def encode_messages(encoded):
+    """
+    Builds an 'a' frame out of JSON encoded messages
+    """
+    return 'a[' + ','.join(encoded) + ']'
+
+
 class FakeTransport(object):
+    """
+    Endpoint transport of a SockJS session
+
+    Messages are queued JSON encoded, so that the same encoding can be shared by `broadcast()`.
+    The queue is bounded by the `OutboundLimits` of the session, an overflow with
+    the DISCONNECT policy closes the session.
+    """
     def __init__(self, session):
         self._session = session
 
-    def send(self, message):
-        self._session.outgoing_messages.append(message)
-        waiter = self._session.waiter
-        if waiter and not waiter.done():
-            waiter.set_result(None)
+    @staticmethod
+    def prepare(message):
+        if isinstance(message, Utf8Text):
+            message = message.decode('utf-8')
+        return json.dumps(message)
+
+    def send_prepared(self, data, *, key=None):
+        session = self._session
+        if session.closed:
+            return False
+        queue = session.outgoing_messages
+        dropped = queue.dropped_messages
+        accepted = queue.put(data, key)
+        if queue.dropped_messages != dropped:
+            SOCKJS_DROPPED_MESSAGES.inc(queue.dropped_messages - dropped)
+        if queue.overflowed:
+            session.close(POLICY_VIOLATION, 'Message queue overflow')
+        elif accepted:
+            session.notifier.notify()
+        return accepted
+
+    def send(self, message, *, key=None):
+        """
+        Queues `message`, returns False if it has been dropped
+        """
+        return self.send_prepared(self.prepare(message), key=key)
+
+    def get_write_buffer_size(self):
+        return self._session.outgoing_messages.size
+
+    def abort(self):
+        self._session.close(POLICY_VIOLATION, 'Message queue overflow')
 
     def close(self):
-        self._session.closed = True
+        self._session.close()
 
 
 class XhrStreamingHandler(Handler):
     initiates_session = True
     allowed_methods = ('POST',)
+    response_limit = RESPONSE_LIMIT
 
     def __init__(self, reader, session, context):
         self._session = session
-        self._session.endpoint.transport = FakeTransport(session)
         self._context = context
         self._reader = reader
+        # set while the response is streamed
+        self._writer = None
 
     @asyncio.coroutine
     def handle(self, request, writer):
@@ -298,38 +360,53 @@ class XhrStreamingHandler(Handler):
             writer.write_body(b'2\r\no\n\r\n')
 
         if self._session.closed:
-            msg = b'c[3000,"Go away!"]\n'
+            msg = (self._session.close_frame + '\n').encode('utf-8')
             length = hex(len(msg)).encode('utf-8')
             writer.write_body(length + b'\r\n' + msg + b'\r\n')
             writer.write_body(b'0\r\n\r\n')
             writer.close()
             return
 
-        written = 0
-        written += self._send_messages(writer)
-        while True:
-            self._session.waiter = Future()
-            yield from self._session.waiter
-            written += self._send_messages(writer)
-            if written >= 4096:
-                writer.write(b'0\r\n\r\n')
-                writer.close()
-                break
+        yield from self._stream(writer)
 
-    def _send_messages(self, writer):
-        msgs = []
-        while self._session.outgoing_messages:
-            msgs.append(self._session.outgoing_messages.popleft())
+    @asyncio.coroutine
+    def _stream(self, writer):
+        self._writer = writer
+        try:
+            written = self._send_messages(writer)
+            while True:
+                yield from self._session.notifier.wait()
+                written += self._send_messages(writer)
+                if self._session.closed:
+                    self._write_frame(writer, self._session.close_frame)
+                    writer.write(b'0\r\n\r\n')
+                    writer.close()
+                    break
+                if written >= self.response_limit:
+                    SOCKJS_RECYCLED_RESPONSES.inc()
+                    writer.write(b'0\r\n\r\n')
+                    writer.close()
+                    break
+        finally:
+            self._writer = None
 
+    def _send_messages(self, writer):
+        msgs = self._session.take_messages()
         if msgs:
-            msg = b'a' + json.dumps(msgs).encode('utf-8') + b'\n'
-            size = '{}\r\n'.format(hex(len(msg))[2:]).encode('utf-8')
-            out = msg + b'\r\n'
-            writer.write(size)
-            writer.write(out)
-            return len(msg)
+            return self._write_frame(writer, encode_messages(msgs))
         return 0
 
+    def _write_frame(self, writer, frame):
+        msg = (frame + '\n').encode('utf-8')
+        size = '{}\r\n'.format(hex(len(msg))[2:]).encode('utf-8')
+        writer.write(size)
+        writer.write(msg + b'\r\n')
+        return len(msg)
+
+    def heartbeat(self):
+        if self._writer is not None:
+            self._write_frame(self._writer, 'h')
+
     @classmethod
     def go_away(cls, request, writer, message):
         origin = request.get('origin', 'null')
@@ -389,30 +466,14 @@ class EventSourceHandler(XhrStreamingHandler):
         if new:
             writer.write_body(b'b\r\ndata: o\r\n\r\n\r\n')
 
-        written = 0
-        written += self._send_messages(writer)
-        while True:
-            self._session.waiter = Future()
-            yield from self._session.waiter
-            written += self._send_messages(writer)
-            if written >= 4096:
-                writer.write(b'0\r\n\r\n')
-                writer.close()
-                break
-
-    def _send_messages(self, writer):
-        msgs = []
-        while self._session.outgoing_messages:
-            msgs.append(self._session.outgoing_messages.popleft())
+        yield from self._stream(writer)
 
-        if msgs:
-            msg = b'data: a' + json.dumps(msgs).encode('utf-8') + b'\r\n\r\n'
-            size = '{}\r\n'.format(hex(len(msg))[2:]).encode('utf-8')
-            out = msg + b'\r\n'
-            writer.write(size)
-            writer.write(out)
-            return len(msg)
-        return 0
+    def _write_frame(self, writer, frame):
+        msg = ('data: ' + frame + '\r\n\r\n').encode('utf-8')
+        size = '{}\r\n'.format(hex(len(msg))[2:]).encode('utf-8')
+        writer.write(size)
+        writer.write(msg + b'\r\n')
+        return len(msg)
 
 
 class XhrRecievingHandler(Handler):
@@ -489,27 +550,10 @@ class HtmlFileHandler(XhrStreamingHandler):
         if new:
             write_chunk(writer, '<script>\np("o");\n</script>\r\n')
 
-        written = 0
-        written += self._send_messages(writer)
-        while True:
-            self._session.waiter = Future()
-            yield from self._session.waiter
-            written += self._send_messages(writer)
-            if written >= 4096:
-                writer.write(b'0\r\n\r\n')
-                writer.close()
-                break
+        yield from self._stream(writer)
 
-    def _send_messages(self, writer):
-        msgs = []
-        while self._session.outgoing_messages:
-            msgs.append(self._session.outgoing_messages.popleft())
-
-        written = 0
-        for msg in msgs:
-            msg = '<script>\np(' + json.dumps('a["' + msg + '"]') + ');\n</script>\r\n'
-            written += write_chunk(writer, msg)
-        return written
+    def _write_frame(self, writer, frame):
+        return write_chunk(writer, '<script>\np(' + json.dumps(frame) + ');\n</script>\r\n')
 
 
 def write_chunk(writer, message):
@@ -546,15 +590,16 @@ class JsonpHandler(XhrStreamingHandler):
             return
 
         if self._session.closed:
-            self.go_away(request, writer, 'c[3000,\\"Go away!\\"]', callback)
+            return self._send_frame(writer, callback, self._session.close_frame)
 
         if self._session.outgoing_messages:
             self._send_messages(writer, callback)
             writer.close()
             return
 
-        self._session.waiter = Future()
-        yield from self._session.waiter
+        yield from self._session.notifier.wait()
+        if self._session.closed:
+            return self._send_frame(writer, callback, self._session.close_frame)
         self._send_messages(writer, callback)
         writer.close()
 
@@ -570,12 +615,16 @@ class JsonpHandler(XhrStreamingHandler):
         writer.write_body(msg)
         return
 
+    def heartbeat(self):
+        self._session.notifier.notify()
+
     def _send_messages(self, writer, callback):
-        msgs = []
-        while self._session.outgoing_messages:
-            msgs.append(self._session.outgoing_messages.popleft())
-        msgs = 'a' + json.dumps(msgs, separators=(',', ':'))
-        msg = '{}({});\r\n'.format(callback, json.dumps(msgs)).encode('utf-8')
+        msgs = self._session.take_messages()
+        # nothing to send after a heartbeat
+        self._send_frame(writer, callback, encode_messages(msgs) if msgs else 'h')
+
+    def _send_frame(self, writer, callback, frame):
+        msg = '{}({});\r\n'.format(callback, json.dumps(frame)).encode('utf-8')
 
         writer.status = 200
         writer.add_headers(
@@ -590,7 +639,7 @@ class JsonpSendingHandler(XhrRecievingHandler):
 
     @asyncio.coroutine
     def handle(self, request, writer):
-        message = request.POST.get('d')
+        message = (yield from request.post()).get('d')
         if not message:
             message = (yield from request.body.read()).decode('utf-8')
         if not message:
@@ -1,20 +1,188 @@
-from asyncio import coroutine
+import re
+from asyncio import (
+    StreamReader,
+    coroutine,
+)
+from asyncio.streams import IncompleteReadError
 
+from .exceptions import (
+    BadRequestException,
+    RequestEntityTooLargeException,
+)
 
-class LimitedReader:
-    def __init__(self, reader, limit):
+
+_DEFAULT_CHUNK_SIZE = 2**16
+_CHUNK_SIZE_RE = re.compile(rb'[0-9A-Fa-f]+')
+
+
+class CountingStreamReader(StreamReader):
+    """
+    StreamReader that keeps track of how many bytes it holds
+
+    The count is taken from the data fed in and the bytes handed out by the
+    read methods, so `buffered` tells whether a pipelined request is waiting.
+    `read(-1)` and `readexactly()` are built on `read(n)` so that nothing is
+    counted twice whichever way the base class implements them.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fed = 0
+        self._returned = 0
+
+    @property
+    def buffered(self):
+        return self._fed - self._returned
+
+    def feed_data(self, data):
+        super().feed_data(data)
+        self._fed += len(data)
+
+    @coroutine
+    def read(self, n=-1):
+        if n < 0:
+            # read the chunks here, super().read(-1) may call self.read() itself
+            chunks = []
+            while True:
+                chunk = yield from self.read(_DEFAULT_CHUNK_SIZE)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        data = yield from super().read(n)
+        self._returned += len(data)
+        return data
+
+    @coroutine
+    def readline(self):
+        line = yield from super().readline()
+        self._returned += len(line)
+        return line
+
+    @coroutine
+    def readexactly(self, n):
+        data = yield from self.read(n)
+        while len(data) < n:
+            chunk = yield from self.read(n - len(data))
+            if not chunk:
+                raise IncompleteReadError(data, n)
+            data += chunk
+        return data
+
+
+class BodyReader:
+    """
+    Base class for request body streams
+
+    Subclasses implement `_read_some()`, the rest of the api is built on top of it:
+    `read()`, `readinto()`, `readchunk()` and `async for chunk in body`.
+    """
+    chunk_size = _DEFAULT_CHUNK_SIZE
+
+    def __init__(self, reader):
         self._reader = reader
-        self._limit = limit
-        self._read_count = 0
+        self._eof = False
+        self._continue = None
+
+    @property
+    def at_eof(self):
+        return self._eof
+
+    def expect_continue(self, callback):
+        """
+        Registers a callback that sends '100 Continue' before the body is read
+        """
+        self._continue = callback
+
+    @property
+    def continue_pending(self):
+        return self._continue is not None and not self._eof
+
+    @coroutine
+    def _read(self, n):
+        if self._continue is not None:
+            callback, self._continue = self._continue, None
+            callback()
+        return (yield from self._read_some(n))
+
+    @coroutine
+    def _read_some(self, n):
+        """Returns up to n bytes, b'' on the end of the body"""
+        raise NotImplementedError
 
     @coroutine
     def read(self, n=-1):
-        if not n or not self.bytes_left:
+        if not n or self._eof:
             return b''
-        if n < 0 or n > self.bytes_left:
+        if n > 0:
+            return (yield from self._read(n))
+
+        chunks = []
+        while True:
+            chunk = yield from self._read(self.chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    @coroutine
+    def readchunk(self):
+        if self._eof:
+            return b''
+        return (yield from self._read(self.chunk_size))
+
+    @coroutine
+    def readinto(self, buf):
+        """
+        Reads up to len(buf) bytes into `buf`, returns the number of bytes read
+        """
+        view = memoryview(buf).cast('B')
+        if not view or self._eof:
+            return 0
+        data = yield from self._read(len(view))
+        n = len(data)
+        view[:n] = data
+        return n
+
+    @coroutine
+    def drain(self):
+        """Reads and discards the rest of the body"""
+        while (yield from self.readchunk()):
+            pass
+
+    def __aiter__(self):
+        return self
+
+    @coroutine
+    def __anext__(self):
+        chunk = yield from self.readchunk()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+
+class LimitedReader(BodyReader):
+    """Body delimited by the Content-Length header"""
+    def __init__(self, reader, limit):
+        super().__init__(reader)
+        self._limit = limit
+        self._read_count = 0
+        self._eof = not limit
+
+    @coroutine
+    def _read_some(self, n):
+        if n > self.bytes_left:
             n = self.bytes_left
-        self._read_count += n
-        return (yield from self._reader.read(n))
+        if not n:
+            self._eof = True
+            return b''
+        data = yield from self._reader.read(n)
+        if not data:
+            # the client has closed connection prematurely
+            self._eof = True
+            return b''
+        self._read_count += len(data)
+        if not self.bytes_left:
+            self._eof = True
+        return data
 
     @property
     def bytes_left(self):
@@ -22,3 +190,67 @@ class LimitedReader:
         if left < 0:  # pragma: no cover
             left = 0
         return left
+
+
+class ChunkedReader(BodyReader):
+    """Body sent with 'Transfer-Encoding: chunked'"""
+    def __init__(self, reader, max_size=None):
+        super().__init__(reader)
+        self._chunk_left = 0
+        self._max_size = max_size
+        self._read_count = 0
+
+    @coroutine
+    def _read_chunk_size(self):
+        try:
+            line = yield from self._reader.readline()
+        except ValueError:
+            raise BadRequestException()
+        if not line.endswith(b'\r\n'):
+            raise BadRequestException()
+        # int() would also take signs, '0x' prefixes and underscores
+        size = line[:-2].split(b';', 1)[0].rstrip(b' \t')
+        if not _CHUNK_SIZE_RE.fullmatch(size):
+            raise BadRequestException()
+        return int(size, 16)
+
+    @coroutine
+    def _read_crlf(self):
+        try:
+            data = yield from self._reader.readexactly(2)
+        except IncompleteReadError:
+            raise BadRequestException()
+        if data != b'\r\n':
+            raise BadRequestException()
+
+    @coroutine
+    def _read_trailers(self):
+        while True:
+            line = yield from self._reader.readline()
+            if not line.endswith(b'\r\n'):
+                raise BadRequestException()
+            if line == b'\r\n':
+                return
+
+    @coroutine
+    def _read_some(self, n):
+        if self._eof:
+            return b''
+        if not self._chunk_left:
+            size = yield from self._read_chunk_size()
+            if not size:
+                yield from self._read_trailers()
+                self._eof = True
+                return b''
+            self._read_count += size
+            if self._max_size is not None and self._read_count > self._max_size:
+                raise RequestEntityTooLargeException()
+            self._chunk_left = size
+
+        data = yield from self._reader.read(min(n, self._chunk_left))
+        if not data:
+            raise BadRequestException()
+        self._chunk_left -= len(data)
+        if not self._chunk_left:
+            yield from self._read_crlf()
+        return data
@@ -1,29 +1,65 @@
 import asyncio
-from asyncio.streams import StreamWriter, IncompleteReadError
+from asyncio.streams import StreamWriter
+from base64 import b64encode
+import codecs
 import collections
+from hashlib import sha1
+from urllib.parse import urlsplit
 import struct
 from enum import Enum
 import os
+import zlib
+
+from .masking import mask_payload
+from .outbound import POLICY_VIOLATION
 
 MAGIC = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 
+# limit of endpoints that do not set `max_message_size`, None lifts it
+DEFAULT_MAX_MESSAGE_SIZE = 2**20
+
+_unpack_uint16 = struct.Struct('!H').unpack_from
+_unpack_uint64 = struct.Struct('!Q').unpack_from
+
+_pack_byte = struct.Struct('!B').pack
+_pack_uint16 = struct.Struct('!H').pack
+_pack_uint64 = struct.Struct('!Q').pack
+_pack_short_header = struct.Struct('!BB').pack
+_pack_medium_header = struct.Struct('!BBH').pack
+_pack_long_header = struct.Struct('!BBQ').pack
+
 
 class FrameBuilder:
     @classmethod
-    def build(cls, *, fin, opcode, payload, masked):
+    def build(cls, *, fin, opcode, payload, masked, rsv1=False):
         if isinstance(payload, str):
             payload = payload.encode('utf-8')
 
-        first_byte = cls._build_first_byte(fin, opcode)
-
-        length_bytes = cls._build_mask_and_length(masked, len(payload))
+        header = cls.build_header(fin, opcode, len(payload), masked=masked, rsv1=rsv1)
 
-        mask = b''
         if masked:
             mask = cls._random_mask()
-            payload = cls._mask_payload(payload, mask)
+            return b''.join((header, mask, cls._mask_payload(payload, mask)))
+        return b''.join((header, payload))
 
-        return b''.join([first_byte, length_bytes, mask, payload])
+    @staticmethod
+    def build_header(fin, opcode, length, *, masked=False, rsv1=False):
+        """
+        Builds the frame header for a payload of `length` bytes, without the mask
+
+        The payload can then be sent as a separate buffer.
+        """
+        first_byte = opcode.value
+        if fin:
+            first_byte |= 0x80
+        if rsv1:
+            first_byte |= 0x40
+        mask_bit = 0x80 if masked else 0
+        if length < 126:
+            return _pack_short_header(first_byte, mask_bit | length)
+        if length < 2**16:
+            return _pack_medium_header(first_byte, mask_bit | 126, length)
+        return _pack_long_header(first_byte, mask_bit | 127, length)
 
     @classmethod
     def continuation(cls, payload, *, fin=True, masked=True):
@@ -56,11 +92,13 @@ class FrameBuilder:
         return cls.build(opcode=OpCode.pong, fin=True, payload=payload, masked=masked)
 
     @staticmethod
-    def _build_first_byte(fin, opcode):
+    def _build_first_byte(fin, opcode, rsv1=False):
         first_byte = (1 << 7) | opcode.value
         if not fin:
             first_byte &= 0x7f
-        return struct.pack("!B", first_byte)
+        if rsv1:
+            first_byte |= 0x40
+        return _pack_byte(first_byte)
 
     @staticmethod
     def _build_mask_and_length(masked, length):
@@ -73,14 +111,14 @@ class FrameBuilder:
             length = 126
 
         if length == 126:
-            extra_length = struct.pack('!H', original_length)
+            extra_length = _pack_uint16(original_length)
         elif length == 127:
-            extra_length = struct.pack('!Q', original_length)
+            extra_length = _pack_uint64(original_length)
 
         if masked:
             length |= 0x80
 
-        return b''.join((struct.pack('!B', length), extra_length))
+        return b''.join((_pack_byte(length), extra_length))
 
     @staticmethod
     def _random_mask():
@@ -88,7 +126,7 @@ class FrameBuilder:
 
     @staticmethod
     def _mask_payload(payload, mask):
-        return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return mask_payload(payload, mask)
 
 
 class OpCode(Enum):
@@ -111,12 +149,13 @@ class Frame:
     """
     WebSocket frame
     """
-    __slots__ = ('fin', 'opcode', 'payload')
+    __slots__ = ('fin', 'opcode', 'payload', 'rsv1')
 
-    def __init__(self, fin, opcode, payload):
+    def __init__(self, fin, opcode, payload, rsv1=0):
         self.fin = fin
         self.opcode = opcode
         self.payload = payload
+        self.rsv1 = rsv1
 
     @property
     def is_ctrl(self):
@@ -154,7 +193,34 @@ class Message:
         return cls(OpCode.close, payload)
 
 
+class MessageChunk:
+    """
+    Part of a data message delivered before the whole message has been received
+    """
+    __slots__ = ('opcode', 'payload', 'fin')
+    is_ctrl = False
+
+    def __init__(self, opcode, payload, fin):
+        self.opcode = opcode
+        self.payload = payload
+        self.fin = fin
+
+
+class Utf8Text(bytes):
+    """
+    Payload of a text message kept as validated UTF-8
+
+    It is sent in a text frame as is, so relayed messages are not encoded again.
+    """
+    __slots__ = ()
+
+
 class WebSocketFormatException(Exception):
+    """
+    Raised on protocol violations, `code` is the close code to report to the peer
+    """
+    code = 1002
+
     def __init__(self, *args):
         if len(args) > 0:
             self.reason = args[0]
@@ -163,50 +229,273 @@ class WebSocketFormatException(Exception):
         super().__init__(*args)
 
 
+class InvalidPayloadException(WebSocketFormatException):
+    code = 1007
+
+
+class MessageTooBigException(WebSocketFormatException):
+    code = 1009
+
+
+_OPCODES = {op.value: op for op in OpCode}
+
+_utf8_decoder = codecs.getincrementaldecoder('utf-8')
+
+
+class FrameDecoder:
+    """
+    Incremental frame decoder
+
+    Raw bytes are pushed with `feed()`, which returns every frame that has been
+    completed by them. Payloads are unmasked straight from the receive buffer.
+    RSV1 is only accepted on the first frame of a data message and only when
+    `allow_rsv1` is set by a negotiated extension.
+    Frames longer than `max_size` are rejected as soon as their header is received.
+    Clients decode server frames with `masked=False`, those must not be masked.
+    """
+    __slots__ = ('_buffer', '_error', '_allow_rsv1', '_max_size', '_masked')
+
+    def __init__(self, *, allow_rsv1=False, max_size=None, masked=True):
+        self._buffer = bytearray()
+        self._error = None
+        self._allow_rsv1 = allow_rsv1
+        self._max_size = max_size
+        self._masked = masked
+
+    def feed(self, data):
+        if self._error is not None:
+            raise self._error
+        buf = self._buffer
+        buf.extend(data)
+        frames = []
+        offset = 0
+        view = memoryview(buf)
+        try:
+            while True:
+                frame, offset = self._decode_frame(buf, view, offset, self._allow_rsv1, self._max_size,
+                                                   self._masked)
+                if frame is None:
+                    break
+                frames.append(frame)
+        except WebSocketFormatException as e:
+            if not frames:
+                raise
+            # let the caller process the frames that precede the broken one
+            self._error = e
+        finally:
+            view.release()
+            del buf[:offset]
+        return frames
+
+    @staticmethod
+    def _decode_frame(buf, view, offset, allow_rsv1, max_size=None, masked=True):
+        available = len(buf) - offset
+        if available < 2:
+            return None, offset
+        first_byte = buf[offset]
+        second_byte = buf[offset + 1]
+
+        fin = (first_byte >> 7) & 1
+        opcode = _OPCODES.get(first_byte & 0xf)
+        length = second_byte & 0x7f
+
+        if opcode is None:
+            raise WebSocketFormatException("Unknown opcode received '0x{:X}'".format(first_byte & 0xf))
+
+        rsv1 = first_byte & 0x40
+        if first_byte & 0x30 or rsv1 and (not allow_rsv1 or opcode.is_ctrl or opcode == OpCode.continuation):
+            raise WebSocketFormatException("Reserved bits must be set to 0")
+
+        if opcode.is_ctrl:
+            if not fin:
+                raise WebSocketFormatException("Control frames MUST NOT be fragmented")
+            if length > 125:
+                raise WebSocketFormatException("All control frames MUST have a payload length of 125 bytes or less")
+
+        if masked:
+            if not second_byte & 0x80:
+                raise WebSocketFormatException("Clients MUST mask their frames")
+            mask_length = 4
+        else:
+            if second_byte & 0x80:
+                raise WebSocketFormatException("Servers MUST NOT mask their frames")
+            mask_length = 0
+
+        header_length = 2 + mask_length
+        if length == 126:
+            header_length += 2
+            if available < 4:
+                return None, offset
+            length = _unpack_uint16(buf, offset + 2)[0]
+        elif length == 127:
+            header_length += 8
+            if available < 10:
+                return None, offset
+            length = _unpack_uint64(buf, offset + 2)[0]
+
+        if max_size is not None and length > max_size and not opcode.is_ctrl:
+            raise MessageTooBigException("Frame exceeds the maximum message size")
+
+        end = offset + header_length + length
+        if available < header_length + length:
+            return None, offset
+
+        start = offset + header_length
+        if masked:
+            payload = mask_payload(view[start:end], bytes(view[start - 4:start]))
+        else:
+            payload = bytes(view[start:end])
+        return Frame(fin, opcode, payload, rsv1), end
+
+
 class WebSocketParser:
     """
     This object is instantiated for each connection
+
+    Frames can either be pushed with `feed()` or pulled from the reader with `get_message()`.
+    Messages longer than `max_message_size` raise MessageTooBigException, compressed
+    ones as well once they inflate past the `max_inflated_size` of `deflate`.
+    In `streaming` mode data frames are returned as MessageChunk objects as soon as
+    they arrive, text is decoded incrementally.
+    Text is validated frame by frame, invalid UTF-8 raises InvalidPayloadException.
+    With `raw_text` text messages are returned as `Utf8Text`. They are still decoded frame
+    by frame, the decoder is the cheapest UTF-8 validation at hand, but the decoded text is
+    dropped. This saves encoding the message again and joining the text of its frames,
+    see bench/raw_text.py.
+    Clients parse unmasked server frames with `masked=False`.
     """
-    def __init__(self, reader):
+    __slots__ = ('_reader', '_deflate', '_max_message_size', '_streaming', '_raw_text', '_decoder', '_pending',
+                 '_parts', '_opcode', '_compressed', '_size', '_inflated', '_inflate_limit', '_text_decoder')
+    read_size = 2**16
+
+    def __init__(self, reader, *, deflate=None, max_message_size=None, streaming=False, raw_text=False,
+                 masked=True):
         self._reader = reader
-        self._frames = collections.deque()
+        self._deflate = deflate
+        self._max_message_size = max_message_size
+        self._inflate_limit = None
+        if deflate is not None:
+            self._inflate_limit = deflate.max_inflated_size
+            if max_message_size is not None:
+                self._inflate_limit = min(max_message_size, self._inflate_limit)
+        self._streaming = streaming
+        self._raw_text = raw_text
+        self._decoder = FrameDecoder(allow_rsv1=deflate is not None, max_size=max_message_size, masked=masked)
+        # frames read by `get_frame()` and not returned yet, only used in pull mode
+        self._pending = None
+        # payloads of the data message being received
+        self._parts = []
+        # state of the data message being received
+        self._opcode = None
+        self._compressed = False
+        self._size = 0
+        self._inflated = 0
+        self._text_decoder = None
+
+    def feed(self, data):
+        """
+        Returns the list of messages completed by `data`
+        """
+        messages = []
+        for frame in self._decoder.feed(data):
+            message = self._process_frame(frame)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    @asyncio.coroutine
+    def get_frame(self):
+        if self._pending is None:
+            self._pending = collections.deque()
+        while not self._pending:
+            data = yield from self._reader.read(self.read_size)
+            if not data:
+                return None
+            self._pending.extend(self._decoder.feed(data))
+        return self._pending.popleft()
 
     @asyncio.coroutine
     def get_message(self):
         while True:
-            try:
-                frame = yield from self.parse_frame(self._reader)
-            except IncompleteReadError:
-                frame = None
+            frame = yield from self.get_frame()
             if frame is None:
                 return
+            message = self._process_frame(frame)
+            if message is not None:
+                return message
 
-            if frame.is_ctrl:
-                return Message(frame.opcode, frame.payload, '')
+    def _process_frame(self, frame):
+        if frame.is_ctrl:
+            return Message(frame.opcode, frame.payload, '')
 
-            if not self._frames and frame.opcode not in (OpCode.binary, OpCode.text):
+        if self._opcode is None:
+            if frame.opcode not in (OpCode.binary, OpCode.text):
                 raise WebSocketFormatException("The first data frame must be either 'binary' or 'text'")
-
-            if self._frames and frame.opcode != OpCode.continuation:
-                raise WebSocketFormatException("Frames belonging to different messages cannot be interleaved")
-            self._frames.append(frame)
-            if frame.fin:
-                return self._build_message()
-
-    def _build_message(self):
-        buf = []
-        frame = self._frames.popleft()
-        opcode = frame.opcode
-        buf.append(frame.payload)
-        while self._frames:
-            frame = self._frames.popleft()
-            buf.append(frame.payload)
-        payload = b''.join(buf)
+            self._opcode = frame.opcode
+            self._compressed = frame.rsv1
+            self._size = self._inflated = 0
+        elif frame.opcode != OpCode.continuation:
+            raise WebSocketFormatException("Frames belonging to different messages cannot be interleaved")
+
+        self._size += len(frame.payload)
+        self._check_size(self._size)
+        opcode = self._opcode
+        fin = frame.fin
+        if fin:
+            self._opcode = None
+        payload = frame.payload
+        if self._compressed:
+            payload = self._inflate(payload, fin)
         if opcode == OpCode.text:
-            try:
-                payload = payload.decode('utf-8')
-            except UnicodeDecodeError:
-                return None
+            # every frame is validated as it arrives
+            payload = self._decode_text(payload, fin)
+        if self._streaming:
+            return MessageChunk(opcode, payload, fin)
+        self._parts.append(payload)
+        if fin:
+            return self._build_message(opcode)
+
+    def _check_size(self, size):
+        if self._max_message_size is not None and size > self._max_message_size:
+            raise MessageTooBigException("Message exceeds {} bytes".format(self._max_message_size))
+
+    def _inflate(self, payload, fin):
+        limit = self._inflate_limit
+        # one byte past the limit is enough to tell that it is exceeded, 0 would not limit at all
+        max_length = limit - self._inflated + 1
+        try:
+            payload = self._deflate.decompress(payload, fin, max_length)
+        except zlib.error:
+            raise WebSocketFormatException("Invalid compressed data")
+        self._inflated += len(payload)
+        if self._inflated > limit:
+            raise MessageTooBigException("Message inflates past {} bytes".format(limit))
+        return payload
+
+    def _decode_text(self, payload, fin):
+        if self._text_decoder is None:
+            self._text_decoder = _utf8_decoder()
+        try:
+            text = self._text_decoder.decode(payload, fin)
+        except UnicodeDecodeError:
+            raise InvalidPayloadException("Text messages must be valid UTF-8")
+        finally:
+            if fin:
+                self._text_decoder.reset()
+        if self._raw_text and not self._streaming:
+            # the text was only built to validate the payload
+            return payload
+        return text
+
+    def _build_message(self, opcode):
+        parts = self._parts
+        if opcode == OpCode.text and not self._raw_text:
+            payload = parts[0] if len(parts) == 1 else ''.join(parts)
+        else:
+            payload = b''.join(parts)
+            if opcode == OpCode.text:
+                payload = Utf8Text(payload)
+        parts.clear()
         return Message(opcode, payload, b'')
 
     @classmethod
@@ -265,23 +554,376 @@ class WebSocketParser:
         else:
             payload = b''
 
-        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        payload = mask_payload(payload, mask)
 
         return Frame(fin, opcode, payload)
 
 
 class WebSocketWriter(StreamWriter):
-    def __init__(self, transport):
+    """
+    Sends messages of a server side connection
+
+    With an `OutboundQueue`, frames are held back while the transport buffer is above
+    the high-water mark of the queue and are written as it drains.
+    With `coalesce_limit`, frames sent within one loop iteration are written together
+    at its end, or as soon as they add up to `coalesce_limit` bytes.
+    """
+    def __init__(self, transport, *, deflate=None, queue=None, coalesce_limit=None):
         self._transport = transport
+        self._deflate = deflate
+        self._queue = queue
+        self._flusher = None
+        self._coalesce_limit = coalesce_limit
+        # frames coalesced in the current loop iteration
+        self._buffer = None
+        self._buffered = 0
+        # round-trip time measured by keepalive pings
+        self.rtt = None
+        # codec of the negotiated subprotocol
+        self.subprotocol = None
+        self.codec = None
 
-    def send(self, msg):
-        if isinstance(msg, bytes):
-            mbytes = FrameBuilder.binary(msg, masked=False)
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def deflate(self):
+        """Compressor of the negotiated permessage-deflate extension"""
+        return self._deflate
+
+    @deflate.setter
+    def deflate(self, deflate):
+        self._deflate = deflate
+
+    def prepare(self, msg):
+        """
+        Builds the uncompressed frame of `msg`, it can be sent to any number
+        of connections using the same codec with `send_prepared()`
+        """
+        opcode, msg = self._encode(msg)
+        return FrameBuilder.build(fin=True, opcode=opcode, payload=msg, masked=False)
+
+    def send_prepared(self, data, *, key=None):
+        return self._write(data, None, key)
+
+    def send(self, msg, *, key=None):
+        """
+        Sends a text or binary message, returns False if it has been dropped by the outbound queue
+
+        Binary payloads may be any bytes-like object. They are joined with the frame header
+        only when the transport buffer is empty, so that the frame goes out with one send() call,
+        otherwise they are handed to the transport as they are. `Utf8Text` is sent as text.
+        `key` identifies messages that may replace each other in a coalescing queue.
+        With a negotiated codec `msg` can be any object the codec is able to encode,
+        it is sent in a binary frame if the codec is `binary`, in a text frame otherwise.
+        """
+        opcode, msg = self._encode(msg)
+        if isinstance(msg, memoryview) and msg.itemsize != 1:
+            msg = msg.cast('B')
+
+        rsv1 = False
+        deflate = self._deflate
+        if deflate is not None and deflate.should_compress(len(msg)):
+            msg = deflate.compress(msg)
+            rsv1 = True
+
+        header = FrameBuilder.build_header(True, opcode, len(msg), rsv1=rsv1)
+        return self._write(header, msg, key)
+
+    def _encode(self, msg):
+        codec = self.codec
+        if codec is not None:
+            msg = codec.encode(msg)
+            opcode = OpCode.binary if codec.binary else OpCode.text
+        elif isinstance(msg, (str, Utf8Text)):
+            opcode = OpCode.text
         else:
-            mbytes = FrameBuilder.text(msg, masked=False)
+            opcode = OpCode.binary
+        if isinstance(msg, str):
+            msg = msg.encode('utf-8')
+        return opcode, msg
+
+    def _write(self, frame, payload=None, key=None):
+        queue = self._queue
+        if queue is not None:
+            if queue.overflowed:
+                return False
+            # frames coalesced in this iteration are on their way to the transport buffer
+            if queue or self._transport_buffer_size() + self._buffered >= queue.limits.high_water:
+                if payload is not None:
+                    # the frame is held back, the payload may be modified by the caller meanwhile
+                    frame = b''.join((frame, payload))
+                self.flush()
+                return self._enqueue(frame, key)
+        if self._coalesce_limit is not None:
+            self._coalesce(frame, payload)
+        elif payload is None:
+            self._transport.write(frame)
+        elif self._transport_buffer_size():
+            # both go to the end of the transport buffer, joining them first would copy the payload twice
+            self._transport.write(frame)
+            self._transport.write(payload)
+        else:
+            # the transport sends the frame with a single send() call
+            self._transport.writelines((frame, payload))
+        return True
+
+    def _transport_buffer_size(self):
+        transport = getattr(self._transport, 'transport', None)
+        if transport is None:
+            return 0
+        return transport.get_write_buffer_size()
+
+    def _coalesce(self, frame, payload):
+        buffer = self._buffer
+        if buffer is None:
+            buffer = self._buffer = []
+            self._transport._loop.call_soon(self.flush)
+        buffer.append(frame)
+        size = len(frame)
+        if payload is not None:
+            if not isinstance(payload, bytes):
+                # the caller may reuse the buffer before the end of the iteration
+                payload = bytes(payload)
+            buffer.append(payload)
+            size += len(payload)
+        self._buffered += size
+        if self._buffered >= self._coalesce_limit:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the frames coalesced in the current loop iteration
+        """
+        buffer = self._buffer
+        if buffer is None:
+            return
+        self._buffer = None
+        self._buffered = 0
+        self._transport.writelines(buffer)
+
+    def _enqueue(self, data, key):
+        queue = self._queue
+        if not queue.put(data, key):
+            if queue.overflowed:
+                self._disconnect()
+            return False
+        if self._flusher is None:
+            self._flusher = asyncio.async(self._flush(), loop=self._transport._loop)
+        return True
 
-        self._transport.write(mbytes)
+    @asyncio.coroutine
+    def _flush(self):
+        queue = self._queue
+        transport = self._transport.transport
+        try:
+            while queue:
+                yield from self._transport.drain()
+                while queue:
+                    self._transport.write(queue.pop())
+                    if transport.get_write_buffer_size() >= queue.limits.high_water:
+                        break
+        except ConnectionError:
+            queue.clear()
+        finally:
+            self._flusher = None
+
+    def _disconnect(self):
+        if getattr(self._transport, '_ws_closing', False):
+            return
+        self.flush()
+        self._transport._ws_closing = True
+        self._transport.write(FrameBuilder.close(POLICY_VIOLATION, masked=False))
+        self._transport.close()
+
+    def get_write_buffer_size(self):
+        """
+        Returns the number of bytes queued in the underlying transport and the outbound queue
+        """
+        size = self._transport.transport.get_write_buffer_size() + self._buffered
+        if self._queue is not None:
+            size += self._queue.size
+        return size
+
+    def abort(self):
+        """
+        Drops the connection without the closing handshake
+        """
+        self._buffer = None
+        self._buffered = 0
+        self._transport.transport.abort()
 
     def close(self):
+        self.flush()
         self._transport._ws_closing = True
-        self._transport.write(FrameBuilder.close(masked=False))
+        frame = FrameBuilder.close(masked=False)
+        if self._queue:
+            # queued messages go out first
+            self._queue.put_control(frame)
+        else:
+            self._transport.write(frame)
+
+
+BROADCAST_SKIP = 'skip'
+BROADCAST_DROP = 'drop'
+
+
+def broadcast(message, transports, *, policy=BROADCAST_SKIP, high_water=2**20):
+    """
+    Sends `message` to every transport, encoding it only once per transport type and codec
+
+    Transports with more than `high_water` bytes in their write buffer are
+    considered slow, depending on `policy` they either miss this message (BROADCAST_SKIP)
+    or are disconnected (BROADCAST_DROP).
+    Transports without `prepare()` fall back to `send()`.
+    Returns the list of slow transports.
+    """
+    if policy not in (BROADCAST_SKIP, BROADCAST_DROP):
+        raise ValueError("Unknown broadcast policy '{}'".format(policy))
+    prepared = {}
+    slow = []
+    for transport in list(transports):
+        get_buffer_size = getattr(transport, 'get_write_buffer_size', None)
+        if get_buffer_size is not None and get_buffer_size() > high_water:
+            slow.append(transport)
+            if policy == BROADCAST_DROP:
+                transport.abort()
+            continue
+        prepare = getattr(transport, 'prepare', None)
+        if prepare is None:
+            transport.send(message)
+            continue
+        cache_key = (type(transport), getattr(transport, 'codec', None))
+        try:
+            data = prepared[cache_key]
+        except KeyError:
+            data = prepared[cache_key] = prepare(message)
+        transport.send_prepared(data)
+    return slow
+
+
+class WebSocketHandshakeError(Exception):
+    pass
+
+
+class WebSocketClient:
+    """
+    Client side of a WebSocket connection, created by `connect()`
+
+    Frames are masked as required from clients, pings are answered while receiving.
+    """
+    def __init__(self, reader, writer, *, subprotocol=None, max_message_size=None):
+        self._reader = reader
+        self._writer = writer
+        self._parser = WebSocketParser(reader, max_message_size=max_message_size, masked=False)
+        self.subprotocol = subprotocol
+        self.closed = False
+
+    def send(self, msg):
+        if isinstance(msg, (str, Utf8Text)):
+            frame = FrameBuilder.text(msg)
+        else:
+            frame = FrameBuilder.binary(msg)
+        self._writer.write(frame)
+
+    def ping(self, payload=b''):
+        self._writer.write(FrameBuilder.ping(payload))
+
+    @asyncio.coroutine
+    def recv(self):
+        """
+        Returns the payload of the next data message, or None once the connection is closed
+        """
+        while not self.closed:
+            msg = yield from self._parser.get_message()
+            if msg is None:
+                self._close_transport()
+                return None
+            if msg.opcode == OpCode.ping:
+                self._writer.write(FrameBuilder.pong(msg.payload))
+            elif msg.opcode == OpCode.close:
+                # echo the status code back
+                self._writer.write(FrameBuilder.build(fin=True, opcode=OpCode.close, payload=msg.payload[:2],
+                                                      masked=True))
+                self._close_transport()
+                return None
+            elif not msg.is_ctrl:
+                return msg.payload
+        return None
+
+    @asyncio.coroutine
+    def close(self, code=1000):
+        """
+        Performs the closing handshake
+        """
+        if self.closed:
+            return
+        self._writer.write(FrameBuilder.close(code))
+        self.closed = True
+        try:
+            while True:
+                msg = yield from self._parser.get_message()
+                if msg is None or msg.opcode == OpCode.close:
+                    break
+        except WebSocketFormatException:
+            pass
+        finally:
+            self._close_transport()
+
+    def _close_transport(self):
+        self.closed = True
+        self._writer.close()
+
+
+@asyncio.coroutine
+def connect(url, *, subprotocols=(), headers=(), max_message_size=None, loop=None):
+    """
+    Opens a WebSocket connection to a ws:// `url`, returns a WebSocketClient
+
+    Raises WebSocketHandshakeError when the server refuses the upgrade.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != 'ws':
+        raise ValueError("Only ws:// URLs are supported")
+    host = parts.hostname
+    port = parts.port or 80
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    reader, writer = yield from asyncio.open_connection(host, port, loop=loop)
+    key = b64encode(os.urandom(16))
+    lines = [
+        'GET {} HTTP/1.1'.format(path),
+        'Host: {}'.format(parts.netloc),
+        'Upgrade: websocket',
+        'Connection: Upgrade',
+        'Sec-WebSocket-Key: {}'.format(key.decode('ascii')),
+        'Sec-WebSocket-Version: 13',
+    ]
+    if subprotocols:
+        lines.append('Sec-WebSocket-Protocol: {}'.format(', '.join(subprotocols)))
+    lines.extend('{}: {}'.format(name, value) for name, value in headers)
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    try:
+        status = yield from reader.readline()
+        response_headers = {}
+        while True:
+            line = yield from reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        status_parts = status.split(None, 2)
+        if len(status_parts) < 2 or status_parts[1] != b'101':
+            raise WebSocketHandshakeError("Unexpected response: {!r}".format(status))
+        accept = b64encode(sha1(key + MAGIC).digest()).decode('ascii')
+        if response_headers.get('sec-websocket-accept') != accept:
+            raise WebSocketHandshakeError("Invalid Sec-WebSocket-Accept")
+    except:
+        writer.close()
+        raise
+    return WebSocketClient(reader, writer, subprotocol=response_headers.get('sec-websocket-protocol'),
+                           max_message_size=max_message_size)